@@ -40,7 +40,7 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 from magtogoek.adcp.rti_reader import RtiReader
-from magtogoek.adcp.tools import dday_to_datetime64
+from magtogoek.adcp.tools import datetime64_to_string, dday_to_datetime64
 from magtogoek.utils import Logger, get_files_from_expresion
 from nptyping import NDArray
 from pycurrents.adcp import rdiraw, transform
@@ -72,7 +72,12 @@ def load_adcp_binary(
     orientation: str = None,
     leading_index: int = None,
     trailing_index: int = None,
+    start_time: str = None,
+    end_time: str = None,
     sensor_depth: float = None,
+    rti_workers: int = None,
+    rti_chunk_size: int = None,
+    rti_drop_variables: tp.List[str] = None,
 ):
     """Load RDI and RTI adcp data.
 
@@ -98,8 +103,19 @@ def load_adcp_binary(
         FIXME
     trailing_index:
         FIXME
+    start_time:
+        Datetime of the first ensemble to load. For RTI files, only the ensembles
+        in the time window are decoded. The other sonars are sliced after loading.
+    end_time:
+        Datetime of the last ensemble to load. (see `start_time`)
     sensor_depth:
         If provided, will be used as a static sensor depth.
+    rti_workers:
+        Number of processes used to decode RTI ENS files.
+    rti_chunk_size:
+        Number of RTI ensembles decoded by a process at a time.
+    rti_drop_variables:
+        RTI variables not to decode: `amp`, `cor`, `pg`, `bt`, `nav`.
     Returns
     -------
         Dataset with the loaded adcp data
@@ -123,8 +139,16 @@ def load_adcp_binary(
     # ------------------------ #
     if sonar in RTI_SONAR:
         l.log(_fprint_filenames("RTI ENS", filenames))
-        data = RtiReader(filenames=filenames).read(
-            start_index=leading_index, stop_index=trailing_index
+        data = RtiReader(
+            filenames=filenames,
+            workers=rti_workers,
+            chunk_size=rti_chunk_size,
+            drop_variables=rti_drop_variables,
+        ).read(
+            start_index=leading_index,
+            stop_index=trailing_index,
+            start_time=start_time,
+            end_time=end_time,
         )
     elif sonar in RDI_SONAR:
         if sonar == "sw_pd0":
@@ -184,19 +208,15 @@ def load_adcp_binary(
         l.warning(
             f"The `dday` vector contains negative values. The time coords was replaced by a default datetime vector: len(dday) with a 1 second time step since {yearbase}-1-1 00:00:00"
         )
-        time, time_string = dday_to_datetime64(
-            np.arange(len(data.dday)) / (3600 * 24), yearbase
-        )
+        time = dday_to_datetime64(np.arange(len(data.dday)) / (3600 * 24), yearbase)
     elif (np.diff(data.dday) < 0).any():
         bad_dday = True
         l.warning(
             f"The `dday` vector is not monotonically increasing. The time coords was replaced by a default datetime vector: len(dday) with a 1 second time step since {yearbase}-1-1 00:00:00"
         )
-        time, time_string = dday_to_datetime64(
-            np.arange(len(data.dday)) / (3600 * 24), yearbase
-        )
+        time = dday_to_datetime64(np.arange(len(data.dday)) / (3600 * 24), yearbase)
     else:
-        time, time_string = dday_to_datetime64(data.dday, yearbase)
+        time = dday_to_datetime64(data.dday, yearbase)
 
     # ----------------------------------------------------------- #
     # Convert depth relative to the ADCP to depth below surface   #
@@ -375,7 +395,7 @@ def load_adcp_binary(
         ds["dday"] = (["time"], np.asarray(data.dday))
 
     else:
-        ds["time_string"] = (["time"], time_string)
+        ds["time_string"] = (["time"], datetime64_to_string(time))
 
     if orientation == "up":
         ds.sortby("depth")
@@ -476,7 +496,9 @@ def coordsystem2earth(data: tp.Type[Bunch], orientation: str):
 
     beam_pattern = "convex" if data.sysconfig["convex"] else "concave"
 
-    xyze, xyze_bt = data.vel.data, data.bt_vel.data
+    has_bt = "bt_vel" in data
+    xyze = data.vel.data
+    bt_xyze = data.bt_vel.data if has_bt else None
 
     if data.trans.coordsystem == "beam":
         if data.sysconfig.angle:
@@ -484,7 +506,8 @@ def coordsystem2earth(data: tp.Type[Bunch], orientation: str):
                 angle=data.sysconfig.angle, geometry=beam_pattern
             )
             xyze = trans.beam_to_xyz(data.vel.data)
-            bt_xyze = trans.beam_to_xyz(data.bt_vel.data)
+            if has_bt:
+                bt_xyze = trans.beam_to_xyz(data.bt_vel.data)
         else:
             print("Beam angle missing. Could not convert from beam coordinate.")
 
@@ -493,7 +516,8 @@ def coordsystem2earth(data: tp.Type[Bunch], orientation: str):
 
         for i in range(4):
             data.vel.data[:, :, i] = np.round(xyze[:, :, i], decimals=3)
-            data.bt_vel.data[:, i] = np.round(bt_xyze[:, i], decimals=3)
+            if has_bt:
+                data.bt_vel.data[:, i] = np.round(bt_xyze[:, i], decimals=3)
     else:
         enu = transform.rdi_xyz_enu(
             xyze,
@@ -502,18 +526,20 @@ def coordsystem2earth(data: tp.Type[Bunch], orientation: str):
             data.roll,
             orientation=orientation,
         )
-        bt_enu = transform.rdi_xyz_enu(
-            bt_xyze,
-            data.heading,
-            data.pitch,
-            data.roll,
-            orientation=orientation,
-        )
+        if has_bt:
+            bt_enu = transform.rdi_xyz_enu(
+                bt_xyze,
+                data.heading,
+                data.pitch,
+                data.roll,
+                orientation=orientation,
+            )
         data.trans["coordsystem"] = "earth"
 
         for i in range(4):
             data.vel.data[:, :, i] = np.round(enu[:, :, i], decimals=3)
-            data.bt_vel.data[:, i] = np.round(bt_enu[:, i], decimals=3)
+            if has_bt:
+                data.bt_vel.data[:, i] = np.round(bt_enu[:, i], decimals=3)
 
 
 def check_PD0_invalid_config(
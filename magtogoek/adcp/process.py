@@ -63,14 +63,18 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 from magtogoek.adcp.loader import load_adcp_binary
-from magtogoek.adcp.quality_control import (adcp_quality_control,
+from magtogoek.adcp.quality_control import (QC_TESTS_VARIABLE,
+                                            adcp_quality_control,
                                             no_adcp_quality_control)
 from magtogoek.adcp.tools import magnetic_to_true
 from magtogoek.attributes_formatter import (
     compute_global_attrs, format_variables_names_and_attributes)
+from magtogoek.checkpoint import (CheckpointError, checkpoint_key,
+                                  files_signature, load_checkpoint,
+                                  save_checkpoint)
 from magtogoek.navigation import load_navigation
-from magtogoek.tools import get_gps_bearing, vincenty
 from magtogoek.utils import Logger, json2dict
+from magtogoek.version import VERSION
 
 l = Logger(level=0)
 
@@ -191,6 +195,17 @@ QC_FILL_VALUE = 127
 
 DATA_DTYPE = "float32"
 
+# Parameters of the loading stage. (see _load_adcp_and_navigation_data)
+LOAD_CHECKPOINT_PARAMS = [
+    "yearbase",
+    "sonar",
+    "adcp_orientation",
+    "sensor_depth",
+    "leading_trim",
+    "trailing_trim",
+    "keep_bt",
+]
+
 _drop_none_attrs = False
 
 
@@ -328,17 +343,11 @@ def _process_adcp_data(params: tp.Dict, sensor_metadata: tp.Dict, global_attrs):
 
     _check_platform_type(sensor_metadata)
 
-    # ----------------- #
-    # LOADING ADCP DATA #
-    # ----------------- #
-    dataset = _load_adcp_data(params)
-
-    # ----------------------------------------- #
-    # ADDING THE NAVIGATION DATA TO THE DATASET #
-    # ----------------------------------------- #
-    if params["navigation_file"]:
-        l.section("Navigation data")
-        dataset = _load_navigation(dataset, params["navigation_file"])
+    # ---------------------------------------------------- #
+    # LOADING ADCP DATA AND ADDING THE NAVIGATION DATA     #
+    # (or resuming from the newest valid checkpoint)       #
+    # ---------------------------------------------------- #
+    dataset = _load_adcp_and_navigation_data(params)
 
     # ----------------------------- #
     # ADDING SOME GLOBAL ATTRIBUTES #
@@ -516,6 +525,62 @@ An additionnal correction of {additional_correction} degree east was added to ha
     # MAKE_FIG TODO
 
 
+def _load_adcp_and_navigation_data(params: tp.Dict) -> tp.Type[xr.Dataset]:
+    """Load the adcp data and add the navigation data.
+
+    If `checkpoint_dir` is given, the dataset is saved to a checkpoint after each
+    stage (`load`, `navigation`) and the next runs resume from the newest valid
+    checkpoint. A checkpoint is valid if the input files and the parameters of
+    its stage and of the previous ones did not change. (see magtogoek.checkpoint)
+    """
+    stages = ["load", "navigation"] if params["navigation_file"] else ["load"]
+    directory = params["checkpoint_dir"]
+
+    dataset, start = None, 0
+    if directory:
+        keys = _checkpoint_keys(params)
+        for count in reversed(range(len(stages))):
+            dataset = load_checkpoint(directory, stages[count], keys[stages[count]])
+            if dataset is not None:
+                l.log(f"Resumed from the `{stages[count]}` checkpoint in {directory}.")
+                start = count + 1
+                break
+
+    for stage in stages[start:]:
+        if stage == "load":
+            dataset = _load_adcp_data(params)
+        else:
+            l.section("Navigation data")
+            dataset = _load_navigation(
+                dataset, params["navigation_file"], params["navigation_workers"]
+            )
+        if directory:
+            try:
+                save_checkpoint(dataset, directory, stage, keys[stage])
+                l.log(f"`{stage}` checkpoint saved in {directory}.")
+            except CheckpointError as err:
+                l.warning(f"`{stage}` checkpoint not saved. {err}")
+
+    return dataset
+
+
+def _checkpoint_keys(params: tp.Dict) -> tp.Dict[str, str]:
+    """Key of the checkpoint of each stage. The key of a stage includes the key
+    of the previous stage."""
+    keys = dict()
+    keys["load"] = checkpoint_key(
+        version=VERSION,
+        files=files_signature(params["input_files"]),
+        rti_drop_variables=_get_rti_drop_variables(params),
+        **{param: params[param] for param in LOAD_CHECKPOINT_PARAMS},
+    )
+    if params["navigation_file"]:
+        keys["navigation"] = checkpoint_key(
+            load=keys["load"], files=files_signature(params["navigation_file"])
+        )
+    return keys
+
+
 def _load_adcp_data(params: tp.Dict) -> tp.Type[xr.Dataset]:
     """
     Load and trim the adcp data into a xarray.Dataset.
@@ -530,8 +595,13 @@ def _load_adcp_data(params: tp.Dict) -> tp.Type[xr.Dataset]:
         sonar=params["sonar"],
         leading_index=leading_index,
         trailing_index=trailing_index,
+        start_time=start_time,
+        end_time=end_time,
         orientation=params["adcp_orientation"],
         sensor_depth=params["sensor_depth"],
+        rti_workers=params["rti_workers"],
+        rti_chunk_size=params["rti_chunk_size"],
+        rti_drop_variables=_get_rti_drop_variables(params),
     )
 
     dataset = dataset.sel(time=slice(start_time, end_time))
@@ -554,6 +624,34 @@ def _load_adcp_data(params: tp.Dict) -> tp.Type[xr.Dataset]:
     return dataset
 
 
+def _get_rti_drop_variables(params: tp.Dict) -> tp.List[str]:
+    """Get the variables that don't need to be read from the RTI files.
+
+    Amplitude, correlation and percent good are not read if they are dropped
+    from the output and not used by the quality control. Bottom track is
+    not read if it is discarded and not used for the motion correction or
+    the sidelobes correction.
+    """
+    quality_control = params["quality_control"]
+    drop_variables = []
+    for var, name, threshold in [
+        ("amp", "amplitude", "amplitude_threshold"),
+        ("cor", "correlation", "correlation_threshold"),
+        ("pg", "percent_good", "percentgood_threshold"),
+    ]:
+        if params[f"drop_{name}"] and not (quality_control and params[threshold]):
+            drop_variables.append(var)
+
+    bt_needed = params["keep_bt"]
+    if quality_control:
+        bt_needed |= params["motion_correction_mode"] == "bt"
+        bt_needed |= params["sidelobes_correction"] and not params["bottom_depth"]
+    if not bt_needed:
+        drop_variables.append("bt")
+
+    return drop_variables
+
+
 def _get_config(config: tp.Type[ConfigParser]):
     """Flattens the config to a unested_dict""" ""
     params = dict()
@@ -621,7 +719,9 @@ _check_platform_type.__doc__ = f"""Check the validity of the `plaform_type`.
     `platform_type` defaults to {DEFAULT_PLATFORM_TYPE}"""
 
 
-def _load_navigation(dataset: tp.Type[xr.Dataset], navigation_files: str):
+def _load_navigation(
+    dataset: tp.Type[xr.Dataset], navigation_files: str, workers: int = None
+):
     """Load navigation data from nmea, gpx or netcdf files.
 
     Returns the dataset with the added navigation data. Data from the navigation file
@@ -636,12 +736,17 @@ def _load_navigation(dataset: tp.Type[xr.Dataset], navigation_files: str):
         nmea(ascii), gpx(xml) or netcdf files containing the navigation data. For the
         netcdf file, variable must be `lon`, `lat` and the coordinates `time`.
 
+    workers :
+        Number of processes parsing the nmea files. Defaults to 1.
+
     Notes
     -----
         Using the magtogoek function `mtgk compute nav`, u_ship, v_ship can be computed from `lon`, `lat`
     data to correct the data for the platform motion by setting the config parameter `m_corr` to `nav`.
     """
-    nav_ds = load_navigation(navigation_files).interp(time=dataset.time)
+    nav_ds = load_navigation(navigation_files, workers=workers or 1).interp(
+        time=dataset.time
+    )
     dataset = xr.merge((dataset, nav_ds), combine_attrs="no_conflicts")
     return dataset
 
@@ -664,6 +769,7 @@ def _quality_control(dataset: tp.Type[xr.Dataset], params: tp.Dict):
         motion_correction_mode=params["motion_correction_mode"],
         sidelobes_correction=params["sidelobes_correction"],
         bottom_depth=params["bottom_depth"],
+        keep_qc_tests=params["keep_qc_tests"],
     )
 
 
@@ -753,6 +859,8 @@ def _format_data_encoding(dataset: tp.Type[xr.Dataset]):
             dataset[var].encoding = {
                 "dtype": "S1",
             }
+        elif var == QC_TESTS_VARIABLE:
+            dataset[var].encoding = {"dtype": "uint16"}
         else:
             dataset[var].encoding = {"dtype": DATA_DTYPE, "_FillValue": DATA_FILL_VALUE}
 
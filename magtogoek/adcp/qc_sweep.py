@@ -0,0 +1,377 @@
+"""
+Sweep of the velocity quality control thresholds.
+
+The statistic tested by each velocity test (e.g. the largest beam amplitude, the
+horizontal velocity) is computed once, in a single pass over blocks of time, and
+binned against the thresholds to sweep. The joint histogram of the bins, per
+depth, then gives the fraction of flagged values of every thresholds
+combination (combined tests included) without testing the data again.
+
+The tests not swept (missing velocities, sidelobes, pressure) are fixed and
+their failed values are counted as flagged for all the combinations.
+
+Usage:
+sweep = QCSweep(dataset, dict(amplitude=[20, 30, 40], horizontal_velocity=[2, 3]))
+sweep.flagged_fraction(amplitude=30, horizontal_velocity=2)  # (depth,)
+sweep.flagged_fraction(amplitude=30)  # horizontal_velocity test not carried out.
+sweep.table()  # pandas.DataFrame, one row per combination.
+sweep.plot("amplitude", horizontal_velocity=2)  # depth by thresholds heatmap.
+
+qc_sweep(input_file, thresholds) does the same from a netcdf file (see `mtgk qc-sweep`).
+"""
+import itertools
+import typing as tp
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from magtogoek.adcp.quality_control import (
+    IMPLAUSIBLE_VEL_TRESHOLD,
+    QC_BLOCK_SIZE,
+    _implausible_vel,
+    _read_block,
+    circular_mean,
+    motion_offsets,
+    pressure_test,
+    sidelobe_cutoff,
+    time_blocks,
+)
+from magtogoek.tools import circular_distance
+from magtogoek.utils import Logger
+
+l = Logger(level=0)
+
+# Tests that can be swept. The values fail when their statistic is `<` or `>` than
+# the threshold. (see adcp_quality_control)
+SWEEP_TESTS = dict(
+    amplitude="<",
+    correlation="<",
+    percentgood="<",
+    horizontal_velocity=">",
+    vertical_velocity=">",
+    error_velocity=">",
+    roll=">",
+    pitch=">",
+)
+MAX_HISTOGRAM_SIZE = 2 ** 26  # Bins of the joint histogram.
+
+
+class QCSweepError(Exception):
+    pass
+
+
+class QCSweep:
+    """Fraction of flagged velocities per depth for a grid of QC thresholds.
+
+    Attributes
+    ----------
+    thresholds :
+        {test: sorted thresholds} swept.
+    total :
+        (depth,) Number of values per depth.
+    passed :
+        (depth, n_1 + 1, n_2 + 1, ...) Number of values passing all the tests. On
+        the axis of each test, index 0 is the test not carried out and index i + 1
+        is the threshold thresholds[test][i].
+    """
+
+    def __init__(
+        self,
+        dataset: tp.Type[xr.Dataset],
+        thresholds: tp.Dict[str, tp.List[float]],
+        motion_correction_mode: str = None,
+        sidelobes_correction: bool = False,
+        bottom_depth: float = None,
+        block_size: int = QC_BLOCK_SIZE,
+    ):
+        """
+        Parameters
+        ----------
+        dataset :
+            ADCP dataset with the generic variable names. Can be lazily loaded.
+        thresholds :
+            {test: thresholds}. The tests are the keys of SWEEP_TESTS.
+        motion_correction_mode, sidelobes_correction, bottom_depth :
+            Fixed parameters. See adcp_quality_control.
+        block_size :
+            Number of time read at once.
+        """
+        for test in thresholds:
+            if test not in SWEEP_TESTS:
+                raise QCSweepError(
+                    f"{test} can't be swept. Tests: {', '.join(SWEEP_TESTS)}."
+                )
+        self.thresholds = {
+            test: np.unique(np.asarray(values, dtype=float))
+            for test, values in thresholds.items()
+            if len(values) > 0
+        }
+        self.depth = dataset.depth.values
+
+        shape = (self.depth.size,) + tuple(v.size + 1 for v in self.thresholds.values())
+        if np.prod(shape) > MAX_HISTOGRAM_SIZE:
+            raise QCSweepError(
+                f"Too many thresholds combinations ({np.prod(shape[1:])}). "
+                f"Sweep fewer tests or thresholds."
+            )
+
+        statistics = _profile_statistics(dataset, self.thresholds, block_size)
+        fixed = _fixed_tests(dataset, sidelobes_correction, bottom_depth)
+        offsets = dict()
+        if motion_correction_mode:
+            offsets = motion_offsets(dataset, motion_correction_mode)
+
+        counts = np.zeros(int(np.prod(shape)), dtype=np.int64)
+        strides = np.cumprod((1,) + shape[:0:-1])[::-1]
+        bins = np.arange(self.depth.size)[:, np.newaxis]
+        for block in time_blocks(dataset.time.size, block_size):
+            velocities = _block_velocities(dataset, block, offsets)
+            failed = _implausible_vel(*velocities, IMPLAUSIBLE_VEL_TRESHOLD)
+            for fixed_test in fixed.values():
+                failed |= fixed_test(block)
+
+            index = bins * strides[0]
+            for test, stride in zip(self.thresholds, strides[1:]):
+                if test in statistics:
+                    values = statistics[test][block]
+                else:
+                    values = _block_statistic(dataset, test, block, velocities)
+                grid = self.thresholds[test]
+                if test == "horizontal_velocity":
+                    grid = grid ** 2  # Compared as in velocity_qc_tests.
+                index = index + stride * _threshold_bins(values, grid, SWEEP_TESTS[test])
+            index = np.broadcast_to(index, failed.shape)
+            counts += np.bincount(index[~failed], minlength=counts.size)
+
+        self.total = np.full(self.depth.size, dataset.time.size)
+        self.passed = _cumulative_passed(
+            counts.reshape(shape), [SWEEP_TESTS[t] for t in self.thresholds]
+        )
+
+    def flagged_fraction(self, **thresholds: float) -> np.ndarray:
+        """(depth,) Fraction of the values flagged with `thresholds`.
+
+        The swept tests missing from `thresholds` (or None) are not carried out.
+        The thresholds must be values of the sweep.
+        """
+        for test in thresholds:
+            if test not in self.thresholds:
+                raise QCSweepError(f"{test} was not swept.")
+        index = tuple(
+            self._threshold_index(test, thresholds.get(test))
+            for test in self.thresholds
+        )
+        return 1 - self.passed[(slice(None),) + index] / self.total
+
+    def _threshold_index(self, test: str, threshold: float) -> int:
+        if threshold is None:
+            return 0
+        index = np.flatnonzero(self.thresholds[test] == threshold)
+        if index.size == 0:
+            raise QCSweepError(
+                f"{threshold} is not a swept threshold of {test}: {self.thresholds[test]}"
+            )
+        return index[0] + 1
+
+    def fractions(self) -> np.ndarray:
+        """(depth, n_1 + 1, ...) Fraction of flagged values of all the combinations.
+        See `passed`."""
+        return 1 - self.passed / self.total.reshape((-1,) + (1,) * len(self.thresholds))
+
+    def table(self) -> pd.DataFrame:
+        """Flagged percentage of every thresholds combination.
+
+        One row per combination, with the mean over depth, the largest and the
+        bin where it is found. NaN thresholds are tests not carried out.
+        """
+        fractions = self.fractions()
+        rows = []
+        for index in itertools.product(*(range(n) for n in fractions.shape[1:])):
+            fraction = fractions[(slice(None),) + index]
+            row = {
+                test: self.thresholds[test][i - 1] if i else np.nan
+                for test, i in zip(self.thresholds, index)
+            }
+            row["mean_flagged_%"] = 100 * fraction.mean()
+            row["max_flagged_%"] = 100 * fraction.max()
+            row["max_depth"] = self.depth[fraction.argmax()]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def plot(self, test: str, **thresholds: float):
+        """Heatmap of the flagged percentage per depth and threshold of `test`.
+        The other tests are set with `thresholds`."""
+        import matplotlib.pyplot as plt
+
+        if test not in self.thresholds:
+            raise QCSweepError(f"{test} was not swept.")
+        fractions = np.stack(
+            [
+                self.flagged_fraction(**{**thresholds, test: threshold})
+                for threshold in self.thresholds[test]
+            ],
+            axis=1,
+        )
+        fig, ax = plt.subplots(figsize=(8, 6))
+        mesh = ax.pcolormesh(
+            np.arange(self.thresholds[test].size),
+            self.depth,
+            100 * fractions,
+            shading="nearest",
+            cmap="viridis",
+        )
+        ax.set_xticks(np.arange(self.thresholds[test].size))
+        ax.set_xticklabels([f"{t:g}" for t in self.thresholds[test]])
+        ax.set_xlabel(f"{test} threshold")
+        ax.set_ylabel("depth")
+        ax.invert_yaxis()
+        if thresholds:
+            ax.set_title(", ".join(f"{k}: {v}" for k, v in thresholds.items()))
+        fig.colorbar(mesh, ax=ax, label="flagged %")
+        return fig
+
+
+def qc_sweep(
+    input_file: str,
+    thresholds: tp.Dict[str, tp.List[float]],
+    output: str = None,
+    plot: bool = False,
+    **kwargs,
+) -> QCSweep:
+    """Sweep the thresholds of a netcdf file and print the table of the flagged
+    percentages.
+
+    Parameters
+    ----------
+    input_file :
+        Netcdf file with the generic variable names (u, v, w, e, amp1, ...) of
+        data not quality controlled. (e.g. `mtgk process` with `quality_control`
+        and `bodc_name` False)
+    output :
+        The table is also written to this `.csv` file.
+    plot :
+        Plot a heatmap for each swept test. The other tests are not carried out.
+    kwargs :
+        Fixed parameters of QCSweep.
+    """
+    sweep = QCSweep(xr.open_dataset(input_file), thresholds, **kwargs)
+    table = sweep.table()
+    print(table.to_string(index=False, float_format="{:g}".format))
+    if output:
+        table.to_csv(output, index=False)
+        l.log(f"Sweep table written to {output}.")
+    if plot:
+        import matplotlib.pyplot as plt
+
+        for test in sweep.thresholds:
+            sweep.plot(test)
+        plt.show()
+    return sweep
+
+
+def _threshold_bins(values: np.ndarray, thresholds: np.ndarray, fails: str) -> np.ndarray:
+    """Index of the bins of `values` between the sorted thresholds.
+
+    With `<` the values of bins larger than i pass thresholds[i] and with `>`,
+    the values of bins smaller or equal to i. NaN values never fail.
+    """
+    if fails == "<":
+        return np.searchsorted(thresholds, np.nan_to_num(values, nan=np.inf), "right")
+    return np.searchsorted(thresholds, np.nan_to_num(values, nan=-np.inf), "left")
+
+
+def _cumulative_passed(counts: np.ndarray, fails: tp.List[str]) -> np.ndarray:
+    """Number of values passing the tests for all the combinations of thresholds.
+
+    Along each test axis, the counts of the n + 1 bins are replaced by the
+    number of values passing: index 0, the test not carried out, and index i + 1
+    the threshold i.
+    """
+    for axis, fail in enumerate(fails, start=1):
+        counts = np.moveaxis(counts, axis, -1)
+        cumulative = np.cumsum(counts, axis=-1)
+        passed = np.empty_like(counts)
+        passed[..., 0] = cumulative[..., -1]
+        if fail == "<":
+            passed[..., 1:] = cumulative[..., -1:] - cumulative[..., :-1]
+        else:
+            passed[..., 1:] = cumulative[..., :-1]
+        counts = np.moveaxis(passed, -1, axis)
+    return counts
+
+
+def _profile_statistics(
+    dataset: tp.Type[xr.Dataset],
+    thresholds: tp.Dict[str, np.ndarray],
+    block_size: int,
+) -> tp.Dict[str, np.ndarray]:
+    """(time,) statistics of the roll and pitch tests: distance from the mean."""
+    statistics = dict()
+    for test, var in (("roll", "roll_"), ("pitch", "pitch")):
+        if test not in thresholds:
+            continue
+        if var in dataset:
+            mean = circular_mean(dataset, var, block_size)
+            statistics[test] = circular_distance(dataset[var].values, mean, units="deg")
+        else:
+            l.warning(f"{test.capitalize()} test not swept. Missing {test} data.")
+            statistics[test] = np.full(dataset.time.shape, np.nan)
+    return statistics
+
+
+def _block_statistic(
+    dataset: tp.Type[xr.Dataset],
+    test: str,
+    block: slice,
+    velocities: tp.Tuple[np.ndarray, np.ndarray, np.ndarray],
+) -> np.ndarray:
+    """(depth, block) statistic of a velocity test.
+
+    The beam tests fail when all the beams are below the threshold: their
+    largest value. The horizontal velocity statistic is `u ** 2 + v ** 2`.
+    """
+    beams = dict(
+        amplitude=[f"amp{i}" for i in range(1, 5)],
+        correlation=[f"corr{i}" for i in range(1, 5)],
+        percentgood=["pg"],
+        error_velocity=["e"],
+    ).get(test)
+    if beams is None:
+        u, v, w = velocities
+        return u ** 2 + v ** 2 if test == "horizontal_velocity" else np.abs(w)
+
+    if not all(v in dataset for v in beams):
+        l.warning(f"{test.capitalize()} test not swept. Missing one or more data.")
+        return np.full(velocities[0].shape, np.nan)
+    values = _read_block(dataset, beams[0], block)
+    for beam in beams[1:]:
+        values = np.maximum(values, _read_block(dataset, beam, block))
+    return np.abs(values) if test == "error_velocity" else values
+
+
+def _block_velocities(
+    dataset: tp.Type[xr.Dataset], block: slice, offsets: tp.Dict[str, np.ndarray]
+) -> tp.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Motion corrected u, v, w of a block. (see velocity_qc_tests)"""
+    return tuple(
+        _read_block(dataset, var, block) + offsets[var][block]
+        if var in offsets
+        else _read_block(dataset, var, block)
+        for var in ("u", "v", "w")
+    )
+
+
+def _fixed_tests(
+    dataset: tp.Type[xr.Dataset], sidelobes_correction: bool, bottom_depth: float
+) -> tp.Dict[str, tp.Callable[[slice], np.ndarray]]:
+    """Tests not swept: {test: function of a block returning its failed values}."""
+    fixed = dict()
+    if sidelobes_correction:
+        cutoff = sidelobe_cutoff(dataset, bottom_depth)
+        if cutoff is not False:
+            ranks, cutoff = cutoff
+            fixed["sidelobes"] = lambda block: ranks >= cutoff[block]
+    if "pres" in dataset:
+        pressure = pressure_test(dataset)
+        fixed["pressure"] = lambda block: pressure[block]
+    return fixed
@@ -46,12 +46,12 @@ IML flags meaning : (Basicaly the same)
 import typing as tp
 from pathlib import Path
 
+import netCDF4
 import numpy as np
 import xarray as xr
 from magtogoek.tools import circular_distance
 from magtogoek.utils import Logger
 from pandas import Timestamp
-from scipy.stats import circmean
 
 # Brand dependent quality control defaults
 #    rti_qc_defaults = dict(amp_th=20)
@@ -59,6 +59,7 @@ from scipy.stats import circmean
 
 
 IMPLAUSIBLE_VEL_TRESHOLD = 15  # meter per second
+QC_BLOCK_SIZE = 2 ** 12  # time steps evaluated at once by the velocity tests.
 MIN_TEMPERATURE = -2  # Celcius
 MAX_TEMPERATURE = 32  # Celcius
 MIN_PRESSURE = 0  # dbar
@@ -80,6 +81,25 @@ FLAG_MEANINGS = (
     "missing_value",
 )
 
+# Velocity tests recorded in the bits of `vel_qc_tests` (bit i: QC_TESTS[i]) and the
+# flag of the values failing them. The highest flag of the failed tests is kept.
+QC_TESTS = (
+    "amplitude",
+    "correlation",
+    "percentgood",
+    "horizontal_velocity",
+    "vertical_velocity",
+    "error_velocity",
+    "roll",
+    "pitch",
+    "sidelobes",
+    "pressure",
+    "missing",
+)
+QC_TESTS_BITS = {test: 1 << i for i, test in enumerate(QC_TESTS)}
+QC_TESTS_FLAGS = dict(sidelobes=4, pressure=4, missing=9)  # Others are 3.
+QC_TESTS_VARIABLE = "vel_qc_tests"
+
 
 def no_adcp_quality_control(dataset):
     """Adds var_QC ancillary variables to dataset with value 0.
@@ -122,12 +142,27 @@ def adcp_quality_control(
     motion_correction_mode: float = None,
     sidelobes_correction: bool = False,
     bottom_depth: float = None,
+    keep_qc_tests: bool = False,
+    block_size: int = QC_BLOCK_SIZE,
+    apply_corrections: bool = True,
 ) -> tp.Type[xr.Dataset]:
     """
     Perform ADCP quality control.
 
     This was adaptated from jeanlucshaw adcp2nc package.
 
+    The velocity tests are evaluated in a single pass over blocks of time (see
+    velocity_qc_tests). The failed tests are recorded as bits of a uint16 array
+    from which the velocity flags are derived.
+
+    The dataset can be lazily loaded (e.g. `xr.open_dataset`). Only a block of
+    `block_size` time of the (depth, time) variables is read at a time; the
+    global quantities (roll and pitch circular means) are computed in a first
+    pass over the blocks. The motion correction and the implausible velocities
+    (NaN) are then applied to u, v, w by blocks (see correct_velocities). To
+    quality control a file without loading it, use quality_control_netcdf or
+    `mtgk qc`.
+
     Parameters
     ----------
     dataset :
@@ -157,6 +192,14 @@ def adcp_quality_control(
         contamination. Set to either "dep" or "bt" or None.
     bottom_depth :
         If not `None`, this depth used for removing side lobe contamination.
+    keep_qc_tests :
+        If True, the bit field of the failed velocity tests is added to the dataset
+        as `vel_qc_tests`.
+    block_size :
+        Number of time read and tested at once.
+    apply_corrections :
+        If False, u, v, w are not modified (nor loaded): the motion correction and
+        the NaN of the missing values are left to the caller. (see correct_velocities)
     beam_angle :
         Force a beam angle configuration and overwrite the value in dataset.
     xducer_depth :
@@ -194,68 +237,55 @@ def adcp_quality_control(
     l.reset()
     l.section("Quality Control")
 
+    offsets = dict()
     if motion_correction_mode:
-        motion_correction(dataset, motion_correction_mode)
-
-    set_implausible_vel_to_nan(dataset, thres=IMPLAUSIBLE_VEL_TRESHOLD)
-
-    vel_flags = np.ones(dataset.depth.shape + dataset.time.shape).astype(int)
+        offsets = motion_offsets(dataset, motion_correction_mode)
 
     vel_qc_test = []
 
     if amp_th:
         l.log(f"amplitude threshold {amp_th}")
-        amp_flag = amplitude_test(dataset, amp_th)
-        vel_flags[amp_flag] = 3
         vel_qc_test.append(f"amplitude_threshold:{amp_th}")
 
     if corr_th:
         l.log(f"correlation threshold {corr_th}")
-        corr_flag = correlation_test(dataset, corr_th)
-        vel_flags[corr_flag] = 3
         vel_qc_test.append(f"correlation_threshold:{corr_th}")
 
     if pg_th:
         l.log(f"percentgood threshold {pg_th}")
-        pg_flag = percentgood_test(dataset, pg_th)
-        vel_flags[pg_flag] = 3
         vel_qc_test.append(f"percentgood_threshold:{pg_th}")
 
     if horizontal_vel_th:
         l.log(f"horizontal velocity threshold {horizontal_vel_th} m/s")
-        horizontal_vel_flag = horizontal_vel_test(dataset, horizontal_vel_th)
-        vel_flags[horizontal_vel_flag] = 3
         vel_qc_test.append(f"horizontal_velocity_threshold:{horizontal_vel_th} m/s")
 
     if vertical_vel_th:
         l.log(f"vertical velocity threshold {vertical_vel_th} m/s")
-        vertical_vel_flag = vertical_vel_test(dataset, vertical_vel_th)
-        vel_flags[vertical_vel_flag] = 3
         vel_qc_test.append(f"vertical_velocity_threshold:{vertical_vel_th} m/s")
 
     if error_vel_th:
         l.log(f"error velocity threshold {error_vel_th} m/s")
-        error_vel_flag = error_vel_test(dataset, error_vel_th)
-        vel_flags[error_vel_flag] = 3
         vel_qc_test.append(f"velocity_error_threshold:{error_vel_th} m/s")
 
+    profile_tests = dict()
+
     if roll_th:
         l.log(f"roll threshold {roll_th} degree")
-        roll_flag = np.tile(roll_test(dataset, roll_th), dataset.depth.shape + (1,))
-        vel_flags[roll_flag] = 3
+        profile_tests["roll"] = roll_test(dataset, roll_th, block_size)
         vel_qc_test.append(f"roll_threshold:{roll_th} degree")
 
     if pitch_th:
         l.log(f"pitch threshold {pitch_th} degree")
-        pitch_flag = np.tile(pitch_test(dataset, pitch_th), dataset.depth.shape + (1,))
-        vel_flags[pitch_flag] = 3
+        profile_tests["pitch"] = pitch_test(dataset, pitch_th, block_size)
         vel_qc_test.append(f"pitch_threshold:{pitch_th} degree")
 
+    cutoff_tests = dict()
+
     if sidelobes_correction:
-        sidelobe_flag = sidelobe_test(dataset, bottom_depth)
-        if sidelobe_flag:
+        sidelobe_flag = sidelobe_cutoff(dataset, bottom_depth)
+        if sidelobe_flag is not False:
             l.log(f"Sidelobe correction carried out.")
-            vel_flags[sidelobe_flag] = 4
+            cutoff_tests["sidelobes"] = sidelobe_flag
             vel_qc_test.append("sidelobes")
 
     if "pres" in dataset:
@@ -264,12 +294,30 @@ def adcp_quality_control(
         pressure_flags = pressure_test(dataset)
         pressure_QC[pressure_flags] = 4
         dataset["pres_QC"] = (["time"], pressure_QC)
-        vel_flags[np.tile(pressure_flags, dataset.depth.shape + (1,))] = 4
+        profile_tests["pressure"] = pressure_flags
         dataset["pres_QC"].attrs[
             "quality_test"
         ] = f"presssure_threshold: less than {MIN_PRESSURE} dbar and greater than {MAX_PRESSURE} dbar"
         vel_qc_test.append(dataset["pres_QC"].attrs["quality_test"])
 
+    vel_tests = velocity_qc_tests(
+        dataset,
+        amp_th=amp_th,
+        corr_th=corr_th,
+        pg_th=pg_th,
+        horizontal_vel_th=horizontal_vel_th,
+        vertical_vel_th=vertical_vel_th,
+        error_vel_th=error_vel_th,
+        profile_tests=profile_tests,
+        cutoff_tests=cutoff_tests,
+        offsets=offsets,
+        block_size=block_size,
+    )
+    vel_flags = qc_tests_to_flags(vel_tests)
+
+    if apply_corrections:
+        correct_velocities(dataset, offsets, vel_flags, block_size)
+
     if "temperature" in dataset:
         l.log(f"Good temperature range {MIN_TEMPERATURE} to {MAX_TEMPERATURE} celsius")
         temperature_QC = np.ones(dataset.temperature.shape)
@@ -286,7 +334,7 @@ def adcp_quality_control(
             + f", percentgood_threshold: {pg_th}" * ("vb_pg" in dataset)
             + "."
         )
-        vb_flag = vertical_beam_test(dataset, amp_th, corr_th, pg_th)
+        vb_flag = vertical_beam_test(dataset, amp_th, corr_th, pg_th, block_size)
         dataset["vb_vel_QC"] = (["depth", "time"], vb_flag * 3)
         dataset["vb_vel_QC"].attrs["quality_test"] = (
             f"amplitude_threshold: {amp_th}\n" * ("vb_amp" in dataset)
@@ -294,15 +342,19 @@ def adcp_quality_control(
             + f"percentgood_threshold: {pg_th}\n" * ("vb_pg" in dataset)
         )
 
-    missing_vel = np.bitwise_or(
-        *(~np.isfinite(dataset[v]).data for v in ("u", "v", "w"))
-    )
-    vel_flags[missing_vel] = 9
-
     for v in ("u", "v", "w"):
         dataset[v + "_QC"] = (["depth", "time"], vel_flags)
         dataset[v + "_QC"].attrs["quality_test"] = "\n".join(vel_qc_test)
 
+    if keep_qc_tests:
+        dataset[QC_TESTS_VARIABLE] = (["depth", "time"], vel_tests)
+        dataset[QC_TESTS_VARIABLE].attrs.update(
+            long_name="Failed velocity quality control tests",
+            flag_masks=np.array([QC_TESTS_BITS[t] for t in QC_TESTS], dtype=np.uint16),
+            flag_meanings=" ".join(QC_TESTS),
+            comment="Bit field of the failed tests. The u, v, w flags are derived from it.",
+        )
+
     for var in list(dataset.variables):
         if "_QC" in var:
             dataset[var].attrs["quality_date"] = Timestamp.now().strftime("%Y-%m-%d")
@@ -319,16 +371,106 @@ def adcp_quality_control(
     dataset.attrs["flags_meanings"] = FLAG_MEANINGS
 
 
-def motion_correction(dataset: tp.Type[xr.Dataset], mode: str):
-    """Carry motion correction on velocities.
+def quality_control_netcdf(
+    input_file: str, output_file: str, block_size: int = QC_BLOCK_SIZE, **kwargs
+):
+    """Quality control a netcdf file without loading it in memory.
+
+    The dataset is lazily loaded and quality controlled by blocks of time (see
+    adcp_quality_control). The variables are then copied to `output_file`, one
+    block of time at a time, with the corrected velocities and the QC variables.
+    The velocities must have the generic names `u`, `v`, `w`.
+
+    Parameters
+    ----------
+    block_size :
+        Number of time read at once.
+    kwargs :
+        Parameters of adcp_quality_control.
+    """
+    with xr.open_dataset(input_file) as dataset:
+        adcp_quality_control(
+            dataset, block_size=block_size, apply_corrections=False, **kwargs
+        )
+        offsets = dict()
+        if kwargs.get("motion_correction_mode"):
+            level, l.level = l.level, 2  # Already logged.
+            offsets = motion_offsets(dataset, kwargs["motion_correction_mode"])
+            l.level = level
+        _write_quality_controlled(input_file, output_file, dataset, offsets, block_size)
+
+    l.log(f"Quality controlled data written to {output_file}.")
+
+
+def _write_quality_controlled(
+    input_file: str,
+    output_file: str,
+    dataset: tp.Type[xr.Dataset],
+    offsets: tp.Dict[str, np.ndarray],
+    block_size: int,
+):
+    """Copy `input_file` to `output_file` by blocks of time, with the corrected
+    velocities and the QC variables (and attributes) of the quality controlled
+    `dataset`."""
+    vel_flags = dataset["u_QC"].values
+    with netCDF4.Dataset(input_file) as src, netCDF4.Dataset(output_file, "w") as dst:
+        dst.setncatts({k: _netcdf_attr(v) for k, v in dataset.attrs.items()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            attrs = var.__dict__.copy()
+            out = dst.createVariable(
+                name, var.datatype, var.dimensions, fill_value=attrs.pop("_FillValue", None)
+            )
+            out.setncatts(attrs)
+            corrected = name in ("u", "v", "w")
+            var.set_auto_maskandscale(corrected)
+            out.set_auto_maskandscale(corrected)
+            if "time" not in var.dimensions:
+                out[...] = var[...]
+                continue
+            axis = var.dimensions.index("time")
+            for block in time_blocks(var.shape[axis], block_size):
+                index = (slice(None),) * axis + (block,)
+                values = var[index]
+                if corrected:
+                    values = np.ma.filled(values.astype(float), np.nan)
+                    _correct_velocity(values, name, block, offsets, vel_flags)
+                    values = np.ma.masked_invalid(values)
+                out[index] = values
+
+        for name in dataset.variables:
+            if name in src.variables:
+                continue
+            variable = dataset[name].variable
+            out = dst.createVariable(name, variable.dtype, variable.dims)
+            out.setncatts({k: _netcdf_attr(v) for k, v in variable.attrs.items()})
+            out[...] = variable.values
+
+
+def _netcdf_attr(value):
+    """Format an attribute value for netCDF4."""
+    if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+        return " ".join(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+
+def motion_offsets(dataset: tp.Type[xr.Dataset], mode: str) -> tp.Dict[str, np.ndarray]:
+    """Return the (time,) motion corrections to add to the velocities.
 
     If mode is 'bt' the motion correction is along x, y, z.
     If mode is 'nav' the motion correction is along x, y.
     """
+    offsets = dict()
     if mode == "bt":
         if all(f"bt_{v}" in dataset for v in ["u", "v", "w"]):
             for field in ["u", "v", "w"]:
-                dataset[field] -= dataset[f"bt_{field}"].values
+                offsets[field] = -dataset[f"bt_{field}"].values
             l.log("Motion correction carried out with bottom track")
         else:
             l.warning(
@@ -337,12 +479,10 @@ def motion_correction(dataset: tp.Type[xr.Dataset], mode: str):
     elif mode == "nav":
         if all(f"{v}_ship" in dataset for v in ["u", "v"]):
             for field in ["u", "v"]:
-                dataset[field] += np.tile(
-                    dataset[field + "_ship"].where(np.isfinite(dataset.lon.values), 0),
-                    (dataset.depth.size, 1),
-                )
-                dataset[f"{field}ship"].values = dataset[field].values
-                l.log("Motion correction carried out with navigation")
+                offsets[field] = (
+                    dataset[field + "_ship"].where(np.isfinite(dataset.lon.values), 0)
+                ).values
+            l.log("Motion correction carried out with navigation")
         else:
             l.warning(
                 "Motion correction aborded. Navigation velocity (u_ship, v_ship) missing"
@@ -351,144 +491,256 @@ def motion_correction(dataset: tp.Type[xr.Dataset], mode: str):
         l.warning(
             "Motion correction aborded. Motion correction mode invalid. ('bt' or 'nav')"
         )
+    return offsets
 
 
-def set_implausible_vel_to_nan(dataset: tp.Type[xr.Dataset], thres: float = 15):
-    """Set bin with improbable values to Nan."""
-    for v in ["u", "v", "w"]:
-        plausible = (dataset[v] > -thres) & (dataset[v] < thres)
-        dataset["u"] = dataset["u"].where(plausible)
-        dataset["v"] = dataset["v"].where(plausible)
-        dataset["w"] = dataset["w"].where(plausible)
-        # flag 4: bad values ? now missing ?
+def correct_velocities(
+    dataset: tp.Type[xr.Dataset],
+    offsets: tp.Dict[str, np.ndarray],
+    vel_flags: np.ndarray,
+    block_size: int = QC_BLOCK_SIZE,
+):
+    """Add the motion `offsets` to u, v, w and set the missing values (flag 9) to NaN.
+
+    The velocities are read, corrected and written back one block of time at a
+    time; in place if they are in memory. The corrected values of lazily loaded
+    velocities are kept in memory (not in the file). To correct a file without
+    loading the velocities, use quality_control_netcdf.
+    """
+    for var in ("u", "v", "w"):
+        variable = dataset[var].variable
+        for block in time_blocks(variable.shape[-1], block_size):
+            values = _read_block(dataset, var, block)
+            variable[..., block] = _correct_velocity(values, var, block, offsets, vel_flags)
 
 
-def correlation_test(dataset, threshold):
-    """FIXME
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-
-    if all(f"corr{i}" in dataset for i in range(1, 5)):
-        return (
-            (dataset.corr1 < threshold)
-            & (dataset.corr2 < threshold)
-            & (dataset.corr3 < threshold)
-            & (dataset.corr4 < threshold)
-        ).data
-    else:
-        l.warnings("Correlation test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+def _correct_velocity(
+    values: np.ndarray,
+    var: str,
+    block: slice,
+    offsets: tp.Dict[str, np.ndarray],
+    vel_flags: np.ndarray,
+) -> np.ndarray:
+    """Correct in place a block of velocity. (see correct_velocities)"""
+    if var in offsets:
+        values += offsets[var][block]
+    values[vel_flags[:, block] == 9] = np.nan
+    return values
 
 
-def amplitude_test(dataset, threshold):
-    """FIXME
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-    if all(f"amp{i}" in dataset for i in range(1, 5)):
-        return (
-            (dataset.amp1 < threshold)
-            & (dataset.amp2 < threshold)
-            & (dataset.amp3 < threshold)
-            & (dataset.amp4 < threshold)
-        ).data
-    else:
-        l.warnings("Amplitude test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+def time_blocks(size: int, block_size: int = QC_BLOCK_SIZE) -> tp.Iterator[slice]:
+    """Yield the slices of consecutive blocks of `block_size` time."""
+    for start in range(0, size, block_size):
+        yield slice(start, start + block_size)
 
 
-def percentgood_test(dataset, threshold):
-    """FIXME
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-    if "pg" in dataset:
-        return (dataset.pg < threshold).data
-    else:
-        l.warnings("Percent Good test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+def _read_block(dataset: tp.Type[xr.Dataset], var: str, block: slice) -> np.ndarray:
+    """Read a block of time of a variable. Only the block of a lazily loaded variable
+    is loaded."""
+    return dataset[var].variable[..., block].values
+
+
+def _implausible_vel(u: np.ndarray, v: np.ndarray, w: np.ndarray, thres: float):
+    with np.errstate(invalid="ignore"):
+        return ~((np.abs(u) < thres) & (np.abs(v) < thres) & (np.abs(w) < thres))
+
+
+def velocity_qc_tests(
+    dataset: tp.Type[xr.Dataset],
+    amp_th: float = None,
+    corr_th: float = None,
+    pg_th: float = None,
+    horizontal_vel_th: float = None,
+    vertical_vel_th: float = None,
+    error_vel_th: float = None,
+    profile_tests: tp.Dict[str, np.ndarray] = None,
+    cutoff_tests: tp.Dict[str, np.ndarray] = None,
+    offsets: tp.Dict[str, np.ndarray] = None,
+    block_size: int = QC_BLOCK_SIZE,
+) -> np.ndarray:
+    """Evaluate the velocity tests in a single pass over blocks of `block_size` time.
+
+    The variables are read one block at a time, so the dataset can be lazily
+    loaded. The dataset is not modified. The missing or implausible velocities (not
+    finite or not within +/- IMPLAUSIBLE_VEL_TRESHOLD) fail the `missing` test.
+    Tests with a falsy threshold are not carried out.
 
+    Parameters
+    ----------
+    profile_tests :
+        Results of the ensemble tests computed beforehand, {test: failed}, with
+        failed of shape (time,). (e.g. roll, pitch, pressure)
+    cutoff_tests :
+        Results of the bin tests computed beforehand, {test: (ranks, cutoff)}.
+        The bins whose (depth, 1) rank is greater or equal to the (time,) cutoff
+        fail. (e.g. sidelobes, see sidelobe_cutoff)
+    offsets :
+        (time,) motion corrections added to the velocities before the tests.
+        (see motion_offsets)
+
+    The ensemble and bin tests are only expanded to (depth, time) one block at a time.
+
+    Returns
+    -------
+    (depth, time) uint16 array. Bit `QC_TESTS_BITS[test]` is set where `test` failed.
+    """
+    profile_tests = profile_tests or dict()
+    cutoff_tests = cutoff_tests or dict()
+    offsets = offsets or dict()
+    beam_tests = [
+        ("amplitude", amp_th, [f"amp{i}" for i in range(1, 5)]),
+        ("correlation", corr_th, [f"corr{i}" for i in range(1, 5)]),
+        ("percentgood", pg_th, ["pg"]),
+    ]
+    for test, threshold, variables in beam_tests:
+        if threshold and not all(v in dataset for v in variables):
+            l.warning(f"{test.capitalize()} test aborted. Missing one or more data.")
+    beam_tests = [
+        (QC_TESTS_BITS[test], threshold, variables)
+        for test, threshold, variables in beam_tests
+        if threshold and all(v in dataset for v in variables)
+    ]
+    if error_vel_th and "e" not in dataset:
+        l.warning("Error velocity test aborted. Missing error velocity data.")
+        error_vel_th = None
+
+    qc_tests = np.zeros(dataset["u"].shape, dtype=np.uint16)
+    for block in time_blocks(qc_tests.shape[-1], block_size):
+        tests = qc_tests[:, block]
+        ub, vb, wb = (
+            _read_block(dataset, var, block) + offsets[var][block]
+            if var in offsets
+            else _read_block(dataset, var, block)
+            for var in ("u", "v", "w")
+        )
 
-def roll_test(dataset: tp.Type[xr.Dataset], thres: float) -> tp.Type[np.array]:
+        missing = _implausible_vel(ub, vb, wb, IMPLAUSIBLE_VEL_TRESHOLD)
+        _set_bit(tests, missing, QC_TESTS_BITS["missing"])
+        # The other tests see the implausible velocities as NaN.
+        ub, vb, wb = (np.where(missing, np.nan, x) for x in (ub, vb, wb))
+
+        for bit, threshold, beams in beam_tests:
+            failed = _read_block(dataset, beams[0], block) < threshold
+            for beam in beams[1:]:
+                failed &= _read_block(dataset, beam, block) < threshold
+            _set_bit(tests, failed, bit)
+
+        with np.errstate(invalid="ignore"):
+            if horizontal_vel_th:
+                failed = ub ** 2 + vb ** 2 > horizontal_vel_th ** 2
+                _set_bit(tests, failed, QC_TESTS_BITS["horizontal_velocity"])
+            if vertical_vel_th:
+                failed = np.abs(wb) > vertical_vel_th
+                _set_bit(tests, failed, QC_TESTS_BITS["vertical_velocity"])
+            if error_vel_th:
+                failed = np.abs(_read_block(dataset, "e", block)) > error_vel_th
+                _set_bit(tests, failed, QC_TESTS_BITS["error_velocity"])
+
+        for test, failed in profile_tests.items():
+            _set_bit(tests, failed[..., block], QC_TESTS_BITS[test])
+
+        for test, (ranks, cutoff) in cutoff_tests.items():
+            failed = ranks >= cutoff[block]
+            _set_bit(tests, failed, QC_TESTS_BITS[test])
+
+    return qc_tests
+
+
+def _set_bit(tests: np.ndarray, failed: np.ndarray, bit: int):
+    np.bitwise_or(tests, np.uint16(bit), out=tests, where=failed)
+
+
+def qc_tests_to_flags(qc_tests: np.ndarray) -> np.ndarray:
+    """Derive the SeaDataNet flags (int8) from the bit field of the failed tests.
+
+    Values failing no test are 1. Otherwise, the highest flag of the failed tests.
+    """
+    flags = np.ones(qc_tests.shape, dtype=np.int8)
+    for flag in sorted(set(QC_TESTS_FLAGS.get(t, 3) for t in QC_TESTS)):
+        mask = sum(QC_TESTS_BITS[t] for t in QC_TESTS if QC_TESTS_FLAGS.get(t, 3) == flag)
+        flags[(qc_tests & mask) != 0] = flag
+    return flags
+
+
+def circular_mean(
+    dataset: tp.Type[xr.Dataset], var: str, block_size: int = QC_BLOCK_SIZE
+) -> float:
+    """Circular mean (degree, -180 to 180) of a variable, read one block of time
+    at a time. NaN are ignored."""
+    sin_sum, cos_sum = 0.0, 0.0
+    for block in time_blocks(dataset[var].shape[-1], block_size):
+        angles = np.radians(_read_block(dataset, var, block))
+        sin_sum += np.nansum(np.sin(angles))
+        cos_sum += np.nansum(np.cos(angles))
+    return np.degrees(np.arctan2(sin_sum, cos_sum))
+
+
+def roll_test(
+    dataset: tp.Type[xr.Dataset], thres: float, block_size: int = QC_BLOCK_SIZE
+) -> tp.Type[np.array]:
     """FIXME
     Roll conditions (True fails)
-    Distance from mean"""
+    Distance from mean. Returns a (time,) array."""
     if "roll_" in dataset:
-        roll_mean = circmean(dataset.roll_.values, low=-180, high=180)
+        roll_mean = circular_mean(dataset, "roll_", block_size)
         roll_from_mean = circular_distance(dataset.roll_.values, roll_mean, units="deg")
         return roll_from_mean > thres
     else:
-        l.warnings("Roll test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+        l.warning("Roll test aborted. Missing roll data")
+        return np.full(dataset.time.shape, False)
 
 
-def pitch_test(dataset: tp.Type[xr.Dataset], thres: float) -> tp.Type[np.array]:
+def pitch_test(
+    dataset: tp.Type[xr.Dataset], thres: float, block_size: int = QC_BLOCK_SIZE
+) -> tp.Type[np.array]:
     """FIXME
     Pitch conditions (True fails)
-    Distance from Mean
+    Distance from Mean. Returns a (time,) array.
     """
     if "pitch" in dataset:
-        pitch_mean = circmean(dataset.pitch.values, low=-180, high=180)
+        pitch_mean = circular_mean(dataset, "pitch", block_size)
         pitch_from_mean = circular_distance(
             dataset.pitch.values, pitch_mean, units="deg"
         )
         return pitch_from_mean > thres
 
     else:
-        l.warnings("Pitch test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
-
-
-def horizontal_vel_test(
-    dataset: tp.Type[xr.Dataset], thres: float
-) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-
-    horizontal_velocity = np.sqrt(dataset.u ** 2 + dataset.v ** 2)
-
-    return np.greater(
-        horizontal_velocity.values,
-        thres,
-        where=np.isfinite(horizontal_velocity),
-    )
-
-
-def vertical_vel_test(dataset: tp.Type[xr.Dataset], thres: float) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-    return np.greater(
-        abs(dataset.w.values),
-        thres,
-        where=np.isfinite(dataset.w.values),
-    )
-
-
-def error_vel_test(dataset: tp.Type[xr.Dataset], thres: float) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-    return np.greater(
-        abs(dataset.e.values),
-        thres,
-        where=np.isfinite(dataset.w.values),
-    )
+        l.warning("Pitch test aborted. Missing pitch data")
+        return np.full(dataset.time.shape, False)
 
 
 def vertical_beam_test(
-    dataset: tp.Type[xr.Dataset], amp_thres: float, corr_thres: float, pg_thres: float
+    dataset: tp.Type[xr.Dataset],
+    amp_thres: float,
+    corr_thres: float,
+    pg_thres: float,
+    block_size: int = QC_BLOCK_SIZE,
 ) -> tp.Type[np.array]:
     """FIXME"""
     vb_test = np.full(dataset.depth.shape + dataset.time.shape, False)
-    if "vb_amp" in dataset.variables and amp_thres:
-        vb_test[dataset.vb_amp < amp_thres] = True
-    if "vb_corr" in dataset.variables and corr_thres:
-        vb_test[dataset.vb_corr < corr_thres] = True
-    if "vb_pg" in dataset.variables and pg_thres:
-        vb_test[dataset.vb_pg < pg_thres] = True
+    tests = [
+        (var, thres)
+        for var, thres in (("vb_amp", amp_thres), ("vb_corr", corr_thres), ("vb_pg", pg_thres))
+        if var in dataset.variables and thres
+    ]
+    for block in time_blocks(dataset.time.size, block_size):
+        for var, thres in tests:
+            vb_test[:, block] |= _read_block(dataset, var, block) < thres
 
     return vb_test
 
 
-def sidelobe_test(dataset: tp.Type[xr.Dataset], bottom_depth: float = None):
-    """FIXME
-    Test for sidelobe contamination (True fails).
+def sidelobe_cutoff(dataset: tp.Type[xr.Dataset], bottom_depth: float = None):
+    """Ranks of the bins away from the ADCP and rank of the first bin contaminated
+    by the sidelobes of each ensemble.
 
-    Returns a boolean array or a False statement if the test cannot be carried out.
+    The bins whose rank is greater or equal to the cutoff fail the sidelobe test.
+    The bins are ranked by distance from the ADCP (increasing depth if the
+    orientation is `down`, decreasing if `up`), so the depth can be in any order.
+    Bins with a non finite depth never fail.
+
+    Returns (depth, 1) ranks and a (time,) int cutoff, or a False statement if the
+    test cannot be carried out.
 
     Equation :
         Downward: max_depth = XducerDepth + (bottom_depth + XducerDepth) * cos(beam_angle)
@@ -499,46 +751,48 @@ def sidelobe_test(dataset: tp.Type[xr.Dataset], bottom_depth: float = None):
     depth : optional
         Fixed bottom depth to use for sidelobe correction
     """
+    if not (dataset.attrs["beam_angle"] and dataset.attrs["orientation"]):
+        return False
 
-    if dataset.attrs["beam_angle"] and dataset.attrs["orientation"]:
-        cos_angle = np.cos(np.radians(dataset.attrs["beam_angle"]))
-        depth_array = np.tile(dataset.depth.data, dataset.time.shape + (1,))
+    cos_angle = np.cos(np.radians(dataset.attrs["beam_angle"]))
 
-        if "xducer_depth" in dataset and "xducer_depth" not in dataset.attrs:
-            xducer_depth = dataset["xducer_depth"].data
-        elif "xducer_depth" in dataset.attrs:
-            xducer_depth = np.tile(dataset.attrs["xducer_depth"], dataset.time.shape)
+    if "xducer_depth" in dataset and "xducer_depth" not in dataset.attrs:
+        xducer_depth = dataset["xducer_depth"].data
+    elif "xducer_depth" in dataset.attrs:
+        xducer_depth = dataset.attrs["xducer_depth"]
+    else:
+        l.warning("Sidelobes correction aborded. Adcp depth `xducer_depth` not provided.")
+        return False
+
+    if dataset.attrs["orientation"] == "down":
+        if bottom_depth:
+            bottom_depth = bottom_depth
+        elif "bt_depth" in dataset:
+            bottom_depth = dataset.bt_depth.data
         else:
-            l.warning(
-                "Sidelobes correction aborded. Adcp depth `xducer_depth` not provided."
-            )
+            l.warning("Sidelobes correction aborded. Bottom depth not found or provided.")
             return False
 
-        if dataset.attrs["orientation"] == "down":
-            if bottom_depth:
-                bottom_depth = bottom_depth
-            elif "bt_depth" in dataset:
-                bottom_depth = dataset.bt_depth.data
-            else:
-                l.warning(
-                    "Sidelobes correction aborded. Bottom depth not found or provided."
-                )
-                return False
-
-            max_depth = xducer_depth + (bottom_depth - xducer_depth) * cos_angle
-            return depth_array.T > max_depth
-
-        elif dataset.attrs["orientation"] == "up":
-
-            min_depth = xducer_depth * (1 - cos_angle)
+        max_depth = xducer_depth + (bottom_depth - xducer_depth) * cos_angle
+        distance, limit = dataset.depth.data, max_depth
 
-            return depth_array.T < min_depth.T
+    elif dataset.attrs["orientation"] == "up":
+        min_depth = xducer_depth * (1 - cos_angle)
+        distance, limit = -dataset.depth.data, -min_depth
 
-        else:
-            l.warning(
-                "Can not correct for sidelobes, `adcp_orientation` parameter not set."
-            )
-            return False
+    else:
+        l.warning("Can not correct for sidelobes, `adcp_orientation` parameter not set.")
+        return False
+
+    order = np.argsort(distance, kind="stable")
+    ranks = np.empty(distance.size, dtype=int)
+    ranks[order] = np.arange(distance.size)
+    ranks[~np.isfinite(distance)] = -1  # Like comparisons to NaN, never fail.
+
+    limit = np.broadcast_to(limit, dataset.time.shape)
+    cutoff = np.searchsorted(distance[order], limit, side="right")
+    cutoff[~np.isfinite(limit)] = distance.size  # Like comparisons to NaN, nothing fails.
+    return ranks[:, np.newaxis], cutoff
 
 
 def temperature_test(dataset):
@@ -0,0 +1,723 @@
+"""
+Fast decoder for Rowetech RTB ensembles.
+
+The datasets of an ensemble are mapped directly with `np.frombuffer` instead of
+being decoded value by value by the rti_python Ensemble classes. Bins x beams
+datasets are stored beam by beam (beam major) and are returned as (bins, beams)
+arrays. Only the datasets used by the RtiReader are decoded.
+
+Usage:
+data = decode_ensemble(chunk)
+chunk: bytes of one ensemble; header + payload + checksum.
+
+data = decode_ensembles(buffer, index)
+buffer: bytes-like (mmap) of a file, index: ensembles index (see rti_scanner).
+
+data = decode_file(filename, index, workers, chunk_size)
+
+The batch decoder preallocates (n_ens, nbins, nbeams) and (n_ens,) arrays and fills
+them block by block. The ensembles are split in runs of consecutive ensembles with
+the same dataset layout (see layout_runs), each decoded with the layout of its
+first ensemble. A DecodeError is raised if the number of bins or beams changes.
+
+`decode_file` splits the index in work units of `chunk_size` ensembles decoded by
+a pool of `workers` processes. Each worker memory-maps the file and writes the
+decoded values directly in `multiprocessing.shared_memory` arrays created by the
+parent process. Only the work units (file, start, stop) and a status are passed
+between the processes.
+
+The returned dictionaries have the same fields as RtiReader.decode_chunk.
+`gps_datetime` is the time of day (timedelta64) of the GGA sentence. The NMEA
+fields (GGA, VTG and HDT) of all the ensembles are extracted at once by extract_nmea.
+
+Notes
+-----
+Correlation are multipled by 255 to be between 0 and 255 (like RDI).
+Pressure is divided by 10. Pascal to decapascal(like RDI).
+"""
+
+import mmap
+import re
+import traceback
+import typing as tp
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from magtogoek.adcp.tools import ymdhms_to_datetime64
+from magtogoek.nmea import (
+    KNOTS_TO_M_S,
+    NUMBER,
+    SENTENCE_TAIL,
+    dm_to_sd,
+    time_of_day,
+    to_float,
+    valid_checksums,
+)
+from nptyping import NDArray
+from rti_python.Codecs.BinaryCodec import (
+    BYTE_TYPE,
+    CHECKSUM_SIZE,
+    DATA_SET_HEADER,
+    DATA_SET_NAME_SIZE,
+    walk_data_sets,
+)
+
+DECODE_BLOCK_SIZE = 2 ** 21  # Number of bytes gathered at a time by the batch decoder.
+DECODE_CHUNK_SIZE = 1000  # Number of ensembles per work unit of decode_file.
+LAYOUT_WINDOW = 64  # Number of ensembles first compared by layout_runs.
+
+# The captured groups are the sentence body, the fields used and the checksum.
+NMEA_GGA = re.compile(
+    rb"\$([A-Z]{2}GGA,%s,%s,([NS]?),%s,([EW]?)," % (NUMBER, NUMBER, NUMBER)
+    + SENTENCE_TAIL
+)
+NMEA_VTG = re.compile(
+    rb"\$([A-Z]{2}VTG,%s,T,[0-9.]*,M,%s,N,%s,K" % (NUMBER, NUMBER, NUMBER)
+    + SENTENCE_TAIL
+)
+NMEA_HDT = re.compile(rb"\$([A-Z]{2}HDT,%s,T" % NUMBER + SENTENCE_TAIL)
+
+ENSEMBLE_DATA_FIELDS = [
+    "EnsembleNumber",
+    "NumBins",
+    "NumBeams",
+    "DesiredPingCount",
+    "ActualPingCount",
+    "Status",
+    "Year",
+    "Month",
+    "Day",
+    "Hour",
+    "Minute",
+    "Second",
+    "HSec",
+]
+
+ANCILLARY_DATA_FIELDS = [
+    "FirstBinRange",
+    "BinSize",
+    "FirstPingTime",
+    "LastPingTime",
+    "Heading",
+    "Pitch",
+    "Roll",
+    "WaterTemp",
+    "SystemTemp",
+    "Salinity",
+    "Pressure",
+    "TransducerDepth",
+    "SpeedOfSound",
+]
+
+BOTTOM_TRACK_FIELDS = [
+    "FirstPingTime",
+    "LastPingTime",
+    "Heading",
+    "Pitch",
+    "Roll",
+    "WaterTemp",
+    "SystemTemp",
+    "Salinity",
+    "Pressure",
+    "TransducerDepth",
+    "SpeedOfSound",
+    "Status",
+    "NumBeams",
+    "ActualPingCount",
+]
+# Per beam arrays following the bottom track scalars, in order.
+BOTTOM_TRACK_BEAM_FIELDS = [
+    "Range",
+    "SNR",
+    "Amplitude",
+    "Correlation",
+    "BeamVelocity",
+    "BeamGood",
+    "InstrumentVelocity",
+    "InstrumentGood",
+    "EarthVelocity",
+    "EarthGood",
+]
+
+BEAM_VELOCITY = "E000001"
+INSTRUMENT_VELOCITY = "E000002"
+EARTH_VELOCITY = "E000003"
+AMPLITUDE = "E000004"
+CORRELATION = "E000005"
+GOOD_BEAM = "E000006"
+GOOD_EARTH = "E000007"
+ENSEMBLE_DATA = "E000008"
+ANCILLARY_DATA = "E000009"
+BOTTOM_TRACK = "E000010"
+NMEA_DATA = "E000011"
+SYSTEM_SETUP = "E000014"
+
+
+def data_sets_directory(
+    chunk: bytes, drop_data_sets: tp.Iterable[str] = ()
+) -> tp.Dict[str, tp.Tuple[int, int, int, int]]:
+    """Return the position of the datasets of an ensemble.
+
+    Parameters
+    ----------
+    chunk :
+        bytes of one ensemble; header + payload + checksum.
+    drop_data_sets :
+        Names of the datasets to leave out of the directory. (e.g. `AMPLITUDE`)
+
+    Returns
+    -------
+    directory :
+        {name: (data_offset, num_elements, element_multiplier, ds_type)} where
+        `data_offset` is the position of the first value of the dataset.
+    """
+    directory = dict()
+    for offset, ds_type, num_elements, element_multiplier, name in walk_data_sets(
+        chunk
+    ):
+        data_offset = offset + DATA_SET_HEADER.size + len(name)
+        name = name.rstrip(b"\0").decode("ascii", "replace")
+        if name not in drop_data_sets:
+            directory[name] = (
+                data_offset,
+                num_elements,
+                element_multiplier,
+                ds_type,
+            )
+
+    return directory
+
+
+def decode_ensemble(
+    chunk: bytes, drop_data_sets: tp.Iterable[str] = ()
+) -> tp.Dict[str, NDArray]:
+    """Decode the datasets of one ensemble used by the RtiReader.
+
+    Parameters
+    ----------
+    chunk :
+        bytes of one ensemble; header + payload + checksum.
+    drop_data_sets :
+        Names of the datasets not to decode.
+
+    Returns
+    -------
+    data :
+        Same fields as RtiReader.decode_chunk.
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    decoded = _decode_data_sets(
+        data, np.zeros(1, dtype=np.int64), data_sets_directory(chunk, drop_data_sets)
+    )
+
+    return {k: v[0, ...] for k, v in decoded.items()}
+
+
+def decode_ensembles(
+    buffer: tp.Union[bytes, mmap.mmap],
+    index: NDArray,
+    out: tp.Dict[str, NDArray] = None,
+    drop_data_sets: tp.Iterable[str] = (),
+) -> tp.Dict[str, NDArray]:
+    """Decode the ensembles of the index into preallocated arrays.
+
+    Parameters
+    ----------
+    buffer :
+        bytes-like object of a whole file.
+    index :
+        Structured array with the `offset` and `length` of the ensembles.
+        (see magtogoek.adcp.rti_scanner)
+    out :
+        Arrays of len(index) where to write the decoded values. Values without
+        an array in `out` are not returned. Allocated if None.
+    drop_data_sets :
+        Names of the datasets not to decode. (e.g. `AMPLITUDE`, `BOTTOM_TRACK`)
+
+    Returns
+    -------
+    data :
+        Same fields as RtiReader.decode_chunk stacked along a first (ensemble) axis.
+    """
+    if len(index) == 0:
+        return dict()
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    try:
+        offsets = index["offset"].astype(np.int64)
+        lengths = index["length"].astype(np.int64)
+
+        decoded = dict() if out is None else out
+        for run in layout_runs(data, index, drop_data_sets):
+            first = data[offsets[run.start] : offsets[run.start] + lengths[run.start]]
+            directory = data_sets_directory(first.tobytes(), drop_data_sets)
+            del first
+            block_size = max(1, DECODE_BLOCK_SIZE // int(lengths[run.start]))
+            for start in range(run.start, run.stop, block_size):
+                block = slice(start, min(start + block_size, run.stop))
+                values = _decode_data_sets(data, offsets[block], directory)
+                if out is None and len(decoded) == 0:
+                    decoded = _allocate(values, len(index))
+                for k, v in values.items():
+                    if k not in decoded:
+                        continue
+                    if v.shape[1:] != decoded[k].shape[1:]:
+                        raise DecodeError(
+                            f"The layout changed at ensemble {index['ens_num'][start]}: "
+                            f"`{k}` of shape {v.shape[1:]} instead of {decoded[k].shape[1:]}."
+                        )
+                    decoded[k][block] = v
+    except Exception as e:
+        # The traceback frames would keep views on the buffer.
+        traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        del data  # release the buffer (mmap can't be closed while exported).
+
+    return decoded
+
+
+def decode_file(
+    filename: str,
+    index: NDArray,
+    workers: int = None,
+    chunk_size: int = None,
+    drop_data_sets: tp.Iterable[str] = (),
+) -> tp.Dict[str, NDArray]:
+    """Decode the ensembles of the index of a file over multiple processes.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file
+    index :
+        Structured array with the `offset` and `length` of the ensembles.
+        (see magtogoek.adcp.rti_scanner)
+    workers :
+        Number of processes. Defaults to the number of cpu minus one. The file is
+        decoded in the current process if `workers` is 1 or if there is only one
+        work unit.
+    chunk_size :
+        Number of ensembles per work unit. Defaults to DECODE_CHUNK_SIZE.
+    drop_data_sets :
+        Names of the datasets not to decode. (e.g. `AMPLITUDE`, `BOTTOM_TRACK`)
+
+    Returns
+    -------
+    data :
+        See decode_ensembles.
+    """
+    workers = workers or max(1, cpu_count() - 1)
+    chunk_size = chunk_size or DECODE_CHUNK_SIZE
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive int")
+
+    if workers == 1 or len(index) <= chunk_size:
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return decode_ensembles(mm, index, drop_data_sets=drop_data_sets)
+
+    # The output arrays layout is taken from the first ensemble.
+    with open(filename, "rb") as f:
+        f.seek(int(index["offset"][0]))
+        first = np.frombuffer(f.read(int(index["length"][0])), dtype=np.uint8)
+    template = _decode_data_sets(
+        first, np.zeros(1, dtype=np.int64), data_sets_directory(first, drop_data_sets)
+    )
+
+    shared = dict()
+    try:
+        specs = dict()
+        for k, v in {"index": index[:1], **template}.items():
+            shape, dtype = (len(index),) + v.shape[1:], v.dtype
+            shared[k] = SharedMemory(
+                create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize)
+            )
+            specs[k] = (shared[k].name, shape, dtype)
+        arrays = _attach_shared_arrays(specs, shared)
+        arrays["index"][:] = index
+        arrays.update(_allocate(template, len(index), like=arrays))
+        del arrays
+
+        units = [
+            (filename, start, min(start + chunk_size, len(index)), drop_data_sets)
+            for start in range(0, len(index), chunk_size)
+        ]
+        with Pool(
+            min(workers, len(units)), initializer=_init_worker, initargs=(specs,)
+        ) as p:
+            statuses = p.starmap(_decode_work_unit, units)
+
+        for start, stop, error in statuses:
+            if error is not None:
+                raise DecodeError(
+                    f"Ensembles {start} to {stop} of {filename} could not be decoded: {error}"
+                )
+
+        decoded = {
+            k: v.copy()
+            for k, v in _attach_shared_arrays(specs, shared).items()
+            if k != "index"
+        }
+    finally:
+        for shm in shared.values():
+            shm.close()
+            shm.unlink()
+
+    return decoded
+
+
+class DecodeError(Exception):
+    pass
+
+
+_worker_shared = dict()  # SharedMemory attached by a worker process.
+_worker_arrays = dict()  # Arrays on the SharedMemory of a worker process.
+
+
+def _init_worker(specs: tp.Dict[str, tp.Tuple]):
+    """Attach the worker process to the shared output arrays."""
+    for k, (name, _, _) in specs.items():
+        _worker_shared[k] = SharedMemory(name=name)
+    _worker_arrays.update(_attach_shared_arrays(specs, _worker_shared))
+
+
+def _decode_work_unit(
+    filename: str, start: int, stop: int, drop_data_sets: tp.Iterable[str] = ()
+) -> tp.Tuple[int, int, tp.Union[str, None]]:
+    """Decode the ensembles [start, stop) of the index in the shared arrays.
+
+    Returns (start, stop, error) where error is None on success.
+    """
+    try:
+        out = {k: v[start:stop] for k, v in _worker_arrays.items() if k != "index"}
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                decode_ensembles(
+                    mm,
+                    _worker_arrays["index"][start:stop],
+                    out=out,
+                    drop_data_sets=drop_data_sets,
+                )
+        del out
+    except Exception as e:
+        return start, stop, repr(e)
+    return start, stop, None
+
+
+def _attach_shared_arrays(
+    specs: tp.Dict[str, tp.Tuple], shared: tp.Dict[str, SharedMemory]
+) -> tp.Dict[str, NDArray]:
+    """Return the arrays of `specs` {key: (shm_name, shape, dtype)} on `shared`."""
+    arrays = dict()
+    for k, (_, shape, dtype) in specs.items():
+        arrays[k] = np.ndarray(shape, dtype=dtype, buffer=shared[k].buf)
+    return arrays
+
+
+def layout_runs(
+    buffer: tp.Union[bytes, NDArray],
+    index: NDArray,
+    drop_data_sets: tp.Iterable[str] = (),
+) -> tp.List[slice]:
+    """Return the slices of `index` of consecutive ensembles with the same layout.
+
+    The ensembles are compared to the first ensemble of their run by windows
+    doubling in size, so a file with few layout changes is only read once.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = index["offset"].astype(np.int64)
+    lengths = index["length"].astype(np.int64)
+    runs, start = [], 0
+    while start < len(index):
+        first = data[offsets[start] : offsets[start] + lengths[start]].tobytes()
+        directory = data_sets_directory(first, drop_data_sets)
+        window = LAYOUT_WINDOW
+        while True:
+            stop = min(start + window, len(index))
+            same = _same_layout(
+                data, offsets[start:stop], lengths[start:stop], directory
+            )
+            if not same.all():
+                stop = start + max(1, int(np.argmin(same)))
+                break
+            if stop == len(index):
+                break
+            window *= 2
+        runs.append(slice(start, stop))
+        start = stop
+    return runs
+
+
+def _same_layout(
+    data: NDArray, offsets: NDArray, lengths: NDArray, directory: tp.Dict
+) -> NDArray:
+    """Return True for the ensembles with the same datasets layout as `directory`.
+
+    The datasets headers (type, size and name) must be the same at the same
+    positions. Byte datasets (NMEA) can have a different size but must fit in
+    the ensemble.
+    """
+    same = np.ones(offsets.size, dtype=bool)
+    header_size = DATA_SET_HEADER.size + DATA_SET_NAME_SIZE
+    for data_offset, num_elements, element_multiplier, ds_type in directory.values():
+        header_start = data_offset - header_size
+        # The headers of the shorter ensembles are not read; the first one fits.
+        fits = data_offset <= lengths
+        same &= fits
+        headers = _gather(
+            data, np.where(fits, offsets, offsets[0]), header_start, header_size
+        )
+        expected = data[offsets[0] + header_start : offsets[0] + data_offset]
+        if ds_type == BYTE_TYPE:
+            # Only the type, name length and name are compared (bytes 4:12 are sizes).
+            same &= (headers[:, :4] == expected[:4]).all(axis=1)
+            same &= (headers[:, 12:] == expected[12:]).all(axis=1)
+            sizes = headers[:, 4:12].copy().view("<i4").astype(np.int64).prod(axis=1)
+        else:
+            same &= (headers == expected).all(axis=1)
+            sizes = num_elements * element_multiplier * 4
+        same &= data_offset + sizes <= lengths - CHECKSUM_SIZE
+
+    return same
+
+
+def _allocate(
+    values: tp.Dict[str, NDArray], n: int, like: tp.Dict[str, NDArray] = None
+) -> tp.Dict[str, NDArray]:
+    """Preallocate arrays of `n` ensembles for the decoded `values`.
+
+    Float and time arrays are filled with NaN/NaT, others with 0. If `like` is
+    given, its arrays are filled instead of allocating new ones.
+    """
+    decoded = dict()
+    for k, v in values.items():
+        if like is not None:
+            decoded[k] = like[k]
+        else:
+            decoded[k] = np.empty((n,) + v.shape[1:], dtype=v.dtype)
+    fill_missing(decoded)
+    return decoded
+
+
+def fill_missing(arrays: tp.Dict[str, NDArray]):
+    """Fill the arrays with missing values; NaN/NaT for float and time, else 0."""
+    for v in arrays.values():
+        if v.dtype.kind in "fc":
+            v.fill(np.nan)
+        elif v.dtype.kind in "mM":
+            v.fill(np.datetime64("NaT"))
+        else:
+            v.fill(0)
+
+
+def _decode_data_sets(
+    data: NDArray, offsets: NDArray, directory: tp.Dict
+) -> tp.Dict[str, NDArray]:
+    """Decode the datasets in `directory` of the ensembles starting at `offsets`.
+
+    All the ensembles must have the layout of `directory`.
+    """
+    decoded = dict()
+
+    if ENSEMBLE_DATA in directory:
+        ed = _gather_values(data, offsets, directory[ENSEMBLE_DATA], "<i4", 13)
+        # Year, Month, Day, Hour, Minute, Second, HSec
+        decoded["datetime"] = ymdhms_to_datetime64(*ed[:, 6:13].T)
+
+    if CORRELATION in directory:
+        decoded["cor"] = (
+            _gather_bins_beams(data, offsets, directory[CORRELATION], "<f4") * 255
+        )
+
+    if AMPLITUDE in directory:
+        decoded["amp"] = _gather_bins_beams(data, offsets, directory[AMPLITUDE], "<f4")
+
+    for name in (GOOD_BEAM, GOOD_EARTH):  # GoodBeam has precedence.
+        if name in directory:
+            decoded["pg"] = _gather_bins_beams(data, offsets, directory[name], "<i4")
+            break
+
+    for name in (EARTH_VELOCITY, INSTRUMENT_VELOCITY, BEAM_VELOCITY):
+        if name in directory:  # EarthVelocity has precedence.
+            decoded["vel"] = _gather_bins_beams(data, offsets, directory[name], "<f4")
+            break
+
+    if ANCILLARY_DATA in directory:
+        ad = _gather_values(data, offsets, directory[ANCILLARY_DATA], "<f4", 13)
+        ad = dict(zip(ANCILLARY_DATA_FIELDS, ad.astype(np.float64).T))
+        decoded["temperature"] = ad["WaterTemp"]
+        decoded["salinity"] = ad["Salinity"]
+        decoded["VL"] = np.zeros(
+            offsets.size, {"names": ["Pressure"], "formats": [float]}
+        )
+        decoded["VL"]["Pressure"] = ad["Pressure"] / 10  # pascal to decapascal
+        decoded["XducerDepth"] = ad["TransducerDepth"]
+        decoded["heading"] = ad["Heading"]
+        decoded["pitch"] = ad["Pitch"]
+        decoded["roll"] = ad["Roll"]
+
+    if BOTTOM_TRACK in directory:
+        _, num_elements, element_multiplier, _ = directory[BOTTOM_TRACK]
+        bt = _gather_values(
+            data,
+            offsets,
+            directory[BOTTOM_TRACK],
+            "<f4",
+            num_elements * element_multiplier,
+        ).astype(np.float64)
+        nbeams = int(bt[0, BOTTOM_TRACK_FIELDS.index("NumBeams")])
+        start = len(BOTTOM_TRACK_FIELDS)
+        beam_fields = dict()
+        for name in BOTTOM_TRACK_BEAM_FIELDS:
+            beam_fields[name] = bt[:, start : start + nbeams]
+            start += nbeams
+        decoded["bt_vel"] = beam_fields["EarthVelocity"]
+        decoded["bt_pg"] = beam_fields["BeamGood"]
+        decoded["bt_cor"] = beam_fields["Correlation"] * 255
+        decoded["bt_depth"] = beam_fields["Range"]
+
+    if NMEA_DATA in directory:
+        decoded.update(extract_nmea(data, offsets, directory[NMEA_DATA]))
+
+    return decoded
+
+
+def _gather(data: NDArray, offsets: NDArray, start: int, size: int) -> NDArray:
+    """Return a (n_ens, size) array of bytes at `start` of each ensemble."""
+    if offsets.size == 1:  # a slice is much faster than fancy indexing.
+        return data[None, offsets[0] + start : offsets[0] + start + size].copy()
+    return data[offsets[:, None] + (start + np.arange(size))]
+
+
+def _gather_values(
+    data: NDArray, offsets: NDArray, entry: tp.Tuple, dtype: str, count: int
+) -> NDArray:
+    """Return the first `count` values of a dataset as a (n_ens, count) array.
+
+    Missing values (e.g. older firmware with fewer values) are set to 0.
+    """
+    data_offset, num_elements, element_multiplier, _ = entry
+    available = min(count, num_elements * element_multiplier)
+    values = np.zeros((offsets.size, count), dtype=dtype)
+    values[:, :available] = _gather(data, offsets, data_offset, available * 4).view(
+        dtype
+    )
+    return values
+
+
+def _gather_bins_beams(
+    data: NDArray, offsets: NDArray, entry: tp.Tuple, dtype: str
+) -> NDArray:
+    """Return a bins x beams dataset stored beam by beam as (n_ens, bins, beams)."""
+    data_offset, num_elements, element_multiplier, _ = entry
+    values = _gather(data, offsets, data_offset, num_elements * element_multiplier * 4)
+    values = values.view(dtype).reshape(offsets.size, element_multiplier, num_elements)
+    return values.transpose(0, 2, 1)
+
+
+def extract_nmea(
+    data: NDArray, offsets: NDArray, entry: tp.Tuple
+) -> tp.Dict[str, NDArray]:
+    """Extract the GGA, VTG and HDT fields of the NMEA datasets of the ensembles.
+
+    The NMEA datasets of all the ensembles are joined in a single buffer searched
+    once per sentence type with a bytes regex. The checksums and the fields of
+    all the sentences are converted at once. (see magtogoek.nmea) The values of the last valid sentence of each ensemble
+    are returned (same as the rti_python NmeaData, without pynmea2).
+
+    Returns
+    -------
+    nmea :
+        latitude, longitude : From GGA. 0 if missing (like rti_python).
+        gps_datetime : Time of day (timedelta64[ns]) from GGA. NaT if missing.
+        gps_speed : Speed over ground (m/s) from VTG. NaN if missing.
+        gps_course : True course over ground (degrees) from VTG. NaN if missing.
+        gps_heading : True heading (degrees) from HDT. NaN if missing.
+    """
+    buffer, width = _join_nmea(data, offsets, entry)
+
+    nmea = dict(
+        latitude=np.zeros(offsets.size),
+        longitude=np.zeros(offsets.size),
+        gps_datetime=np.full(offsets.size, np.timedelta64("NaT", "ns")),
+        gps_speed=np.full(offsets.size, np.nan),
+        gps_course=np.full(offsets.size, np.nan),
+        gps_heading=np.full(offsets.size, np.nan),
+    )
+
+    ens, (time, lat, ns, lon, ew) = _find_sentences(buffer, width, NMEA_GGA)
+    if ens.size:
+        # Empty coordinates are 0 like pynmea2.
+        lat, lon = np.nan_to_num(dm_to_sd(lat)), np.nan_to_num(dm_to_sd(lon))
+        nmea["latitude"][ens] = lat * np.where(ns == b"S", -1, 1)
+        nmea["longitude"][ens] = lon * np.where(ew == b"W", -1, 1)
+        nmea["gps_datetime"][ens] = time_of_day(time)
+
+    ens, (course, knots, kmh) = _find_sentences(buffer, width, NMEA_VTG)
+    if ens.size:
+        knots = to_float(knots)
+        speed = knots * KNOTS_TO_M_S
+        speed[np.isnan(knots)] = to_float(kmh)[np.isnan(knots)] / 3.6
+        nmea["gps_speed"][ens] = speed
+        nmea["gps_course"][ens] = to_float(course)
+
+    ens, (heading,) = _find_sentences(buffer, width, NMEA_HDT)
+    if ens.size:
+        nmea["gps_heading"][ens] = to_float(heading)
+
+    return nmea
+
+
+def _join_nmea(
+    data: NDArray, offsets: NDArray, entry: tp.Tuple
+) -> tp.Tuple[bytes, NDArray]:
+    """Join the NMEA datasets of the ensembles in rows of the same width.
+
+    The rows are padded with `\\n`. Returns the joined bytes and the width of
+    the rows; the ensemble of a byte at `position` is `position // width`.
+    """
+    header_start = entry[0] - DATA_SET_HEADER.size - DATA_SET_NAME_SIZE
+    sizes = (
+        _gather(data, offsets, header_start + 4, 8)
+        .view("<i4")
+        .astype(np.int64)
+        .prod(axis=1)
+    )
+    width = int(sizes.max()) + 1
+    rows = _gather(
+        data, offsets, entry[0], min(width, data.size - int(offsets.max()) - entry[0])
+    )
+    joined = np.full((offsets.size, width), ord("\n"), dtype=np.uint8)
+    joined[:, : rows.shape[1]] = rows
+    joined[np.arange(width) >= sizes[:, None]] = ord("\n")
+
+    return joined.tobytes(), width
+
+
+def _find_sentences(
+    buffer: bytes, width: int, pattern: tp.Pattern
+) -> tp.Tuple[NDArray, tp.List[NDArray]]:
+    """Find the valid sentences of a type and keep the last one of each ensemble.
+
+    Returns
+    -------
+    ensembles :
+        Ensemble of the kept sentences.
+    fields :
+        Arrays (bytes) of the captured fields of the kept sentences.
+    """
+    matches = [(m.start(), *m.groups(b"")) for m in pattern.finditer(buffer)]
+    if not matches:
+        return np.empty(0, dtype=np.int64), []
+
+    starts, bodies, *fields, checksums = zip(*matches)
+    valid = valid_checksums(bodies, checksums)
+
+    ensembles = np.array(starts)[valid] // width
+    # Last sentence of each ensemble.
+    _, last = np.unique(ensembles[::-1], return_index=True)
+    keep = np.flatnonzero(valid)[::-1][last]
+
+    return ensembles[::-1][last], [np.array(f, dtype=bytes)[keep] for f in fields]
@@ -2,7 +2,8 @@
 RTI readers for Rowetech ENS files based on rti_tools by jeanlucshaw and rti_python.
 Only tested on SeaWatch adcp.
 
-Uses rti_python Ensemble and Codecs to read and decode data. The data are then loaded in a
+Uses rti_python Ensemble and Codecs to read the first ensemble of the files and the
+fast decoder (magtogoek.adcp.rti_decoder) to decode the data. The data are then loaded in a
 `Bunch` object taken from pycurrents. This allows us to use to same loader for RDI and RTI data.
 
 Usage:
@@ -13,27 +14,67 @@ ens.EnsembleData.ActualPingCount # ping_per_ensemble.
 
 """
 
+import csv
+import json
 import logging
+import mmap
+import time
+from copy import deepcopy
 from datetime import datetime
 from multiprocessing import Pool, cpu_count
 from pathlib import Path
-from typing import Dict, List, Tuple, Type
+from typing import Dict, Iterator, List, Tuple, Type
 
 import numpy as np
+from magtogoek.adcp.rti_decoder import (
+    AMPLITUDE,
+    ANCILLARY_DATA,
+    BEAM_VELOCITY,
+    BOTTOM_TRACK,
+    CORRELATION,
+    EARTH_VELOCITY,
+    ENSEMBLE_DATA,
+    GOOD_BEAM,
+    GOOD_EARTH,
+    INSTRUMENT_VELOCITY,
+    NMEA_DATA,
+    SYSTEM_SETUP,
+    decode_ensemble,
+    decode_ensembles,
+    decode_file,
+)
+from magtogoek.adcp.rti_scanner import (
+    incomplete_ensemble_start,
+    read_index_cache,
+    scan_ens_buffer,
+    scan_ens_file,
+    summarize_index,
+    write_index_cache,
+)
 from magtogoek.adcp.tools import datetime_to_dday
 from magtogoek.utils import get_files_from_expresion
-from rti_python.Codecs.BinaryCodec import BinaryCodec
+from rti_python.Codecs.BinaryCodec import DATA_SET_NAME_SIZE, BinaryCodec
 from rti_python.Ensemble.EnsembleData import *
 from scipy.constants import convert_temperature
-from scipy.interpolate import griddata
 from scipy.stats import circmean
-from tqdm import tqdm
 
-DELIMITER = b"\x80" * 16  # RTB ensemble delimiter
-BLOCK_SIZE = 4096  # Number of bytes read at a time
+logger = logging.getLogger(__name__)
+
 RTI_FILL_VALUE = 88.88800048828125
 RDI_FILL_VALUE = -32768.0
 
+# Static data compared between files to report configuration changes.
+CONFIG_KEYS = ["NBeams", "nbin", "CellSize", "Bin1Dist", "NPings", "kHz", "coordsystem"]
+
+# Variables that can be dropped: datasets not decoded when the variable is dropped.
+DROPPABLE_VARIABLES = {
+    "amp": [AMPLITUDE],
+    "cor": [CORRELATION],
+    "pg": [GOOD_BEAM, GOOD_EARTH],
+    "bt": [BOTTOM_TRACK],
+    "nav": [NMEA_DATA],
+}
+
 
 class FilesFormatError(Exception):
     pass
@@ -88,15 +129,35 @@ class RtiReader:
     ----------
     filenames
         path/to/filename or list(path/to/filenames) or path/to/regex
+    cache
+        If True, the files index is read from (and written to) a sidecar
+        `<filename>.idx` file. See magtogoek.adcp.rti_scanner.
+    workers
+        Number of processes used to index the files and to decode the ensembles.
+        Defaults to the number of cpu minus one.
+    chunk_size
+        Number of ensembles decoded by a process at a time.
+    drop_variables
+        Variables not to read: `amp`, `cor`, `pg`, `bt` (bottom track) and
+        `nav` (NMEA). Their datasets are not decoded.
 
     Methods
     -------
-    check_files(self) :
+    check_files(self, output) :
         Prints info about the .ENS files; ensemble counts, number of bin, bin size, etc.
 
-    read(start_index, stop_index) :
+    get_files_summary(self) :
+        Return a summary of each file; counts, time coverage, gaps, config changes.
+
+    read(start_index, stop_index, start_time, end_time) :
       Return a Bunch object with the read data.
 
+    iter_blocks(block_size, start_index, stop_index, start_time, end_time) :
+      Yield Bunch objects of `block_size` ensembles of the read data.
+
+    follow(poll_interval, timeout) :
+      Yield Bunch objects of the ensembles appended to the last file.
+
         Parameters
         ----------
         start_index :
@@ -110,45 +171,162 @@ class RtiReader:
             data :
     """
 
-    def __init__(self, filenames: Tuple[str, List]):
+    def __init__(
+        self,
+        filenames: Tuple[str, List],
+        cache: bool = True,
+        workers: int = None,
+        chunk_size: int = None,
+        drop_variables: List[str] = None,
+    ):
         """
         Parameters
         ----------
         filenames
             path/to/filename or list(path/to/filenames) or path/to/regex
+        cache
+            Use the sidecar index cache files.
+        workers
+            Number of processes used to decode the ensembles.
+        chunk_size
+            Number of ensembles decoded by a process at a time.
+        drop_variables
+            Variables not to read. (see DROPPABLE_VARIABLES)
         """
         self.filenames = get_files_from_expresion(filenames)
+        self.cache = cache
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        self.drop_data_sets = []
+        for variable in drop_variables or []:
+            if variable not in DROPPABLE_VARIABLES:
+                raise ValueError(
+                    f"{variable} can't be dropped. Droppable variables: {list(DROPPABLE_VARIABLES)}"
+                )
+            self.drop_data_sets += DROPPABLE_VARIABLES[variable]
 
         self.start_index = None
         self.stop_index = None
 
         self.files_ens_count = None
+        self.files_index = None
+        self.files_static = None
         self.files_start_stop_index = None
+        self.ens_index = None
         self.ens_chunks = None
         self.current_file = None
 
-    def check_files(self):
-        """Check files for ensemble count and bin depths."""
+    def check_files(self, output: str = None):
+        """Check files for ensemble count and bin depths.
+
+        Only the files index and their first ensemble are read.
+
+        Parameters
+        ----------
+        output :
+            path/to/summary.json or path/to/summary.csv. If given, the
+            summary (see `get_files_summary`) is also written to the file.
+        """
+        summaries = self.get_files_summary()
+
+        for summary in summaries:
+            print("-" * 40)
+            print("File:", Path(summary["file"]).name)
+            print("Number of ens:", summary["ens_count"])
+            if summary["ens_count"] == 0:
+                continue
+
+            print("Year:", summary["yearbase"])
+            print("Start time:", summary["start_time"])
+            print("End time:", summary["end_time"])
+            print("Time step:", summary["time_step"], "s")
+            print("Time gaps:", summary["gaps"])
+            print("Missing ens:", summary["missing_ens"])
+            print("Number of beams:", summary["NBeams"])
+            print("Number of bins:", summary["nbin"])
+            print("Binsize:", summary["CellSize"])
+            print("Distance first bin:", summary["Bin1Dist"], "m")
+            print("Beam angle:", summary["angle"])
+            print("Frequency:", int(summary["kHz"]), "hz")
+            if summary["layout_changes"]:
+                print("Ensemble layout changes:", summary["layout_changes"])
+            if summary["config_changes"]:
+                print("Config changes:", ", ".join(summary["config_changes"]))
+
+        if output:
+            self.write_files_summary(summaries, output)
+            print("-" * 40)
+            print(f"Summary made -> {output}")
 
+    def get_files_summary(self) -> List[Dict]:
+        """Return a summary of each file from its index and its first ensemble.
+
+        The summary contains the `rti_scanner.summarize_index` values, the
+        CONFIG_KEYS static data of the file and `config_changes`, the list
+        of the CONFIG_KEYS that differ from the previous file.
+        """
         self.get_files_ens_count()
 
+        summaries = []
+        previous_config = None
         for filename in self.filenames:
-            self.current_file = filename
-            self.get_ens_chunks()
-            ens = BinaryCodec.decode_data_sets(self.ens_chunks[0][1])
+            summary = dict(file=str(filename))
+            summary.update(summarize_index(self.files_index[filename]))
+            static = self.files_static[filename]
+            config = self._static_config(static)
+            summary["yearbase"] = static["yearbase"] if static else None
+            summary["angle"] = static["sysconfig"]["angle"] if static else None
+            summary.update(config)
+            summary["config_changes"] = []
+            if static:
+                if previous_config is not None:
+                    summary["config_changes"] = [
+                        k for k in CONFIG_KEYS if config[k] != previous_config[k]
+                    ]
+                previous_config = config
+            summaries.append(summary)
+
+        return summaries
 
-            print("-" * 40)
-            print("File:", Path(filename).name)
-            print("Year:", ens.EnsembleData.Year)
-            print("Number of ens:", len(self.ens_chunks))
-            print("Number of beams:", ens.EnsembleData.NumBeams)
-            print("Number of bins:", ens.EnsembleData.NumBins)
-            print("Binsize:", ens.AncillaryData.BinSize)
-            print("Distance first bin:", round(ens.AncillaryData.FirstBinRange, 3), "m")
-            print("Beam angle:", self._beam_angle(ens.EnsembleData.SerialNumber))
-            print("Frequency:", int(ens.SystemSetup.WpSystemFreqHz), "hz")
-
-    def read(self, start_index: int = None, stop_index: int = None) -> Type[Bunch]:
+    @staticmethod
+    def write_files_summary(summaries: List[Dict], output: str):
+        """Write the files summary to a json or csv file."""
+        output = Path(output)
+        if output.suffix == ".csv":
+            with open(output, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(summaries[0].keys()))
+                writer.writeheader()
+                for summary in summaries:
+                    writer.writerow(
+                        {
+                            **summary,
+                            "config_changes": ";".join(summary["config_changes"]),
+                        }
+                    )
+        else:
+            with open(output, "w") as f:
+                json.dump(summaries, f, indent=2)
+
+    @staticmethod
+    def _static_config(static: Dict) -> Dict:
+        """Return the CONFIG_KEYS values of the static data."""
+        if not static:
+            return {k: None for k in CONFIG_KEYS}
+        config = {
+            k: static[k] for k in ["NBeams", "nbin", "CellSize", "Bin1Dist", "NPings"]
+        }
+        config["kHz"] = static["sysconfig"]["kHz"]
+        config["coordsystem"] = static.get("trans", {}).get("coordsystem")
+        return config
+
+    def read(
+        self,
+        start_index: int = None,
+        stop_index: int = None,
+        start_time: str = None,
+        end_time: str = None,
+    ) -> Type[Bunch]:
         """Return a Bunch object with the read data.
 
         Parameters
@@ -159,11 +337,166 @@ class RtiReader:
         stop_index :
            Trim trailling chunks by stop_index.
 
+        start_time :
+           Only read the ensembles at or after start_time.
+
+        end_time :
+           Only read the ensembles at or before end_time.
+
         Returns
         --------
             data
         TODO add inline comments
         """
+        self._prepare_read(start_index, stop_index, start_time, end_time)
+
+        files_bunch = []
+        for filename in self.filenames:
+            start, stop = self.files_start_stop_index[filename]
+            self.current_file = filename
+            self.get_ens_index(start, stop)
+            files_bunch.append(self.read_file())
+
+        data = self.concatenate_files_bunch(files_bunch)
+
+        return data
+
+    def iter_blocks(
+        self,
+        block_size: int = 1000,
+        start_index: int = None,
+        stop_index: int = None,
+        start_time: str = None,
+        end_time: str = None,
+    ) -> Iterator[Type[Bunch]]:
+        """Yield the read data by blocks of `block_size` ensembles.
+
+        Only one block is decoded at a time so the memory used is bounded by
+        `block_size` instead of the number of ensembles. Blocks don't span over
+        files; the last block of each file can be smaller.
+
+        The static data (orientation, bin depths, etc.) of all the blocks are the
+        ones of the first block, like the files concatenated by `read`.
+
+        Parameters
+        -----------
+        block_size :
+           Number of ensembles per block.
+
+        start_index :
+           Trim leading chunks by start_index.
+
+        stop_index :
+           Trim trailling chunks by stop_index.
+
+        start_time :
+           Only read the ensembles at or after start_time.
+
+        end_time :
+           Only read the ensembles at or before end_time.
+
+        Yields
+        ------
+            data
+        """
+        if block_size < 1:
+            raise ValueError("Block size must be a positive int")
+
+        self._prepare_read(start_index, stop_index, start_time, end_time)
+
+        reference = None
+        for filename in self.filenames:
+            start, stop = self.files_start_stop_index[filename]
+            self.current_file = filename
+            self.get_ens_index(start, stop)
+            file_index = self.ens_index
+            for block_start in range(0, len(file_index), block_size):
+                self.ens_index = file_index[block_start : block_start + block_size]
+                block = self.read_file(reference=reference)
+                if reference is None:
+                    reference = block
+                else:
+                    self.check_mismatch_dep([reference, block])
+                yield block
+
+    def follow(
+        self, poll_interval: float = 1.0, timeout: float = None
+    ) -> Iterator[Type[Bunch]]:
+        """Follow the last file while it is being written.
+
+        At each poll, only the bytes appended to the file since the previous poll
+        are read. The ensembles they complete are decoded and yielded as a Bunch;
+        the bytes of an incomplete trailing ensemble are kept for the next poll.
+        If the file is truncated, it is read again from the start.
+
+        The static data (orientation, bin depths, etc.) of all the blocks are the
+        ones of the first block.
+
+        Parameters
+        ----------
+        poll_interval :
+            Time (seconds) between polls.
+        timeout :
+            Stop after `timeout` seconds without new ensembles. Follow forever if None.
+
+        Yields
+        ------
+            data of the appended ensembles.
+        """
+        self.current_file = self.filenames[-1]
+        static, reference = None, None
+        read_offset = 0  # Position of the first byte not read yet.
+        pending, pending_offset = b"", 0  # Bytes kept for the next poll, and position.
+        last_ensemble_time = time.monotonic()
+
+        while True:
+            if Path(self.current_file).stat().st_size < read_offset:
+                logger.warning(
+                    f"{self.current_file} was truncated. Reading from the start."
+                )
+                static, reference = None, None
+                read_offset, pending, pending_offset = 0, b"", 0
+
+            with open(self.current_file, "rb") as f:
+                f.seek(read_offset)
+                buffer, buffer_offset = pending + f.read(), pending_offset
+            read_offset = buffer_offset + len(buffer)
+
+            index = scan_ens_buffer(buffer)
+            end = int(index["offset"][-1] + index["length"][-1]) if len(index) else 0
+            # Only the bytes that could start an ensemble are kept for the next poll.
+            start = end + incomplete_ensemble_start(buffer[end:])
+            pending, pending_offset = buffer[start:], buffer_offset + start
+
+            if len(index) > 0:
+                decoded = decode_ensembles(
+                    buffer, index, drop_data_sets=self.drop_data_sets
+                )
+                index["offset"] += buffer_offset
+
+                if static is None:
+                    static = self._get_static_metadata(self.current_file, index)
+                self.ens_index = index
+                block = self._make_bunch(
+                    static, self._format_decoded(decoded), reference
+                )
+                if reference is None:
+                    reference = block
+                last_ensemble_time = time.monotonic()
+                yield block
+            elif timeout is not None and time.monotonic() - last_ensemble_time > timeout:
+                return
+
+            time.sleep(poll_interval)
+
+    def _prepare_read(
+        self,
+        start_index: int = None,
+        stop_index: int = None,
+        start_time: str = None,
+        end_time: str = None,
+    ):
+        """Index the files and get the ensembles to read from each file."""
         if start_index:
             if start_index < 0:
                 raise ValueError("Start index must be positive int")
@@ -196,42 +529,37 @@ class RtiReader:
 
         self.get_files_start_stop_index()
 
-        files_bunch = []
-        for filename in self.filenames:
-            start, stop = self.files_start_stop_index[filename]
-            self.current_file = filename
-            self.get_ens_chunks()
-            self.ens_chunks = self.ens_chunks[start:stop]
-            files_bunch.append(self.read_file())
+        if start_time is not None or end_time is not None:
+            self.get_files_time_window(start_time, end_time)
+            if len(self.filenames) == 0:
+                raise ValueError(
+                    f"No ensemble found between {start_time} and {end_time}."
+                )
 
-        data = self.concatenate_files_bunch(files_bunch)
+    def get_files_ens_count(self):
+        """Scan each files to index their ensembles and get the ensemble counts.
 
-        return data
+        The files are scanned once, in parallel if `self.workers` allows it.
+        The index is then reused to read the chunks.
+        If `self.cache` is True, a valid sidecar index cache is used instead of
+        scanning the file and the cache is (re)written after a scan.
 
-    def get_files_ens_count(self):
-        """Read each files to find the number of ensemble in each file."""
-        self.files_ens_count = []
-        buff = bytes()
-        ii = 0
-        self.ens_chunks = []
+        Also gets the `static` data of the files (see `_get_static_metadata`).
+        """
+        workers = min(self.workers or max(1, cpu_count() - 1), len(self.filenames))
+        args = [(filename, self.cache) for filename in self.filenames]
+        if workers > 1:
+            with Pool(workers) as pool:
+                indexed = pool.starmap(self._index_file, args)
+        else:
+            indexed = [self._index_file(*arg) for arg in args]
 
-        for filename in self.filenames:
-            count = 0
-            with open(filename, "rb") as f:
-                data = f.read(BLOCK_SIZE)
-                while data:
-                    buff += data
-                    if DELIMITER in buff:
-                        chunks = buff.split(DELIMITER)
-                        buff = chunks.pop()
-                        for chunk in chunks:
-                            if BinaryCodec.verify_ens_data(DELIMITER + chunk):
-                                count += 1
-                    data = f.read(BLOCK_SIZE)
-                # check the remaining bytes in buffer
-                if BinaryCodec.verify_ens_data(DELIMITER + buff):
-                    count += 1
-            self.files_ens_count.append(count)
+        self.files_index = dict()
+        self.files_static = dict()
+        for filename, (index, static) in zip(self.filenames, indexed):
+            self.files_index[filename] = index
+            self.files_static[filename] = static
+        self.files_ens_count = [len(self.files_index[f]) for f in self.filenames]
 
     def drop_empty_files(self):
         """Drop the files with 0 ensemble from self.filenames"""
@@ -240,6 +568,8 @@ class RtiReader:
             print(f"No data found in {filename}. File dropped")
         self.filenames = np.array(self.filenames)[counts != 0].tolist()
         self.files_ens_count = counts[counts != 0].tolist()
+        self.files_index = {f: self.files_index[f] for f in self.filenames}
+        self.files_static = {f: self.files_static[f] for f in self.filenames}
 
     def get_files_start_stop_index(self):
         """Get the start and stop index for the files
@@ -280,42 +610,196 @@ class RtiReader:
                 stop = stop_index
             self.files_start_stop_index[filename] = (start, stop)
 
-    def get_ens_chunks(self):
-        """Read the binary ens file and get ensemble (chunk/ping)
+    def get_files_time_window(self, start_time: str = None, end_time: str = None):
+        """Narrow the start and stop index of the files to a time window.
+
+        The ensembles times of the files index are binary searched so only the
+        ensembles in the window are decoded. Files without ensembles in the
+        window are dropped. The window bounds are inclusive.
+
+        Parameters
+        ----------
+        start_time :
+            Datetime of the first ensemble to read. `None` for no lower bound.
+        end_time :
+            Datetime of the last ensemble to read. `None` for no upper bound.
+        """
+        if start_time is not None:
+            start_time = np.datetime64(start_time, "ns")
+        if end_time is not None:
+            end_time = np.datetime64(end_time, "ns")
+
+        filenames = []
+        for filename in self.filenames:
+            start, stop = self.files_start_stop_index[filename]
+            start, stop, _ = slice(start, stop).indices(len(self.files_index[filename]))
+            window_start, window_stop = self._time_window_index(
+                self.files_index[filename]["time"][start:stop], start_time, end_time
+            )
+            if window_stop > window_start:
+                filenames.append(filename)
+                self.files_start_stop_index[filename] = (
+                    start + window_start,
+                    start + window_stop,
+                )
+
+        for filename in set(self.filenames) - set(filenames):
+            del self.files_start_stop_index[filename]
+        self.filenames = filenames
+
+    @staticmethod
+    def _time_window_index(
+        times: np.ndarray, start_time: np.datetime64, end_time: np.datetime64
+    ) -> Tuple[int, int]:
+        """Return the (start, stop) index of the times in the window.
+
+        Sorted times are binary searched. Otherwise, (NaT or time going backward),
+        the span from the first to the last time in the window is returned.
+        """
+        if len(times) == 0:
+            return 0, 0
+
+        if (np.diff(times) >= np.timedelta64(0)).all() and not np.isnat(times[0]):
+            start = 0 if start_time is None else np.searchsorted(times, start_time)
+            stop = (
+                len(times)
+                if end_time is None
+                else np.searchsorted(times, end_time, side="right")
+            )
+            return int(start), int(stop)
+
+        in_window = ~np.isnat(times)
+        if start_time is not None:
+            in_window &= times >= start_time
+        if end_time is not None:
+            in_window &= times <= end_time
+        found = np.flatnonzero(in_window)
+        if len(found) == 0:
+            return 0, 0
+        return int(found[0]), int(found[-1]) + 1
+
+    def get_ens_index(self, start: int = None, stop: int = None):
+        """Get the index of the ensembles of the current file to read.
+
+        makes attributes ens_index: (offset, length, ens_num, time) structured array.
+
+        Parameters
+        ----------
+        start :
+            Index of the first ensemble to get.
+        stop :
+            Index of the ensemble where to stop.
+        """
+        if self.files_index is None or self.current_file not in self.files_index:
+            if self.files_index is None:
+                self.files_index = dict()
+            self.files_index[self.current_file] = scan_ens_file(self.current_file)
+
+        self.ens_index = self.files_index[self.current_file][start:stop]
+
+    def get_ens_chunks(self, start: int = None, stop: int = None):
+        """Get the ensembles (chunk/ping) of the current file from its index.
 
         makes attributes chunk_list: List[(chunk_idx, chunk)]
 
+        Parameters
+        ----------
+        start :
+            Index of the first ensemble to get.
+        stop :
+            Index of the ensemble where to stop.
         """
-        buff = bytes()
-        ii = 0
+        self.get_ens_index(start, stop)
+        index = self.ens_index
         self.ens_chunks = []
 
+        if len(index) == 0:
+            return
+
         with open(self.current_file, "rb") as f:
-            data = f.read(BLOCK_SIZE)
-            while data:
-                buff += data
-                if DELIMITER in buff:
-                    chunks = buff.split(DELIMITER)
-                    buff = chunks.pop()
-                    for chunk in chunks:
-                        if BinaryCodec.verify_ens_data(DELIMITER + chunk):
-                            self.ens_chunks.append((ii, DELIMITER + chunk))
-                            ii += 1
-
-                data = f.read(BLOCK_SIZE)
-
-            # check the remaining bytes in buffer
-            if BinaryCodec.verify_ens_data(DELIMITER + buff):
-                self.ens_chunks.append((ii, DELIMITER + buff))
-                ii += 1
-
-    def read_file(self) -> Type[Bunch]:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for ii, (offset, length) in enumerate(
+                    zip(index["offset"].tolist(), index["length"].tolist())
+                ):
+                    self.ens_chunks.append((ii, mm[offset : offset + length]))
+
+    @classmethod
+    def _index_file(cls, filename: str, cache: bool = True) -> Tuple[np.ndarray, Dict]:
+        """Return the index and the `static` data of a file.
+
+        The sidecar index cache is used (and written) if `cache` is True.
+        """
+        cached = read_index_cache(filename) if cache else None
+        if cached is not None:
+            return cached
+
+        index = scan_ens_file(filename)
+        static = cls._get_static_metadata(filename, index)
+        if cache:
+            write_index_cache(filename, index, static)
+
+        return index, static
+
+    @classmethod
+    def _get_static_metadata(cls, filename: str, index) -> Dict:
+        """Get the `static` data of a file from its first ensemble.
+
+        Returns None if the file has no ensemble.
+        """
+        if len(index) == 0:
+            return None
+
+        with open(filename, "rb") as f:
+            f.seek(int(index["offset"][0]))
+            chunk = f.read(int(index["length"][0]))
+        directory = BinaryCodec.data_sets_directory(chunk)
+        ens = BinaryCodec.decode_data_sets(
+            chunk, names=[ENSEMBLE_DATA, ANCILLARY_DATA, SYSTEM_SETUP]
+        )
+
+        static = dict(
+            nbin=ens.EnsembleData.NumBins,
+            NBeams=ens.EnsembleData.NumBeams,
+            yearbase=ens.EnsembleData.Year,
+            SerialNumber=ens.EnsembleData.SerialNumber,
+            NPings=ens.EnsembleData.ActualPingCount,
+            CellSize=ens.AncillaryData.BinSize,
+            Bin1Dist=round(ens.AncillaryData.FirstBinRange, 3),
+            pingtype=ens.SystemSetup.WpBroadband,
+            sysconfig=dict(
+                angle=cls._beam_angle(ens.EnsembleData.SerialNumber),
+                kHz=ens.SystemSetup.WpSystemFreqHz,
+                convex=True,  # Rowetech adcp seems to be convex.
+                up=None,
+            ),
+            FL=dict(
+                FWV=int(
+                    str(ens.EnsembleData.SysFirmwareMajor)
+                    + str(ens.EnsembleData.SysFirmwareMinor)
+                ),
+                FWR=ens.EnsembleData.SysFirmwareRevision,
+                Pulse=ens.SystemSetup.WpLagLength * 100,  # meters to centimeters
+            ),
+        )
+
+        for name, coordsystem in [
+            (BEAM_VELOCITY, "beam"),
+            (INSTRUMENT_VELOCITY, "xyz"),
+            (EARTH_VELOCITY, "earth"),
+        ]:
+            if name.encode().ljust(DATA_SET_NAME_SIZE, b"\0") in directory:
+                static["trans"] = dict(coordsystem=coordsystem)
+
+        return static
+
+    def read_file(self, reference: Type[Bunch] = None) -> Type[Bunch]:
         """Read data from one RTB .ENS file put them into a Bunch object
 
         Parameters
         ----------
-        ens_file_path :
-            path/to/ens_file_path
+        reference :
+            Bunch of previously read data. If given, its orientation and bin depths
+            are used instead of computing them from the read data.
 
         Returns
         -------
@@ -323,109 +807,97 @@ class RtiReader:
             bunch with the read data.
 
         """
-        # Get `static` data from the first ensemble.
-        ens = BinaryCodec.decode_data_sets(self.ens_chunks[0][1])
+        # Get `static` data of the file (first ensemble).
+        if self.files_static is None or self.current_file not in self.files_static:
+            if self.files_static is None:
+                self.files_static = dict()
+            self.files_static[self.current_file] = self._get_static_metadata(
+                self.current_file, self.files_index[self.current_file]
+            )
+
+        return self._make_bunch(
+            self.files_static[self.current_file], self.read_chunks(), reference
+        )
 
+    def _make_bunch(
+        self, static: Dict, decoded: Type[Bunch], reference: Type[Bunch] = None
+    ) -> Type[Bunch]:
+        """Put the `static` data and the decoded ensembles of the current file in a Bunch."""
         # Get coordinate sizes
-        ppd = Bunch()
+        ppd = Bunch(**deepcopy(static))
         ppd.filename = Path(self.current_file).name
-        ppd.ens_count = len(self.ens_chunks)
-
-        ppd.nbin = ens.EnsembleData.NumBins
-        ppd.NBeams = ens.EnsembleData.NumBeams
-        ppd.yearbase = ens.EnsembleData.Year
-        ppd.SerialNumber = ens.EnsembleData.SerialNumber
-        ppd.NPings = ens.EnsembleData.ActualPingCount
-
-        ppd.CellSize = ens.AncillaryData.BinSize
-        ppd.Bin1Dist = round(ens.AncillaryData.FirstBinRange, 3)
+        ppd.ens_count = len(self.ens_index)
 
         ppd.dep = ppd.Bin1Dist + np.arange(0, ppd.nbin * ppd.CellSize, ppd.CellSize)
 
-        ppd.pingtype = ens.SystemSetup.WpBroadband
-        ppd.sysconfig = dict(
-            angle=self._beam_angle(ppd.SerialNumber),
-            kHz=ens.SystemSetup.WpSystemFreqHz,
-            convex=True,  # Rowetech adcp seems to be convex.
-            up=None,
-        )
-        ppd.FL = dict()
-        ppd.FL["FWV"] = int(
-            str(ens.EnsembleData.SysFirmwareMajor)
-            + str(ens.EnsembleData.SysFirmwareMinor)
-        )
-        ppd.FL["FWR"] = ens.EnsembleData.SysFirmwareRevision
-        ppd.FL["Pulse"] = ens.SystemSetup.WpLagLength * 100  # meters to centimeters
-
-        if ens.IsBeamVelocity:
-            ppd.trans = dict(coordsystem="beam")
-        if ens.IsInstrumentVelocity:
-            ppd.trans = dict(coordsystem="xyz")
-        if ens.IsEarthVelocity:
-            ppd.trans = dict(coordsystem="earth")
-
         # Read chunks and data of ens to ppd.
-        ppd = Bunch(**ppd, **self.read_chunks())
+        ppd = Bunch(**ppd, **decoded)
 
-        # Determine up/down configuration
-        mean_roll = circmean(np.radians(ppd.roll))
-        ppd.sysconfig["up"] = True if abs(mean_roll) < np.radians(30) else False
-
-        # Determine bin depths
-        if ppd.sysconfig["up"] is True:
-            ppd.dep = np.asarray(np.median(ppd.XducerDepth) - ppd.dep).round(2)
+        if reference is not None:
+            ppd.sysconfig["up"] = reference.sysconfig["up"]
+            ppd.dep = reference.dep
         else:
-            ppd.dep = np.asarray(np.median(ppd.XducerDepth) + ppd.dep).round(2)
+            self._set_orientation_and_depth(ppd)
 
         # Roll near zero means downwards (like RDI)
         ppd.roll = ppd.roll + 180
         ppd.roll[ppd.roll > 180] -= 360
 
-        ppd.dday = datetime_to_dday(ppd["datetime"])
+        ppd.dday = datetime_to_dday(ppd.datetime, ppd.yearbase)
 
         if "gps_datetime" in ppd:
             ppd.rawnav = self.format_rawnav(ppd)
 
         return ppd
 
+    @staticmethod
+    def _set_orientation_and_depth(ppd: Type[Bunch]):
+        """Set the up/down configuration from the roll and the bin depths."""
+        # Determine up/down configuration
+        mean_roll = circmean(np.radians(ppd.roll))
+        ppd.sysconfig["up"] = True if abs(mean_roll) < np.radians(30) else False
+
+        # Determine bin depths
+        if ppd.sysconfig["up"] is True:
+            ppd.dep = np.asarray(np.median(ppd.XducerDepth) - ppd.dep).round(2)
+        else:
+            ppd.dep = np.asarray(np.median(ppd.XducerDepth) + ppd.dep).round(2)
+
     def read_chunks(self) -> Type[Bunch]:
-        """Read and decode chunks over multple process
+        """Decode the ensembles of `ens_index` into preallocated arrays.
 
-        Notes
-        -----
-        This could be somewhat faster if the tqdm was removed. It takes ~.25 additional seconds
-        (~5s total) for ~4000 chunks. Exiting the processes to output progress could be time consuming
-        for bigger files.
+        The ensembles are decoded by chunks of `chunk_size` ensembles over
+        `workers` processes in shared memory arrays.
+        (see magtogoek.adcp.rti_decoder.decode_file)
         """
-        # spliting the reading workload on multiple cpu
-        number_of_cpu = cpu_count() - 1
-
         print(f"Reading {self.current_file}")
         time0 = datetime.now()
 
-        with Pool(number_of_cpu) as p:  # test
-            decoded_chunks = p.starmap(self.decode_chunk, tqdm(self.ens_chunks))  # test
+        decoded = decode_file(
+            self.current_file,
+            self.ens_index,
+            self.workers,
+            self.chunk_size,
+            drop_data_sets=self.drop_data_sets,
+        )
 
         time1 = datetime.now()
         print(
-            len(self.ens_chunks),
+            len(self.ens_index),
             " chuncks read in",
             round((time1 - time0).total_seconds(), 3),
             "s",
         )
 
-        # sorting the decoded_chunks with the index position then droping the indx.
-        decoded_chunks.sort()
-        decoded_chunks = [data for _, data in decoded_chunks]
+        return self._format_decoded(decoded)
 
-        # Merging bunches into a single one.
+    @staticmethod
+    def _format_decoded(decoded: Dict) -> Type[Bunch]:
+        """Split the beam data and change the velocity fill values to RDI ones."""
         # Splitting beam data into new individual variable e.g. vel -> vel1,...,vel4
-        ppd = Bunch()
-
-        for k in decoded_chunks[0]:
-            chunks = [p[k] for p in decoded_chunks]
-            ppd[k] = np.stack(chunks, axis=0)
+        ppd = Bunch(decoded)
 
+        for k in decoded:
             if k == "vel":
                 #  change de vel fill values to the one used by teledyne.
                 ppd.vel[ppd.vel == RTI_FILL_VALUE] = RDI_FILL_VALUE
@@ -451,56 +923,11 @@ class RtiReader:
 
         Notes
         -----
+        Datasets are decoded by magtogoek.adcp.rti_decoder.decode_ensemble.
         Correlation are multipled by 255 to be between 0 and 255 (like RDI).
         Pressure is divided by 10. Pascal to decapascal(like RDI).
         """
-        ppd = Bunch()
-
-        ens = BinaryCodec.decode_data_sets(chunk)
-
-        if ens.IsEnsembleData:
-            ppd.datetime = np.array(ens.EnsembleData.datetime())
-
-        if ens.IsCorrelation:
-            ppd.cor = np.array(ens.Correlation.Correlation) * 255
-
-        if ens.IsAmplitude:
-            ppd.amp = np.array(ens.Amplitude.Amplitude)
-        if ens.IsGoodEarth:
-            ppd.pg = np.array(ens.GoodEarth.GoodEarth)
-
-        if ens.IsGoodBeam:
-            ppd.pg = np.array(ens.GoodBeam.GoodBeam)
-
-        if ens.IsBeamVelocity:
-            ppd.vel = np.array(ens.BeamVelocity.Velocities)
-
-        if ens.IsInstrumentVelocity:
-            ppd.vel = np.array(ens.InstrumentVelocity.Velocities)
-
-        if ens.IsEarthVelocity:
-            ppd.vel = np.array(ens.EarthVelocity.Velocities)
-
-        if ens.IsAncillaryData:
-            ppd.temperature = ens.AncillaryData.WaterTemp
-            ppd.salinity = np.array(ens.AncillaryData.Salinity)
-            pressure = np.array(ens.AncillaryData.Pressure) / 10  # pascal to decapascal
-            ppd.VL = np.array(pressure, {"names": ["Pressure"], "formats": [np.float]})
-            ppd.XducerDepth = np.array(ens.AncillaryData.TransducerDepth)
-            ppd.heading = np.array(ens.AncillaryData.Heading)
-            ppd.pitch = np.array(ens.AncillaryData.Pitch)
-            ppd.roll = np.array(ens.AncillaryData.Roll)
-
-        if ens.IsBottomTrack:
-            ppd.bt_vel = np.array(ens.BottomTrack.EarthVelocity)
-            ppd.bt_pg = np.array(ens.BottomTrack.BeamGood)
-            ppd.bt_cor = np.array(ens.BottomTrack.Correlation) * 255
-            ppd.bt_depth = np.array(ens.BottomTrack.Range)
-
-        if ens.IsNmeaData:
-            ppd.longitude = np.array(ens.NmeaData.longitude)
-            ppd.latitude = np.array(ens.NmeaData.latitude)
-            ppd.gps_datetime = np.array(ens.NmeaData.datetime)
+        ppd = Bunch(decode_ensemble(chunk))
 
         return ii, ppd
 
@@ -523,15 +950,32 @@ class RtiReader:
     def format_rawnav(data: Type[Bunch]) -> Dict:
         """Format rawnav to pycurent rawnav.
 
-        Interpolates longitude and latitude on adcp dday.
+        The GGA time of day (`gps_datetime`) is put on the date of the ensembles;
+        a day is added or removed when it is more than 12 hours from the ensemble
+        time (midnight crossing). Longitude and latitude are interpolated on adcp dday.
         """
+        gps_time = data.datetime.astype("datetime64[D]") + data.gps_datetime
+        offset = gps_time - data.datetime
+        gps_time[offset > np.timedelta64(12, "h")] -= np.timedelta64(1, "D")
+        gps_time[offset < -np.timedelta64(12, "h")] += np.timedelta64(1, "D")
+        gps_dday = datetime_to_dday(gps_time, data.yearbase)
+
+        valid = np.isfinite(gps_dday)
+        order = np.argsort(gps_dday[valid])
+        gps_dday = gps_dday[valid][order]
+
+        rawnav = dict()
+        for key, values in (
+            ("Lon1_BAM4", data.longitude),
+            ("Lat1_BAM4", data.latitude),
+        ):
+            if gps_dday.size == 0:
+                rawnav[key] = np.full(data.dday.shape, np.nan)
+                continue
+            rawnav[key] = np.interp(
+                data.dday, gps_dday, values[valid][order], left=np.nan, right=np.nan
+            ) / (180.0 / 2 ** 31)
 
-        gps_dday = datetime_to_dday(data.gsp_datetime)
-
-        rawnav = dict(
-            Lon1_BAM4=griddata(gps_dday, data.longitude, data.dday) / (180.0 / 2 ** 31),
-            Lat1_BAM4=griddata(gps_dday, data.latitude, data.dday) / (180.0 / 2 ** 31),
-        )
         return rawnav
 
     def concatenate_files_bunch(self, bunches: List[Type[Bunch]]) -> Type[Bunch]:
@@ -563,12 +1007,26 @@ class RtiReader:
         ppd.dep = b0.dep
 
         for k in b0:
+            if k == "rawnav":
+                continue
             if k == "dep" or not isinstance(b0[k], np.ndarray):
                 ppd[k] = b0[k]
             else:
                 chunks = [p[k] for p in bunches]
                 ppd[k] = np.concatenate(chunks)
 
+        if any("rawnav" in p for p in bunches):
+            # Files without gps data have NaN positions.
+            ppd.rawnav = {
+                key: np.concatenate(
+                    [
+                        p.rawnav[key] if "rawnav" in p else np.full(p.dday.shape, np.nan)
+                        for p in bunches
+                    ]
+                )
+                for key in ("Lon1_BAM4", "Lat1_BAM4")
+            }
+
         return ppd
 
     @staticmethod
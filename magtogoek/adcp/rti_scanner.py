@@ -0,0 +1,382 @@
+"""
+Scanner for Rowetech RTB .ENS files.
+
+Each file is memory-mapped once and the ensemble delimiters are located with a
+vectorized search. The candidate ensemble headers are validated (the ensemble
+number and the payload size are followed by their one's complement) before the
+checksum of the payload is computed. The result is a compact index of the valid
+ensembles that is reused to count and to decode the ensembles without scanning
+the file again.
+
+The index and the static metadata of the first ensemble can be cached in a
+sidecar file, `<filename>.idx`, next to the .ENS file. The cache is keyed on the
+file path, size and modification time and is ignored if any of them changed.
+
+Usage:
+index = scan_ens_file(filename)
+
+Index fields:
+    offset : position (bytes) of the ensemble delimiter in the file.
+    length : size (bytes) of the ensemble; header + payload + checksum.
+    ens_num : ensemble number found in the ensemble header.
+    time : ensemble datetime64[ns] from the EnsembleData (E000008) dataset.
+
+"""
+
+import binascii
+import json
+import mmap
+import os
+import typing as tp
+from pathlib import Path
+
+import numpy as np
+from magtogoek.adcp.tools import ymdhms_to_datetime64
+from nptyping import NDArray
+from rti_python.Codecs.BinaryCodec import (
+    CHECKSUM_SIZE,
+    DATA_SET_HEADER,
+    DATA_SET_NAME_SIZE,
+    HEADER_SIZE,
+    walk_data_sets,
+)
+
+DELIMITER = b"\x80" * 16  # RTB ensemble delimiter
+SCAN_BLOCK_SIZE = 2 ** 24  # Number of bytes searched at a time for delimiters.
+
+ENSEMBLE_DATA_NAME = b"E000008\0"
+ENSEMBLE_DATA_SIZE = 13 * 4  # EnsembleNumber ... HSec (int32).
+
+GAP_FACTOR = 1.5  # Time steps greater than GAP_FACTOR * median time step are gaps.
+
+INDEX_CACHE_SUFFIX = ".idx"
+INDEX_CACHE_VERSION = 1
+
+ENS_INDEX_DTYPE = np.dtype(
+    [("offset", "<i8"), ("length", "<i4"), ("ens_num", "<i4"), ("time", "<M8[ns]")]
+)
+
+
+def scan_ens_file(filename: str) -> NDArray:
+    """Return the index of the valid ensembles of a RTB .ENS file.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file
+
+    Returns
+    -------
+    index :
+        Structured array (offset, length, ens_num) of the valid ensembles.
+    """
+    if Path(filename).stat().st_size < HEADER_SIZE + CHECKSUM_SIZE:
+        return np.empty(0, dtype=ENS_INDEX_DTYPE)
+
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            index = scan_ens_buffer(mm)
+
+    return index
+
+
+def scan_ens_buffer(buffer: tp.Union[bytes, mmap.mmap]) -> NDArray:
+    """Return the index of the valid ensembles found in a bytes-like buffer.
+
+    See scan_ens_file.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    offsets = _find_delimiters(data)
+    offsets, payload_sizes, ens_nums = _validate_headers(data, offsets)
+    index = _chain_ensembles(data, offsets, payload_sizes, ens_nums)
+    index["time"] = _read_ens_times(data, index)
+
+    del data  # release the buffer (mmap can't be closed while exported).
+
+    return index
+
+
+def incomplete_ensemble_start(buffer: tp.Union[bytes, mmap.mmap]) -> int:
+    """Return the position from which the bytes of a buffer could still be part of
+    an ensemble completed by bytes appended later.
+
+    It is the position of the first delimiter followed by an incomplete header
+    or by a valid header of an ensemble that doesn't fit in the buffer. Without
+    one, only the trailing bytes that could start a delimiter are kept.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = _find_delimiters(data)
+    short = offsets[offsets + HEADER_SIZE > data.size]
+
+    offsets = offsets[offsets + HEADER_SIZE <= data.size]
+    header = data[offsets[:, None] + np.arange(len(DELIMITER), HEADER_SIZE)]
+    ens_nums, inv_ens_nums, payload_sizes, inv_payload_sizes = (
+        header.view("<i4").astype(np.int64).T
+    )
+    valid = (ens_nums == ~inv_ens_nums) & (payload_sizes == ~inv_payload_sizes)
+    valid &= payload_sizes > 0
+    valid &= offsets + HEADER_SIZE + payload_sizes + CHECKSUM_SIZE > data.size
+    candidates = np.concatenate((offsets[valid], short))
+    size = data.size
+
+    del data, header  # release the buffer (mmap can't be closed while exported).
+
+    if candidates.size > 0:
+        return int(candidates.min())
+    return max(0, size - len(DELIMITER) + 1)
+
+
+def _find_delimiters(data: NDArray) -> NDArray:
+    """Return the positions where 16 consecutive delimiter bytes start.
+
+    Positions are searched by blocks of SCAN_BLOCK_SIZE bytes. Block overlaps
+    by 15 bytes so delimiters spanning two blocks are found once.
+
+    Runs of more than 16 delimiter bytes return more than one position. The
+    wrong ones are removed when validating the headers.
+    """
+    delimiter_byte, width = DELIMITER[0], len(DELIMITER)
+    positions = []
+    for block_start in range(0, data.size, SCAN_BLOCK_SIZE):
+        block_stop = min(block_start + SCAN_BLOCK_SIZE + width - 1, data.size)
+        hits = np.flatnonzero(data[block_start:block_stop] == delimiter_byte)
+        if hits.size < width:
+            continue
+        # hits is sorted and unique: hits[i+15] - hits[i] == 15 means 16 consecutive.
+        is_start = (hits[width - 1 :] - hits[: hits.size - width + 1]) == width - 1
+        starts = hits[: hits.size - width + 1][is_start] + block_start
+        positions.append(starts[starts < block_start + SCAN_BLOCK_SIZE])
+
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    return np.concatenate(positions).astype(np.int64)
+
+
+def _validate_headers(
+    data: NDArray, offsets: NDArray
+) -> tp.Tuple[NDArray, NDArray, NDArray]:
+    """Keep the delimiter positions followed by a valid ensemble header.
+
+    A valid header has ens_num == ~inverse_ens_num, payload_size == ~inverse_payload_size
+    and the whole ensemble (header + payload + checksum) must fit in the data.
+
+    Returns
+    -------
+    offsets, payload_sizes, ens_nums
+    """
+    offsets = offsets[offsets + HEADER_SIZE <= data.size]
+
+    header = data[offsets[:, None] + np.arange(len(DELIMITER), HEADER_SIZE)]
+    ens_nums, inv_ens_nums, payload_sizes, inv_payload_sizes = (
+        header.view("<i4").astype(np.int64).T
+    )
+
+    valid = (ens_nums == ~inv_ens_nums) & (payload_sizes == ~inv_payload_sizes)
+    valid &= payload_sizes > 0
+    valid &= offsets + HEADER_SIZE + payload_sizes + CHECKSUM_SIZE <= data.size
+
+    return offsets[valid], payload_sizes[valid], ens_nums[valid]
+
+
+def _chain_ensembles(
+    data: NDArray, offsets: NDArray, payload_sizes: NDArray, ens_nums: NDArray
+) -> NDArray:
+    """Verify the checksums and return the index of consecutive ensembles.
+
+    Candidates starting inside an already validated ensemble are skipped
+    without computing their checksum.
+    """
+    index = []
+    next_offset = 0
+    for offset, payload_size, ens_num in zip(
+        offsets.tolist(), payload_sizes.tolist(), ens_nums.tolist()
+    ):
+        if offset < next_offset:
+            continue
+        payload_start = offset + HEADER_SIZE
+        checksum_start = payload_start + payload_size
+        checksum = int.from_bytes(
+            data[checksum_start : checksum_start + CHECKSUM_SIZE].tobytes(), "little"
+        )
+        if binascii.crc_hqx(data[payload_start:checksum_start], 0) == checksum:
+            index.append(
+                (offset, HEADER_SIZE + payload_size + CHECKSUM_SIZE, ens_num, "NaT")
+            )
+            next_offset = checksum_start + CHECKSUM_SIZE
+
+    return np.array(index, dtype=ENS_INDEX_DTYPE)
+
+
+def find_data_set(data: NDArray, offset: int, length: int, name: bytes) -> int:
+    """Return the position of the dataset `name` in the ensemble at `offset`.
+
+    Returns -1 if the dataset is not in the ensemble.
+    """
+    for pointer, *_, data_set_name in walk_data_sets(data, offset, offset + length):
+        if data_set_name == name:
+            return pointer
+    return -1
+
+
+def _read_ens_times(data: NDArray, index: NDArray) -> NDArray:
+    """Read the ensembles datetime from the EnsembleData (E000008) dataset.
+
+    The position of the dataset in the first ensemble is assumed for all the
+    ensembles and only the ensembles where the dataset is somewhere else are
+    walked through. Ensembles without the dataset have a NaT time.
+    """
+    times = np.full(len(index), np.datetime64("NaT"), dtype="M8[ns]")
+    if len(index) == 0:
+        return times
+
+    offsets, lengths = index["offset"], index["length"].astype(np.int64)
+    first = find_data_set(data, int(offsets[0]), int(lengths[0]), ENSEMBLE_DATA_NAME)
+    data_start = DATA_SET_HEADER.size + DATA_SET_NAME_SIZE
+    relative = first - offsets[0] if first >= 0 else HEADER_SIZE
+
+    ds_offsets = offsets + relative
+    same_layout = relative + data_start + ENSEMBLE_DATA_SIZE <= lengths - CHECKSUM_SIZE
+    names = data[
+        ds_offsets[same_layout, None]
+        + np.arange(DATA_SET_HEADER.size, DATA_SET_HEADER.size + DATA_SET_NAME_SIZE)
+    ]
+    same_layout[same_layout] = (
+        names == np.frombuffer(ENSEMBLE_DATA_NAME, dtype=np.uint8)
+    ).all(axis=1)
+
+    for i in np.flatnonzero(~same_layout):
+        ds_offsets[i] = find_data_set(
+            data, int(offsets[i]), int(lengths[i]), ENSEMBLE_DATA_NAME
+        )
+    found = ds_offsets >= 0
+
+    fields = (
+        data[ds_offsets[found, None] + data_start + np.arange(ENSEMBLE_DATA_SIZE)]
+        .view("<i4")
+        .T
+    )
+    # EnsembleNumber, NumBins, NumBeams, DesiredPingCount, ActualPingCount, Status,
+    # Year, Month, Day, Hour, Minute, Second, HSec
+    times[found] = ymdhms_to_datetime64(*fields[6:13])
+
+    return times
+
+
+def summarize_index(index: NDArray) -> tp.Dict:
+    """Summarize the ensembles of an index without decoding them.
+
+    Returns
+    -------
+    summary :
+        ens_count : number of valid ensembles.
+        first_ens, last_ens : first and last ensemble numbers.
+        missing_ens : number of skipped ensemble numbers.
+        start_time, end_time : time coverage (ISO strings).
+        time_step : median time step in seconds.
+        gaps : number of time steps greater than GAP_FACTOR * time_step.
+        largest_gap : largest time step in seconds.
+        layout_changes : number of times the ensemble size changes, which
+            happens when the number of bins, beams or datasets changes.
+    """
+    summary = dict(
+        ens_count=len(index),
+        first_ens=None,
+        last_ens=None,
+        missing_ens=0,
+        start_time=None,
+        end_time=None,
+        time_step=None,
+        gaps=0,
+        largest_gap=None,
+        layout_changes=0,
+    )
+    if len(index) == 0:
+        return summary
+
+    ens_nums = index["ens_num"].astype(np.int64)
+    summary["first_ens"] = int(ens_nums[0])
+    summary["last_ens"] = int(ens_nums[-1])
+    summary["missing_ens"] = int(np.clip(np.diff(ens_nums) - 1, 0, None).sum())
+    summary["layout_changes"] = int(np.count_nonzero(np.diff(index["length"])))
+
+    times = index["time"][~np.isnat(index["time"])]
+    if len(times) == 0:
+        return summary
+    summary["start_time"] = str(np.datetime_as_string(times.min(), unit="s"))
+    summary["end_time"] = str(np.datetime_as_string(times.max(), unit="s"))
+
+    steps = np.diff(times) / np.timedelta64(1, "s")
+    if len(steps) == 0:
+        return summary
+    time_step = float(np.median(steps))
+    summary["time_step"] = time_step
+    summary["gaps"] = int(np.count_nonzero(steps > GAP_FACTOR * time_step))
+    summary["largest_gap"] = float(steps.max())
+
+    return summary
+
+
+def read_index_cache(filename: str) -> tp.Union[tp.Tuple[NDArray, tp.Dict], None]:
+    """Read the sidecar index cache of a file.
+
+    Returns
+    -------
+    (index, static) or None if there is no valid cache for the file.
+    """
+    cache = index_cache_path(filename)
+    if not cache.is_file():
+        return None
+    try:
+        with np.load(cache, allow_pickle=False) as npz:
+            meta = json.loads(str(npz["meta"]))
+            if meta != _index_cache_key(filename):
+                return None
+            index = npz["index"]
+            static = json.loads(str(npz["static"]))
+    except Exception:  # Truncated or corrupted cache (e.g. BadZipFile, EOFError).
+        return None
+
+    if index.dtype != ENS_INDEX_DTYPE:
+        return None
+
+    return index, static
+
+
+def write_index_cache(filename: str, index: NDArray, static: tp.Dict = None):
+    """Write the index and the static metadata to the sidecar cache of a file.
+
+    Nothing is written if the directory is not writable. The cache is written to a
+    temporary file first; an interrupted write never leaves a partial cache.
+    """
+    cache = index_cache_path(filename)
+    tmp_cache = cache.with_name(cache.name + ".tmp")
+    try:
+        with open(tmp_cache, "wb") as f:
+            np.savez(
+                f,
+                index=index,
+                meta=np.array(json.dumps(_index_cache_key(filename))),
+                static=np.array(json.dumps(static)),
+            )
+        os.replace(tmp_cache, cache)
+    except OSError:
+        pass
+
+
+def index_cache_path(filename: str) -> Path:
+    """Return the path of the sidecar index cache of a file. (<filename>.idx)"""
+    p = Path(filename)
+    return p.with_name(p.name + INDEX_CACHE_SUFFIX)
+
+
+def _index_cache_key(filename: str) -> tp.Dict:
+    """Key identifying a file version: path, size and modification time."""
+    stat = Path(filename).stat()
+    return dict(
+        version=INDEX_CACHE_VERSION,
+        path=str(Path(filename).resolve()),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+    )
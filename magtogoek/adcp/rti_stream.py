@@ -0,0 +1,496 @@
+"""
+Live readers for Rowetech RTB ensemble streams.
+
+The ensembles are reassembled incrementally from the stream with the
+EnsembleFramer (rti_python.Codecs.RingBufferCodec) and decoded by batches with
+the batch decoder (magtogoek.adcp.rti_decoder). A batch is a dictionary of
+arrays with a first (ensemble) axis; the same fields as the RtiReader.
+
+Usage:
+reader = EnsembleReader("localhost", 55000, batch_size=100, batch_interval=1.0)
+async for batch in reader.batches():
+    batch["vel"]  # (n_ens, n_bins, n_beams)
+
+The EnsembleBatcher decodes the ensembles of a codec (e.g. RingBufferCodec) in
+preallocated arrays reused between batches:
+batcher = EnsembleBatcher(batch_size=100, batch_interval=1.0)
+batcher.subscribe(callback)  # callback(batch)
+batcher.attach(RingBufferCodec(decode=False))
+
+follow_file prints (and plots) the ensembles appended to a growing .ENS file.
+(see RtiReader.follow)
+
+"""
+import asyncio
+import logging
+import time
+import typing as tp
+from threading import Condition, Thread
+
+import numpy as np
+from magtogoek.adcp.rti_decoder import decode_ensembles, fill_missing, layout_runs
+from magtogoek.adcp.rti_scanner import ENS_INDEX_DTYPE
+from magtogoek.adcp.rti_reader import RDI_FILL_VALUE, RTI_FILL_VALUE, RtiReader
+from nptyping import NDArray
+from rti_python.Codecs.RingBufferCodec import EnsembleFramer
+
+READ_SIZE = 2 ** 16
+
+logger = logging.getLogger(__name__)
+
+
+def decode_frames(
+    frames: tp.List[bytes], drop_data_sets: tp.Iterable[str] = ()
+) -> tp.Dict[str, NDArray]:
+    """Decode a list of verified ensembles (header + payload + checksum).
+
+    The frames must have the same layout (see rti_decoder.decode_ensembles).
+
+    Returns
+    -------
+    batch :
+        Dictionary of arrays of len(frames). See rti_decoder.decode_ensembles.
+    """
+    batch = decode_ensembles(
+        b"".join(frames), _frames_index(frames), drop_data_sets=drop_data_sets
+    )
+    rdi_fill_values(batch)
+    return batch
+
+
+def _frames_index(frames: tp.List[bytes]) -> NDArray:
+    index = np.zeros(len(frames), dtype=ENS_INDEX_DTYPE)
+    index["length"] = [len(frame) for frame in frames]
+    index["offset"][1:] = np.cumsum(index["length"][:-1])
+    return index
+
+
+def rdi_fill_values(batch: tp.Dict[str, NDArray]):
+    """Change the velocity fill values to the RDI ones in place, like the RtiReader."""
+    for k in ("vel", "bt_vel"):
+        if k in batch:
+            batch[k][batch[k] == RTI_FILL_VALUE] = RDI_FILL_VALUE
+
+
+class EnsembleReader:
+    """Asyncio reader of the RTB ensembles of a TCP source.
+
+    The connection is reopened with an exponential backoff when it fails or
+    closes. The decoded ensembles are delivered by batches of `batch_size`
+    ensembles or every `batch_interval` seconds, whichever comes first.
+
+    Parameters
+    ----------
+    host, port :
+        Address of the TCP source.
+    batch_size :
+        Maximum number of ensembles per batch.
+    batch_interval :
+        Maximum time (seconds) an ensemble waits before its batch is delivered.
+    reconnect_delay :
+        Time (seconds) before the first reconnection attempt. Doubled after each
+        failed attempt up to `max_reconnect_delay`.
+    max_reconnect_delay :
+        Maximum time (seconds) between reconnection attempts.
+    max_retries :
+        Number of consecutive failed connections before the reader stops. `None`
+        to retry forever.
+    drop_data_sets :
+        Names of the datasets not to decode. (see rti_decoder)
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 30.0,
+        max_retries: int = None,
+        drop_data_sets: tp.Iterable[str] = (),
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive int")
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_retries = max_retries
+        self.drop_data_sets = drop_data_sets
+
+        self.connections = 0
+        self.ensembles = 0
+        self.bad_ensembles = 0
+        self._stopped = False
+        self._frames = None
+        self._receiving = None
+
+    def stop(self):
+        """Stop reading. The ensembles already received are delivered.
+
+        The pending read (or reconnection delay) is cancelled, so `batches` ends
+        even if the source is idle. Must be called from the event loop thread.
+        """
+        self._stopped = True
+        if self._receiving is not None:
+            self._receiving.cancel()
+
+    async def batches(self) -> tp.AsyncIterator[tp.Dict[str, NDArray]]:
+        """Yield the decoded ensembles by batches.
+
+        Ends when `stop` is called or after `max_retries` failed connections.
+        """
+        self._frames = asyncio.Queue()
+        receiving = self._receiving = asyncio.ensure_future(self._receive())
+        try:
+            frames, deadline = [], None
+            while True:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                try:
+                    frame = await asyncio.wait_for(
+                        self._frames.get(), None if timeout is None else max(timeout, 0)
+                    )
+                except asyncio.TimeoutError:
+                    frame = b""  # Batch interval reached.
+
+                if frame:
+                    frames.append(frame)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.batch_interval
+
+                if frames and (not frame or len(frames) >= self.batch_size):
+                    # A batch is split where the layout of the ensembles changes.
+                    for run in layout_runs(
+                        b"".join(frames), _frames_index(frames), self.drop_data_sets
+                    ):
+                        yield decode_frames(frames[run], self.drop_data_sets)
+                    frames, deadline = [], None
+
+                if frame is None:  # End of the stream.
+                    break
+        finally:
+            self._stopped = True
+            receiving.cancel()
+            await asyncio.gather(receiving, return_exceptions=True)
+
+    async def run(self, callback: tp.Callable):
+        """Pass each batch to `callback(batch)`. `callback` can be a coroutine function."""
+        async for batch in self.batches():
+            result = callback(batch)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def _receive(self):
+        """Read the TCP source, reconnecting with backoff, and queue the ensembles."""
+        delay, retries = self.reconnect_delay, 0
+        try:
+            while not self._stopped:
+                try:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                except OSError as e:
+                    retries += 1
+                    if self.max_retries is not None and retries > self.max_retries:
+                        logger.warning(
+                            f"Could not connect to {self.host}:{self.port}: {e}"
+                        )
+                        break
+                    await asyncio.sleep(delay)
+                    delay = min(2 * delay, self.max_reconnect_delay)
+                    continue
+
+                delay, retries = self.reconnect_delay, 0
+                self.connections += 1
+                try:
+                    await self._read_connection(reader)
+                except OSError as e:
+                    logger.warning(f"Connection to {self.host}:{self.port} lost: {e}")
+                finally:
+                    writer.close()
+
+                if not self._stopped:
+                    await asyncio.sleep(delay)
+        finally:
+            self._frames.put_nowait(None)
+
+    async def _read_connection(self, reader: asyncio.StreamReader):
+        """Queue the ensembles of a connection until it closes."""
+        framer = EnsembleFramer()  # An ensemble can't span two connections.
+        try:
+            while not self._stopped:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                framer.feed(data)
+                frame = framer.next_ensemble()
+                while frame is not None:
+                    self.ensembles += 1
+                    self._frames.put_nowait(frame)
+                    frame = framer.next_ensemble()
+        finally:
+            self.bad_ensembles += framer.bad_ensembles
+
+
+class EnsembleBatcher:
+    """Decode binary ensembles by batches into reused columnar arrays.
+
+    The ensembles added with `add` are copied in a preallocated staging buffer.
+    A thread decodes them every `batch_size` ensembles or `batch_interval`
+    seconds, whichever comes first, and passes the batch to the subscribers.
+
+    The arrays of a batch are views on buffers reused by the next batch; copy
+    them to keep them after the callback returns. A batch is split where the
+    layout of the ensembles (e.g. the number of bins) changes and the arrays are
+    reallocated for the new layout.
+
+    Parameters
+    ----------
+    batch_size :
+        Maximum number of ensembles per batch.
+    batch_interval :
+        Maximum time (seconds) an ensemble waits before its batch is delivered.
+    drop_data_sets :
+        Names of the datasets not to decode. (see rti_decoder)
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+        drop_data_sets: tp.Iterable[str] = (),
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive int")
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.drop_data_sets = drop_data_sets
+        self.subscribers = []
+        self.batches = 0
+
+        # Two staging buffers: one is filled while the other is decoded.
+        self._staging = [np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint8)]
+        self._used = 0
+        self._lengths = []
+        self._deadline = None
+        self._index = np.zeros(batch_size, dtype=ENS_INDEX_DTYPE)
+        self._arrays = None
+        self._closed = False
+        self._condition = Condition()
+
+        self.thread = Thread(target=self._run, name="Ensemble Batcher")
+        self.thread.start()
+
+    def subscribe(self, callback: tp.Callable):
+        """Call `callback(batch)` for each batch."""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: tp.Callable):
+        self.subscribers.remove(callback)
+
+    def attach(self, codec):
+        """Batch the ensembles of a codec firing `frame_event`. (e.g. RingBufferCodec)"""
+        codec.frame_event += lambda sender, ens_bin: self.add(ens_bin)
+
+    def add(self, ens_bin: bytes):
+        """Add a verified binary ensemble. Wait while a full batch is pending."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or len(self._lengths) < self.batch_size
+            )
+            if self._closed:
+                raise ValueError("The batcher is closed.")
+            staging = self._staging[0]
+            if self._used + len(ens_bin) > staging.size:
+                size = max(2 * staging.size, self.batch_size * len(ens_bin))
+                self._staging[0] = np.resize(staging, size)
+            self._staging[0][self._used : self._used + len(ens_bin)] = np.frombuffer(
+                ens_bin, dtype=np.uint8
+            )
+            self._used += len(ens_bin)
+            self._lengths.append(len(ens_bin))
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.batch_interval
+            self._condition.notify_all()
+
+    def close(self):
+        """Deliver the pending ensembles and stop the thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (
+                    self._closed
+                    or len(self._lengths) >= self.batch_size
+                    or (self._lengths and time.monotonic() >= self._deadline)
+                ):
+                    timeout = None
+                    if self._deadline is not None:
+                        timeout = self._deadline - time.monotonic()
+                    self._condition.wait(timeout)
+
+                if not self._lengths and self._closed:
+                    break
+                # Swap the staging buffers.
+                staging, used, lengths = self._staging[0], self._used, self._lengths
+                self._staging.reverse()
+                self._used, self._lengths, self._deadline = 0, [], None
+                self._condition.notify_all()
+
+            self._deliver(staging, used, lengths)
+
+    def _deliver(self, staging: NDArray, used: int, lengths: tp.List[int]):
+        n = len(lengths)
+        index = self._index[:n]
+        index["length"] = lengths
+        index["offset"][0] = 0
+        index["offset"][1:] = np.cumsum(index["length"][:-1])
+        buffer = staging[:used]
+
+        for run in layout_runs(buffer, index, self.drop_data_sets):
+            self._deliver_run(buffer, index[run])
+
+    def _deliver_run(self, buffer: NDArray, index: NDArray):
+        """Decode and deliver ensembles of the same layout."""
+        first = decode_ensembles(buffer, index[:1], drop_data_sets=self.drop_data_sets)
+        layout = {k: (v.shape[1:], v.dtype) for k, v in first.items()}
+        if self._arrays is None or layout != {
+            k: (v.shape[1:], v.dtype) for k, v in self._arrays.items()
+        }:
+            self._arrays = {
+                k: np.empty((self.batch_size,) + v.shape[1:], dtype=v.dtype)
+                for k, v in first.items()
+            }
+
+        batch = {k: v[: len(index)] for k, v in self._arrays.items()}
+        fill_missing(batch)
+        decode_ensembles(buffer, index, out=batch, drop_data_sets=self.drop_data_sets)
+        rdi_fill_values(batch)
+
+        self.batches += 1
+        for callback in self.subscribers:
+            try:
+                callback(batch)
+            except Exception as e:
+                logger.warning(f"Batch subscriber {callback} failed: {e}")
+
+
+async def replay_server(
+    filename: str,
+    host: str = "localhost",
+    port: int = 0,
+    rate: float = None,
+    packet_size: int = 2 ** 14,
+) -> asyncio.AbstractServer:
+    """Start a TCP server replaying a .ENS file to each client.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.ENS
+    host, port :
+        Address to listen on. Port 0 picks a free port (see `server.sockets`).
+    rate :
+        Bytes per second. As fast as possible if None.
+    packet_size :
+        Bytes sent at a time.
+    """
+
+    async def replay(reader, writer):
+        with open(filename, "rb") as f:
+            data = f.read()
+        start = time.monotonic()
+        try:
+            for sent in range(0, len(data), packet_size):
+                writer.write(data[sent : sent + packet_size])
+                await writer.drain()
+                if rate:
+                    await asyncio.sleep(
+                        max(0.0, start + (sent + packet_size) / rate - time.monotonic())
+                    )
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(replay, host, port)
+
+
+def follow_file(
+    filename: str,
+    poll_interval: float = 1.0,
+    timeout: float = None,
+    plot: bool = False,
+    drop_variables: tp.List[str] = None,
+):
+    """Print a summary of the ensembles appended to a growing .ENS file.
+
+    For each poll with new ensembles: the ensemble count and time span, the
+    missing ensemble numbers, the percentage of missing velocities and the
+    depth averaged velocities of the first two beams/components. With `plot`,
+    the depth averaged velocities are also drawn in a figure updated at each poll.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.ENS being written.
+    poll_interval, timeout :
+        See RtiReader.follow.
+    plot :
+        Draw the depth averaged velocities.
+    drop_variables :
+        Variables not to read. Defaults to `amp`, `cor`, `pg`, `bt` and `nav`.
+    """
+    if drop_variables is None:
+        drop_variables = ["amp", "cor", "pg", "bt", "nav"]
+    reader = RtiReader(filename, cache=False, drop_variables=drop_variables)
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        plt.ion()
+        fig, ax = plt.subplots(figsize=(10, 4))
+        lines = [ax.plot([], [], label=name)[0] for name in ("vel1", "vel2")]
+        times, plotted = [], [[], []]
+        ax.set_ylabel("depth averaged velocity")
+        ax.legend(loc="upper left")
+
+    last_ens_num = None
+    try:
+        for block in reader.follow(poll_interval, timeout):
+            ens_num = reader.ens_index["ens_num"]
+            missing = int(np.sum(np.diff(ens_num) - 1))
+            if last_ens_num is not None:
+                missing += int(ens_num[0] - last_ens_num - 1)
+            last_ens_num = ens_num[-1]
+
+            averages, means = [], []
+            for name in ("vel1", "vel2"):
+                good = block[name] != RDI_FILL_VALUE
+                vel = np.where(good, block[name], 0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    averages.append(vel.sum(axis=1) / good.sum(axis=1))
+                    means.append(vel.sum() / good.sum())
+            bad_vel = np.mean(block.vel1 == RDI_FILL_VALUE) * 100
+
+            print(
+                f"{block.ens_count} ensembles [{ens_num[0]}-{ens_num[-1]}] "
+                f"{block.datetime[0]} to {block.datetime[-1]}, "
+                f"{missing} missing, {bad_vel:.1f}% bad velocity, "
+                f"mean vel1 {means[0]:.3f} vel2 {means[1]:.3f}"
+            )
+
+            if plot:
+                times.append(block.datetime)
+                for line, values, average in zip(lines, plotted, averages):
+                    values.append(average)
+                    line.set_data(np.concatenate(times), np.concatenate(values))
+                ax.relim()
+                ax.autoscale_view()
+                plt.pause(0.01)
+    except KeyboardInterrupt:
+        pass
@@ -8,7 +8,7 @@ from pathlib import Path
 import click
 import numpy as np
 from nptyping import NDArray
-from pandas import Timestamp, to_datetime
+from pandas import Timestamp
 
 
 def magnetic_to_true(
@@ -52,36 +52,45 @@ def magnetic_to_true(
     return true_east, true_north
 
 
-def dday_to_datetime64(dday: tp.List, yearbase: int) -> tp.Tuple[NDArray, NDArray]:
-    """Convert time recorded time to pandas time (np.datetime64[s]).
+def dday_to_datetime64(dday: tp.List, yearbase: int) -> NDArray:
+    """Convert decimal days since yearbase to datetime64[s].
 
-    Replace time coordinates with datetime64 in strftime='%Y-%m-%d %H:%M:%S'
-    Add `time_string` variables to dataset (strftime='%Y-%m-%d %H:%M:%S')
+    The time is truncated to the second.
 
     Parameters
     ----------
-    dataset:
-       FIXME
+    dday :
+        Decimal days since `yearbase`-01-01.
+    yearbase :
+        Year of the dday origin.
     """
-    start_time = Timestamp(str(yearbase) + "-01-01")
-    time = np.array(
-        to_datetime(dday, unit="D", origin=start_time, utc=True).strftime(
-            "%Y-%m-%d %H:%M:%S"
-        ),
-        dtype="datetime64[s]",
-    )
-    time_string = time.astype(str)
+    nanoseconds = np.round(np.asarray(dday, dtype=np.float64) * 86400e9)
+
+    return (
+        np.datetime64(f"{yearbase:04d}-01-01", "ns")
+        + nanoseconds.astype(np.int64).astype("m8[ns]")
+    ).astype("datetime64[s]")
 
-    return time, time_string
+
+def datetime64_to_string(time: NDArray) -> NDArray:
+    """Format datetime64 as strings `%Y-%m-%dT%H:%M:%S`."""
+    return np.datetime_as_string(np.asarray(time, dtype="datetime64[s]"), unit="s")
 
 
 def datetime_to_dday(
-    datetimes: tp.List[tp.Type[datetime]], yearbase: int = None
+    datetimes: tp.Union[NDArray, tp.List[tp.Type[datetime]]], yearbase: int = None
 ) -> NDArray:
-    """Convert sequence of datetime to an array of dday since yearbase
+    """Convert sequence of datetime (or datetime64 array) to an array of dday since yearbase
 
     If yearbase is none, default to the year of the first datetime.
     """
+    if isinstance(datetimes, np.ndarray) and datetimes.dtype.kind == "M":
+        if not yearbase:
+            yearbase = datetimes[0].astype("datetime64[Y]").astype(int) + 1970
+        return (datetimes - np.datetime64(f"{yearbase:04d}-01-01")) / np.timedelta64(
+            1, "D"
+        )
+
     yearbase = yearbase if yearbase else datetimes[0].year
 
     return (
@@ -91,6 +100,65 @@ def datetime_to_dday(
     )
 
 
+def ymdhms_to_datetime64(
+    year: NDArray,
+    month: NDArray,
+    day: NDArray,
+    hour: NDArray,
+    minute: NDArray,
+    second: NDArray,
+    hsec: NDArray = 0,
+) -> NDArray:
+    """Assemble datetime64[ns] from integer date and time fields.
+
+    Invalid dates (e.g. month 0 or day 31 of a 30 days month) are returned as NaT.
+
+    Parameters
+    ----------
+    year, month, day, hour, minute, second :
+        Arrays of integer fields.
+    hsec :
+        Hundredths of second.
+    """
+    year, month, day, hour, minute, second, hsec = np.broadcast_arrays(
+        *(
+            np.asarray(f, dtype=np.int64)
+            for f in (year, month, day, hour, minute, second, hsec)
+        )
+    )
+    valid = (
+        (year >= 1)
+        & (year <= 9999)
+        & (month >= 1)
+        & (month <= 12)
+        & (day >= 1)
+        & (day <= 31)
+        & (hour >= 0)
+        & (hour < 24)
+        & (minute >= 0)
+        & (minute < 60)
+        & (second >= 0)
+        & (second < 60)
+        & (hsec >= 0)
+        & (hsec < 100)
+    )
+    months = (np.where(valid, year, 1970) - 1970).astype("M8[Y]") + (
+        np.where(valid, month, 1) - 1
+    ).astype("m8[M]")
+    dates = months.astype("M8[D]") + (np.where(valid, day, 1) - 1).astype("m8[D]")
+    valid &= dates.astype("M8[M]") == months  # day not in month.
+
+    times = (
+        dates.astype("M8[ns]")
+        + hour.astype("m8[h]")
+        + minute.astype("m8[m]")
+        + second.astype("m8[s]")
+        + (hsec * 10).astype("m8[ms]")
+    )
+
+    return np.where(valid, times, np.datetime64("NaT", "ns"))
+
+
 def get_datetime_and_count(trim_arg: str):
     """Get datime and count from trim_arg.
 
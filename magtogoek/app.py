@@ -12,10 +12,14 @@ Usage:
 
     $ mtgk process [CONFIG_FILE]
 
+    $ mtgk qc-sweep [INPUT_FILE] [OPTIONS]
+
     $ mtgk quick [adcp, ] [INPUT_FILES] [OPTIONS] FIXME has been modified. Probably not working.
 
     $ mtgk check [rti, ] [INPUT_FILES]
 
+    $ mtgk check follow [INPUT_FILE] [OPTIONS]
+
 
 
 NOTE
@@ -68,6 +72,10 @@ ADCP_CONFIG_STRUCT = {
     "magnetic_declination": "ADCP_PROCESSING",
     "sensor_depth": "ADCP_PROCESSING",
     "keep_bt": "ADCP_PROCESSING",
+    "rti_workers": "ADCP_PROCESSING",
+    "rti_chunk_size": "ADCP_PROCESSING",
+    "navigation_workers": "ADCP_PROCESSING",
+    "checkpoint_dir": "ADCP_PROCESSING",
     "quality_control": "ADCP_QUALITY_CONTROL",
     "amplitude_threshold": "ADCP_QUALITY_CONTROL",
     "percentgood_threshold": "ADCP_QUALITY_CONTROL",
@@ -89,6 +97,7 @@ ADCP_CONFIG_STRUCT = {
     "drop_amplitude": "ADCP_OUTPUT",
     "make_figures": "ADCP_OUTPUT",
     "make_log": "ADCP_OUTPUT",
+    "keep_qc_tests": "ADCP_OUTPUT",
 }
 
 CONFIG_NAME_TRANSLATOR = dict(
@@ -167,6 +176,212 @@ def process(config_file, info):
         process_adcp(config)
 
 
+def _thresholds_list(ctx, param, value):
+    """Parse comma separated thresholds. (e.g. `20,30,40`)"""
+    if value is None:
+        return []
+    try:
+        return [float(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise click.BadParameter("Thresholds must be comma separated numbers.")
+
+
+@magtogoek.command("qc-sweep")
+@click.option(
+    "--info", is_flag=True, callback=_print_info, help="Show command information"
+)
+@click.argument("input_file", metavar="[input_file]", type=click.Path(exists=True))
+@click.option(
+    "-a",
+    "--amplitude",
+    callback=_thresholds_list,
+    help="Amplitude thresholds. (e.g. `20,30,40`)",
+)
+@click.option(
+    "-c", "--correlation", callback=_thresholds_list, help="Correlation thresholds."
+)
+@click.option(
+    "-u", "--percentgood", callback=_thresholds_list, help="Percent good thresholds."
+)
+@click.option(
+    "--horizontal-velocity",
+    callback=_thresholds_list,
+    help="Horizontal velocity thresholds (m/s).",
+)
+@click.option(
+    "--vertical-velocity",
+    callback=_thresholds_list,
+    help="Vertical velocity thresholds (m/s).",
+)
+@click.option(
+    "--error-velocity", callback=_thresholds_list, help="Error velocity thresholds (m/s)."
+)
+@click.option("-r", "--roll", callback=_thresholds_list, help="Roll thresholds (degree).")
+@click.option(
+    "-p", "--pitch", callback=_thresholds_list, help="Pitch thresholds (degree)."
+)
+@click.option(
+    "--sidelobes/--no-sidelobes",
+    help="Do side lobe correction.",
+    default=True,
+    show_default=True,
+)
+@click.option(
+    "-d",
+    "--bottom-depth",
+    type=click.FLOAT,
+    help="If provided, this fixed depth will be used for sidelobes correction.",
+    default=None,
+)
+@click.option(
+    "-m",
+    "--motion_correction_mode",
+    help="Corrects motion with bottomTrack `bt` or navigation `nav`.",
+    default=None,
+    type=click.Choice(["bt", "nav"]),
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(),
+    default=None,
+    help="Write the table to a `.csv` file.",
+)
+@click.option(
+    "--plot",
+    is_flag=True,
+    default=False,
+    help="Plot the flagged percentage per depth of each swept test.",
+)
+def qc_sweep(input_file, info, **options):
+    """Flagged percentages of ADCP data for a grid of QC thresholds."""
+    from magtogoek.adcp.qc_sweep import SWEEP_TESTS, qc_sweep
+
+    qc_sweep(
+        input_file,
+        {test: options[test] for test in SWEEP_TESTS},
+        output=options["output"],
+        plot=options["plot"],
+        motion_correction_mode=options["motion_correction_mode"],
+        sidelobes_correction=options["sidelobes"],
+        bottom_depth=options["bottom_depth"],
+    )
+
+
+@magtogoek.command("qc")
+@click.option(
+    "--info", is_flag=True, callback=_print_info, help="Show command information"
+)
+@click.argument("input_file", metavar="[input_file]", type=click.Path(exists=True))
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(),
+    default=None,
+    help="Output netcdf file. Defaults to `<input_file>_qc.nc`.",
+)
+@click.option(
+    "-a", "--amplitude-threshold", type=click.FLOAT, default=0, show_default=True
+)
+@click.option(
+    "-p", "--percentgood-threshold", type=click.FLOAT, default=90, show_default=True
+)
+@click.option(
+    "-c", "--correlation-threshold", type=click.FLOAT, default=64, show_default=True
+)
+@click.option(
+    "-u",
+    "--horizontal-velocity-threshold",
+    type=click.FLOAT,
+    help="[m/s]",
+    default=5,
+    show_default=True,
+)
+@click.option(
+    "-w",
+    "--vertical-velocity-threshold",
+    type=click.FLOAT,
+    help="[m/s]",
+    default=5,
+    show_default=True,
+)
+@click.option(
+    "-e",
+    "--error-velocity-threshold",
+    type=click.FLOAT,
+    help="[m/s]",
+    default=5,
+    show_default=True,
+)
+@click.option(
+    "-r", "--roll-threshold", type=click.FLOAT, help="[degree]", default=20, show_default=True
+)
+@click.option(
+    "-P", "--pitch-threshold", type=click.FLOAT, help="[degree]", default=20, show_default=True
+)
+@click.option(
+    "--sidelobes/--no-sidelobes",
+    help="Do side lobe correction.",
+    default=True,
+    show_default=True,
+)
+@click.option(
+    "-d",
+    "--bottom-depth",
+    type=click.FLOAT,
+    help="If provided, this fixed depth will be used for sidelobes correction.",
+    default=None,
+)
+@click.option(
+    "-m",
+    "--motion_correction_mode",
+    help="Corrects motion with bottomTrack `bt` or navigation `nav`.",
+    default=None,
+    type=click.Choice(["bt", "nav"]),
+)
+@click.option(
+    "--keep-qc-tests/--no-keep-qc-tests",
+    help="Add the bit field of the failed velocity tests (vel_qc_tests).",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--block-size",
+    type=click.INT,
+    help="Number of time read at once.",
+    default=None,
+)
+def qc(input_file, info, **options):
+    """Quality control an ADCP netcdf file without loading it in memory.
+
+    The variables must have the generic names (u, v, w, e, amp1, ...). (e.g.
+    `mtgk process` with `quality_control` and `bodc_name` False)
+    """
+    from magtogoek.adcp.quality_control import QC_BLOCK_SIZE, quality_control_netcdf
+
+    output = options["output"]
+    if not output:
+        p = Path(input_file)
+        output = str(p.with_name(p.stem + "_qc.nc"))
+    quality_control_netcdf(
+        input_file,
+        output,
+        block_size=options["block_size"] or QC_BLOCK_SIZE,
+        amp_th=options["amplitude_threshold"],
+        corr_th=options["correlation_threshold"],
+        pg_th=options["percentgood_threshold"],
+        roll_th=options["roll_threshold"],
+        pitch_th=options["pitch_threshold"],
+        horizontal_vel_th=options["horizontal_velocity_threshold"],
+        vertical_vel_th=options["vertical_velocity_threshold"],
+        error_vel_th=options["error_velocity_threshold"],
+        motion_correction_mode=options["motion_correction_mode"],
+        sidelobes_correction=options["sidelobes"],
+        bottom_depth=options["bottom_depth"],
+        keep_qc_tests=options["keep_qc_tests"],
+    )
+
+
 # --------------------------- #
 #        mtgk groups          #
 # --------------------------- #
@@ -338,12 +553,71 @@ def quick_adcp(
     type=click.Path(exists=True),
     required=True,
 )
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(),
+    default=None,
+    help="Write a summary of the files to a `.json` or `.csv` file.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.INT,
+    default=None,
+    help="Number of processes used to index the files.",
+)
 @click.pass_context
 def check_rti(ctx, input_files, **options):
     """Prints info about RTI .ENS files."""
     from magtogoek.adcp.rti_reader import RtiReader
 
-    RtiReader(input_files).check_files()
+    RtiReader(input_files, workers=options["workers"]).check_files(
+        output=options["output"]
+    )
+
+
+@check.command("follow")
+@click.option(
+    "--info", is_flag=True, callback=_print_info, help="Show command information"
+)
+@click.argument(
+    "input_file",
+    metavar="[input_file]",
+    type=click.Path(exists=True),
+    required=True,
+)
+@click.option(
+    "-p",
+    "--poll-interval",
+    type=click.FLOAT,
+    default=1.0,
+    help="Time in seconds between polls of the file.",
+)
+@click.option(
+    "-t",
+    "--timeout",
+    type=click.FLOAT,
+    default=None,
+    help="Stop after this time in seconds without new ensembles.",
+)
+@click.option(
+    "--plot",
+    is_flag=True,
+    default=False,
+    help="Plot the depth averaged velocities.",
+)
+@click.pass_context
+def check_follow(ctx, input_file, **options):
+    """Prints info about the ensembles appended to a RTI .ENS file being written."""
+    from magtogoek.adcp.rti_stream import follow_file
+
+    follow_file(
+        input_file,
+        poll_interval=options["poll_interval"],
+        timeout=options["timeout"],
+        plot=options["plot"],
+    )
 
 
 @compute.command("nav", context_settings=CONTEXT_SETTINGS)
@@ -371,6 +645,18 @@ def check_rti(ctx, input_files, **options):
     default=1,
     help="Length of the averaging window.",
 )
+@click.option(
+    "--workers",
+    type=click.INT,
+    default=1,
+    help="Number of processes used to parse the nmea files.",
+)
+@click.option(
+    "--gpx-backend",
+    type=click.Choice(["iterparse", "gpxpy"]),
+    default="iterparse",
+    help="Parser of the gpx files.",
+)
 @click.pass_context
 def navigation(ctx, input_files, **options):
     """Command to compute u_ship, v_ship, bearing from gsp data."""
@@ -380,6 +666,8 @@ def navigation(ctx, input_files, **options):
         filenames=input_files,
         output_name=options["output_name"],
         window=options["window"],
+        workers=options["workers"],
+        gpx_backend=options["gpx_backend"],
     )
 
 
@@ -482,6 +770,11 @@ def _print_arguments(group, parent):
             + "Command process data with configuration files",
             fg="white",
         )
+        click.secho(
+            "  qc-sweep".ljust(20, " ")
+            + "Command to sweep the adcp quality control thresholds",
+            fg="white",
+        )
         click.secho(
             "  quick".ljust(20, " ") + "Command to quickly process data files",
             fg="white",
@@ -511,6 +804,13 @@ def _print_arguments(group, parent):
             fg="white",
         )
 
+    if group == "qc-sweep":
+        click.secho(
+            "  [input_file]".ljust(20, " ")
+            + "Filename (path/to/file) of the adcp netcdf file.",
+            fg="white",
+        )
+
     if group == "compute":
         click.secho(
             "  nav".ljust(20, " ")
@@ -530,6 +830,11 @@ def _print_arguments(group, parent):
             "  rti".ljust(20, " ") + "Print information on the rti .ens files. ",
             fg="white",
         )
+        click.secho(
+            "  follow".ljust(20, " ")
+            + "Print information on the ensembles appended to a rti .ens file.",
+            fg="white",
+        )
 
     if group == "adcp":
         click.secho(
@@ -565,6 +870,13 @@ def _print_description(group):
   relative path where used in the configuration file, they are relative to directory
   where the command is called and not where the configuration file is located."""
         )
+    if group == "qc-sweep":
+        click.echo(
+            """  Fraction of the velocities flagged for every combination of the given quality
+  control thresholds (comma separated), per depth. The tested quantities are binned once,
+  so adding thresholds is cheap. The input netcdf file must have the generic variable
+  names and not be quality controlled (`quality_control` and `bodc_name` False)."""
+        )
     if group == "check":
         click.echo(
             """Print somes raw files informations. Only available for adcp RTI .ENS files."""
@@ -581,6 +893,12 @@ def _print_description(group):
            sw_pd0 : SeaWatch (RTI in RDI pd0 file format)
         """
         )
+    if group == "follow":
+        click.echo(
+            """  Follow a RTI .ENS file being written. At each poll, only the appended ensembles
+  are read and summarized; ensemble count, missing ensembles, percentage of bad velocity
+  and depth averaged velocities. Use `--plot` to plot the depth averaged velocities."""
+        )
     if group == "nav":
         click.echo(
             """ Compute u_ship (eastward velocity), v_ship (northward velocity) and the bearing
@@ -597,13 +915,15 @@ def _print_usage(group, parent):
     _parent = parent.info_name if parent else ""
 
     if group == "mtgk":
-        click.echo("  mtgk [config, process, quick, check]")
+        click.echo("  mtgk [config, process, qc-sweep, quick, check]")
     if group == "config":
         click.echo("  mtgk config [adcp, platform,] [CONFIG_NAME] [OPTIONS]")
     if group == "platform":
         click.echo(f"  mtgk config platform [FILENAME] [OPTIONS]")
     if group == "process":
         click.echo("  mtgk process [CONFIG_FILE] [OPTIONS]")
+    if group == "qc-sweep":
+        click.echo("  mtgk qc-sweep [INPUT_FILE] [OPTIONS]")
     if group == "quick":
         click.echo("  mtgk quick [adcp, ] [FILENAME,...] [OPTIONS]")
     if group == "adcp":
@@ -612,8 +932,10 @@ def _print_usage(group, parent):
         if _parent == "quick":
             click.echo(f"  mtgk quick adcp [INPUT_FILES] [SONAR] [YEARBASE] [OPTIONS]")
     if group == "check":
-        click.echo(f"  mtgk check [rti,] [INPUT_FILES] ")
+        click.echo(f"  mtgk check [rti, follow] [INPUT_FILES] ")
     if group == "rti":
         click.echo(f"  mtgk check rti [INPUT_FILES] ")
+    if group == "follow":
+        click.echo(f"  mtgk check follow [INPUT_FILE] [OPTIONS]")
     if group == "nav":
         click.echo(f"  mtgk compute nav [INPUT_FILES] ")
@@ -272,11 +272,46 @@ def adcp_options(input_files=True, yearbase=True, sonar=True):
     [default: --bodc-name]""",
             default=True,
         ),
+        click.option(
+            "--keep-qc-tests/--drop-qc-tests",
+            help="""Keep the bit field of the failed velocity quality control
+    tests (vel_qc_tests) in the output dataset. [default: --drop-qc-tests]""",
+            default=False,
+        ),
         click.option(
             "--keep_bt/--discard-bt",
             help="""Weather to use or discard the bottom (bt) track data.""",
             default=True,
             show_default=True,
         ),
+        click.option(
+            "--rti-workers",
+            type=click.INT,
+            help="""Number of processes used to decode RTI ENS files.
+    Defaults to the number of cpu - 1.""",
+            default=None,
+        ),
+        click.option(
+            "--rti-chunk-size",
+            type=click.INT,
+            help="""Number of RTI ensembles decoded by a process at a time.
+    Defaults to 1000.""",
+            default=None,
+        ),
+        click.option(
+            "--navigation-workers",
+            type=click.INT,
+            help="""Number of processes used to parse the nmea navigation files.
+    Defaults to 1.""",
+            default=None,
+        ),
+        click.option(
+            "--checkpoint-dir",
+            type=click.Path(file_okay=False),
+            help="""Directory where the loaded data are checkpointed. The next
+    runs resume from the checkpoints if the inputs and the loading parameters
+    did not change.""",
+            default=None,
+        ),
     ]
     return options
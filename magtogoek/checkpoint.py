@@ -0,0 +1,174 @@
+"""
+Checkpoints of the intermediate datasets of the processing.
+
+A checkpoint is an uncompressed `.npz` file of the dataset variables and a
+`.json` file of its metadata (dimensions, coordinates, attributes). It is
+identified by a stage name (e.g. `load`) and a key: the hash of everything the
+stage depends on, the input files (path, size, modification time) and the
+parameters. A checkpoint is only loaded if its key matches, so changing an
+input file or one of the parameters makes the stage run again. Only the last
+saved checkpoint of each stage is kept.
+
+Usage:
+key = checkpoint_key(files=files_signature(input_files), yearbase=2021)
+dataset = load_checkpoint(directory, "load", key)
+if dataset is None:
+    dataset = ...
+    save_checkpoint(dataset, directory, "load", key)
+"""
+import hashlib
+import json
+import os
+import re
+import typing as tp
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+from magtogoek.utils import get_files_from_expresion
+
+CHECKPOINT_FORMAT = 1
+KEY_PREFIX_SIZE = 16  # Number of hex digits of the key in the checkpoint file names.
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def checkpoint_key(**items) -> str:
+    """Hash (hex) of the json representation of `items`."""
+    text = json.dumps(items, sort_keys=True, default=_key_default)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def files_signature(filenames: tp.Union[str, tp.List[str]]) -> tp.List[tp.List]:
+    """Path, size and modification time (ns) of the files of an expression."""
+    signature = []
+    for filename in get_files_from_expresion(filenames):
+        stat = Path(filename).stat()
+        signature.append([str(Path(filename).resolve()), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def checkpoint_paths(directory: str, stage: str, key: str) -> tp.Tuple[Path, Path]:
+    """Data (.npz) and metadata (.json) files of a checkpoint."""
+    stem = Path(directory) / f"{stage}_{key[:KEY_PREFIX_SIZE]}"
+    return stem.with_suffix(".npz"), stem.with_suffix(".json")
+
+
+def save_checkpoint(dataset: tp.Type[xr.Dataset], directory: str, stage: str, key: str):
+    """Write the dataset variables and metadata to a checkpoint.
+
+    The metadata are written last; an incomplete checkpoint is never valid. The
+    checkpoints of the same stage with other keys are then removed.
+
+    Raises
+    ------
+    CheckpointError :
+        If a variable or an attribute can't be saved as is (e.g. an attribute
+        that is not a number, a string, a list or an array).
+    """
+    arrays, variables = dict(), dict()
+    for name, variable in dataset.variables.items():
+        values = variable.values
+        if values.dtype == object:
+            if not all(isinstance(v, str) for v in values.flat):
+                raise CheckpointError(f"Variable {name} of objects can't be saved.")
+            values = values.astype(str)
+        arrays[name] = values
+        variables[name] = dict(
+            dims=variable.dims, attrs=variable.attrs, object=variable.dtype == object
+        )
+    metadata = dict(
+        format=CHECKPOINT_FORMAT,
+        stage=stage,
+        key=key,
+        coords=list(dataset.coords),
+        attrs=dataset.attrs,
+        variables=variables,
+    )
+    text = _to_json(metadata)
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    data_path, metadata_path = checkpoint_paths(directory, stage, key)
+    for path, write in (
+        (data_path, lambda f: np.savez(f, **arrays)),
+        (metadata_path, lambda f: f.write(text.encode())),
+    ):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    _remove_other_checkpoints(directory, stage, key)
+
+
+def _remove_other_checkpoints(directory: str, stage: str, key: str):
+    """Remove the checkpoints of `stage` with another key.
+
+    The metadata are removed first, so a partly removed checkpoint is never valid.
+    """
+    pattern = re.compile(re.escape(stage) + "_[0-9a-f]{%d}" % KEY_PREFIX_SIZE)
+    kept = checkpoint_paths(directory, stage, key)[0].stem
+    stems = {
+        path.stem
+        for path in Path(directory).glob(f"{stage}_*")
+        if path.suffix in (".json", ".npz")
+        and pattern.fullmatch(path.stem)
+        and path.stem != kept
+    }
+    for stem in sorted(stems):
+        for suffix in (".json", ".npz"):
+            try:
+                os.remove(Path(directory) / (stem + suffix))
+            except OSError:
+                pass
+
+
+def load_checkpoint(directory: str, stage: str, key: str) -> tp.Optional[xr.Dataset]:
+    """Dataset of a checkpoint. None if there is no valid checkpoint for the key."""
+    data_path, metadata_path = checkpoint_paths(directory, stage, key)
+    if not (data_path.is_file() and metadata_path.is_file()):
+        return None
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        if metadata["format"] != CHECKPOINT_FORMAT or metadata["key"] != key:
+            return None
+        with np.load(data_path) as arrays:
+            variables = {
+                name: xr.Variable(
+                    var["dims"],
+                    arrays[name].astype(object) if var["object"] else arrays[name],
+                    var["attrs"],
+                )
+                for name, var in metadata["variables"].items()
+            }
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+    coords = {name: variables.pop(name) for name in metadata["coords"]}
+    return xr.Dataset(variables, coords=coords, attrs=metadata["attrs"])
+
+
+def _to_json(metadata: tp.Dict) -> str:
+    return json.dumps(metadata, indent=1, default=_json_default)
+
+
+def _json_default(value):
+    """Numpy values as python values. Other objects can't be saved."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise CheckpointError(f"Attribute value {value!r} can't be saved.")
+
+
+def _key_default(value):
+    """Numpy values as python values. Other objects as their string, they are only
+    hashed."""
+    try:
+        return _json_default(value)
+    except CheckpointError:
+        return str(value)
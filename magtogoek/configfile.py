@@ -25,6 +25,10 @@ ADCP PROCESSING:
 -yearbase: year that the sampling started. ex: `1970`
 -adcp_orientation: `down` or `up`. (horizontal no supported)
 -sonar:  Must be one of `wh`, `os`, `bb`, `nb` or `sw`
+-rti_workers: number of processes used to decode RTI files. Blank for number of cpu - 1.
+-rti_chunk_size: number of RTI ensembles decoded by a process at a time.
+-navigation_workers: number of processes used to parse the nmea navigation files.
+-checkpoint_dir: directory of the checkpoints of the loaded data. Blank for no checkpoints.
 
 ADCP_QUALITY_CONTROL:
 If quality_control is `False`, no quality control is carried out.
@@ -33,6 +37,7 @@ Blanks are omitted or set False.
 ADCP_OUTPUT:
 Set True or False.
 If bodc_name False, generic variable names are used.
+If keep_qc_tests True, the bit field of the failed velocity tests is kept (vel_qc_tests).
 FIXME
 """
 
@@ -115,6 +120,10 @@ ADCP_CONFIG = dict(
         "magnetic_declination": "",
         "sensor_depth": "",
         "keep_bt": True,
+        "rti_workers": "",
+        "rti_chunk_size": 1000,
+        "navigation_workers": 1,
+        "checkpoint_dir": "",
     },
     ADCP_QUALITY_CONTROL={
         "quality_control": True,
@@ -141,6 +150,7 @@ ADCP_CONFIG = dict(
         "drop_amplitude": True,
         "make_figures": True,
         "make_log": True,
+        "keep_qc_tests": False,
     },
 )
 ADCP_CONFIG_TYPES = dict(
@@ -152,6 +162,10 @@ ADCP_CONFIG_TYPES = dict(
         "magnetic_declination": float,
         "sensor_depth": float,
         "keep_bt": bool,
+        "rti_workers": int,
+        "rti_chunk_size": int,
+        "navigation_workers": int,
+        "checkpoint_dir": str,
     },
     ADCP_QUALITY_CONTROL={
         "quality_control": bool,
@@ -178,6 +192,7 @@ ADCP_CONFIG_TYPES = dict(
         "drop_amplitude": bool,
         "make_figures": bool,
         "make_log": bool,
+        "keep_qc_tests": bool,
     },
 )
 
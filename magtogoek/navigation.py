@@ -11,23 +11,42 @@ compute_navigation:
     average window could do the trick.
 """
 
+import re
 import typing as tp
 import warnings
+from multiprocessing import Pool
 from pathlib import Path
+from xml.etree.ElementTree import iterparse
 
 import gpxpy
 import matplotlib.pyplot as plt
 import numpy as np
-import pynmea2
 import xarray as xr
-
-from magtogoek.tools import get_gps_bearing, vincenty
+from nptyping import NDArray
+
+from magtogoek.adcp.tools import ymdhms_to_datetime64
+from magtogoek.nmea import (
+    dm_to_sd,
+    hex_to_int,
+    parse_decimals,
+    split_fields,
+    time_of_day,
+    xor_checksums,
+)
+from magtogoek.tools import nans, vincenty_inverse
 from magtogoek.utils import Logger, get_files_from_expresion
 
 l = Logger(level=0)
 
 
 FILE_FORMATS = [".log", ".gpx", ".nc"]
+NMEA_CHUNK_SIZE = 2 ** 22  # bytes
+GPX_BACKENDS = ["gpxpy", "iterparse"]
+GPX_CHUNK_SIZE = 2 ** 16  # track points
+GPX_TIME_ZONE = re.compile(r"(Z|[+-][0-9]{2}:?[0-9]{2})$")
+# Number of fields parsed after the sentence type: GGA (time, lat, N/S, lon, E/W),
+# ZDA (time, day, month, year), RMC (time, ..., ddmmyy).
+NMEA_FIELDS_COUNT = {b"GGA": 5, b"ZDA": 4, b"RMC": 9}
 GPS_VARIABLES_NAME = ["lon", "lat", "time"]
 VARIABLE_TRANSLATOR = dict(
     time=["Time", "TIME", "T", "t"],
@@ -36,10 +55,18 @@ VARIABLE_TRANSLATOR = dict(
 )
 
 
-def load_navigation(filenames):
+def load_navigation(filenames, workers: int = 1, gpx_backend: str = "iterparse"):
     """Load gps data from  `nmea`, `gpx` or `netcdf` file format.
     Returns a xarray.Dataset with the loaded data.
+
+    `workers` processes parse the shards of the nmea files.
+
+    The gpx files are streamed with `iterparse` (default) or parsed with `gpxpy`.
+    With `iterparse`, the memory used by the parsing stays flat regardless of the
+    track length.
     """
+    if gpx_backend not in GPX_BACKENDS:
+        raise ValueError(f"gpx_backend must be one of {GPX_BACKENDS}.")
 
     filenames = get_files_from_expresion(filenames)
 
@@ -62,9 +89,9 @@ def load_navigation(filenames):
             dataset = xr.open_dataset(filename)
             dataset = _check_variables_names(dataset)
         elif ext == ".gpx":
-            dataset = _load_gps(filename, file_type="gpx")
+            dataset = _load_gps(filename, file_type="gpx", gpx_backend=gpx_backend)
         elif ext == ".log":
-            dataset = _load_gps(filename, file_type="nmea")
+            dataset = _load_gps(filename, file_type="nmea", workers=workers)
         else:
             dataset = None
 
@@ -77,17 +104,22 @@ def load_navigation(filenames):
         return None
 
 
-def _load_gps(filename: str, file_type: str) -> tp.Type[xr.Dataset]:
+def _load_gps(
+    filename: str, file_type: str, workers: int = 1, gpx_backend: str = "iterparse"
+) -> tp.Type[xr.Dataset]:
     """Load navigation data `lon`, `lat` and `time` from a gpx or nmea file format."""
     if file_type == "gpx":
-        gps_data = _read_gpx(filename)
+        if gpx_backend == "iterparse":
+            gps_data = _stream_gpx(filename)
+        else:
+            gps_data = _read_gpx(filename)
     if file_type == "nmea":
-        gps_data = _read_nmea(filename)
+        gps_data = _read_nmea(filename, workers=workers)
 
     dataset = xr.Dataset(
         {"lon": (["time"], gps_data["lon"]), "lat": (["time"], gps_data["lat"])},
         coords={"time": gps_data["time"]},
-        attrs={"filename": Path(filename).absolute()},
+        attrs={"filename": str(Path(filename).absolute())},
     )
     return dataset.sortby("time")
 
@@ -110,26 +142,304 @@ def _read_gpx(filename: str) -> tp.Dict:
     return gps_data
 
 
-def _read_nmea(filename: str) -> tp.Dict:
-    """Load gps_dataigation data `lon`, `lat` and `time` from a NMEA file.
+def _stream_gpx(filename: str, chunk_size: int = GPX_CHUNK_SIZE) -> tp.Dict:
+    """Load navigation data `lon`, `lat` and `time` from a gpx file with iterparse.
+    Returns a dictionnary with the loaded data. (see _iter_gpx)
+    """
+    chunks = list(_iter_gpx(filename, chunk_size)) or [_gpx_chunk(0)]
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def _iter_gpx(filename: str, chunk_size: int = GPX_CHUNK_SIZE) -> tp.Iterator[tp.Dict]:
+    """Yield the `time`, `lon` and `lat` of the track points of a gpx file by
+    chunks of at most `chunk_size` points.
+
+    The document is parsed incrementally and the track points are cleared once
+    read, so the memory used stays flat regardless of the track length. Like
+    gpxpy, only the track points (`trkpt`) are read and the time zones are
+    dropped without conversion. Points without time are NaT.
+    """
+    chunk, count = _gpx_chunk(chunk_size), 0
+    segment = None
+    for event, element in iterparse(filename, events=("start", "end")):
+        tag = element.tag.rsplit("}", 1)[-1]  # Drop the namespace.
+        if event == "start":
+            if tag == "trkseg":
+                segment = element
+            continue
+        if tag != "trkpt":
+            continue
+
+        chunk["lon"][count] = float(element.get("lon"))
+        chunk["lat"][count] = float(element.get("lat"))
+        chunk["time"][count] = _gpx_time(element)
+        count += 1
+        if segment is not None:
+            segment.clear()  # Drops the points already read.
+        if count == chunk_size:
+            yield chunk
+            chunk, count = _gpx_chunk(chunk_size), 0
+
+    if count:
+        yield {k: v[:count] for k, v in chunk.items()}
+
+
+def _gpx_chunk(size: int) -> tp.Dict:
+    """Return preallocated arrays of `size` gpx track points."""
+    return dict(
+        time=np.full(size, np.datetime64("NaT", "ns")), lon=nans(size), lat=nans(size)
+    )
+
+
+def _gpx_time(point) -> np.datetime64:
+    """Return the time of a gpx track point without its time zone."""
+    for child in point:
+        if child.tag.rsplit("}", 1)[-1] == "time" and child.text:
+            return np.datetime64(GPX_TIME_ZONE.sub("", child.text.strip()), "ns")
+    return np.datetime64("NaT", "ns")
+
+
+def _read_nmea(
+    filename: str, workers: int = 1, chunk_size: int = NMEA_CHUNK_SIZE
+) -> tp.Dict:
+    """Load navigation data `lon`, `lat` and `time` from a NMEA file.
     Returns a dictionnary with the loaded data.
+
+    The file is read by chunks of `chunk_size` bytes. Only the GGA (position),
+    ZDA and RMC (date) sentences are parsed, all the sentences of a chunk at
+    once. (see magtogoek.nmea) Lines with a bad checksum or malformed are skipped
+    and counted. The times of the GGA fixes are their time of day on the date of
+    the nearest preceding ZDA/RMC sentence (the following one for the fixes
+    before the first date).
+
+    Parameters
+    ----------
+    workers :
+        Number of processes parsing shards of the file.
+    chunk_size :
+        Number of bytes read at a time.
     """
-    gps_data = dict(time=[], lon=[], lat=[])
-    with open(filename, "r") as f:
-        for line in f.readlines():
-            m = pynmea2.parse(line)
-            if m.sentence_type == "GGA":
-                gps_data["lon"].append(m.longitude)
-                gps_data["lat"].append(m.latitude)
-            if m.sentence_type == "ZDA":
-                gps_data["time"].append(np.datetime64(m.datetime.replace(tzinfo=None)))
+    size = Path(filename).stat().st_size
+    workers = max(1, min(workers or 1, size // chunk_size + 1))
+    shards = _nmea_shards(filename, size, workers) or [(0, 0)]
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            parsed = pool.starmap(
+                _parse_nmea_shard, [(filename, *s, chunk_size) for s in shards]
+            )
+    else:
+        parsed = [_parse_nmea_shard(filename, *s, chunk_size) for s in shards]
+
+    sentences = {k: np.concatenate([p[0][k] for p in parsed]) for k in parsed[0][0]}
+    counts = {k: sum(p[1][k] for p in parsed) for k in parsed[0][1]}
+
+    gps_data = _date_gga_fixes(sentences, counts)
+
+    if counts["bad_checksum"] or counts["malformed"]:
+        l.warning(
+            f"{filename}: {counts['bad_checksum']} sentences with a bad checksum and "
+            f"{counts['malformed']} malformed sentences were skipped."
+        )
+    if counts["undated"]:
+        l.warning(f"{filename}: {counts['undated']} GGA fixes without date (ZDA/RMC).")
+    if counts["no_fix"]:
+        l.log(f"{filename}: {counts['no_fix']} GGA sentences without position.")
+
     return gps_data
 
 
+def _nmea_shards(filename: str, size: int, n: int) -> tp.List[tp.Tuple[int, int]]:
+    """Split a file in `n` byte ranges starting at the beginning of a line."""
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, n):
+            f.seek(max(size * i // n, bounds[-1]))
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def _parse_nmea_shard(
+    filename: str, start: int, stop: int, chunk_size: int = NMEA_CHUNK_SIZE
+) -> tp.Tuple[tp.Dict, tp.Dict]:
+    """Parse the GGA, ZDA and RMC sentences of a byte range of a NMEA file.
+
+    Returns
+    -------
+    sentences :
+        Arrays in file order; is_gga, time_of_day, date (NaT for GGA),
+        lon, lat (NaN for ZDA/RMC).
+    counts :
+        Number of bad_checksum, malformed, no_fix sentences.
+    """
+    chunks, counts = [], dict(bad_checksum=0, malformed=0, no_fix=0)
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remainder = b""
+        while start < stop:
+            data = f.read(min(chunk_size, stop - start))
+            if not data:
+                break
+            start += len(data)
+            data = remainder + data
+            end = data.rfind(b"\n") + 1  # Lines are not split between chunks.
+            if end:
+                chunks.append(_parse_nmea_chunk(data[:end], counts))
+            remainder = data[end:]
+        if remainder:
+            chunks.append(_parse_nmea_chunk(remainder, counts))
+
+    if not chunks:
+        chunks = [_parse_nmea_chunk(b"", counts)]
+
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}, counts
+
+
+def _parse_nmea_chunk(chunk: bytes, counts: tp.Dict) -> tp.Dict:
+    """Parse the GGA, ZDA and RMC sentences of a chunk of complete lines.
+
+    The sentences are located, checked and parsed on the bytes of the chunk
+    with NumPy, all at once. (see magtogoek.nmea)
+    """
+    data = np.frombuffer(chunk + b"\n", dtype=np.uint8)
+
+    starts = np.flatnonzero(data[:-7] == ord("$")) + 1
+    sentence_types = data[starts[:, None] + np.arange(2, 5)].copy().view("S3")[:, 0]
+    selected = (
+        np.isin(sentence_types, list(NMEA_FIELDS_COUNT))
+        & (data[starts + 5] == ord(","))
+        & _is_upper(data[starts])
+        & _is_upper(data[starts + 1])
+    )
+    starts, sentence_types = starts[selected], sentence_types[selected]
+    n = starts.size
+    if n == 0:
+        return _nmea_sentences(0)
+
+    # A sentence ends at the checksum, at the end of the line or at the next `$`.
+    terminators = np.flatnonzero(
+        (data == ord("*")) | (data == ord("\n")) | (data == ord("\r")) | (data == ord("$"))
+    )
+    stops = terminators[np.searchsorted(terminators, starts)]
+
+    has_checksum = data[stops] == ord("*")
+    expected = hex_to_int(
+        data[np.minimum(stops[has_checksum, None] + (1, 2), data.size - 1)]
+    )
+    valid = np.ones(n, dtype=bool)
+    valid[has_checksum] = expected == xor_checksums(
+        data, starts[has_checksum], stops[has_checksum]
+    )
+    counts["bad_checksum"] += int(n - valid.sum())
+
+    field_starts, field_ends, complete = split_fields(
+        data, starts, stops, max(NMEA_FIELDS_COUNT.values()) + 1
+    )
+
+    sentences = _nmea_sentences(n)
+    sentences["is_gga"] = sentence_types == b"GGA"
+    for sentence_type, count in NMEA_FIELDS_COUNT.items():
+        # The first field is the talker and sentence type (e.g. `GPGGA`).
+        selected = valid & (sentence_types == sentence_type)
+        malformed = selected & (complete <= count)
+        counts["malformed"] += int(malformed.sum())
+        index = np.flatnonzero(selected & ~malformed)
+        if index.size == 0:
+            continue
+
+        def number(i):
+            return parse_decimals(data, field_starts[index, i], field_ends[index, i])
+
+        def letter(i):
+            single = field_ends[index, i] - field_starts[index, i] == 1
+            return np.where(single, data[field_starts[index, i]], 0)
+
+        sentences["time_of_day"][index] = time_of_day(number(1))
+        if sentence_type == b"GGA":
+            sentences["lat"][index] = dm_to_sd(number(2)) * np.where(
+                letter(3) == ord("S"), -1, 1
+            )
+            sentences["lon"][index] = dm_to_sd(number(4)) * np.where(
+                letter(5) == ord("W"), -1, 1
+            )
+            counts["no_fix"] += int(
+                (~np.isfinite(sentences["lat"][index] + sentences["lon"][index])).sum()
+            )
+        elif sentence_type == b"ZDA":
+            sentences["date"][index] = _date64(number(4), number(3), number(2))
+        else:
+            ddmmyy = number(9)
+            yy = np.floor(np.mod(ddmmyy, 100))
+            sentences["date"][index] = _date64(
+                np.where(yy < 80, 2000 + yy, 1900 + yy),
+                np.floor(np.mod(ddmmyy, 10000) / 100),
+                np.floor(ddmmyy / 10000),
+            )
+
+    return {k: v[valid] for k, v in sentences.items()}
+
+
+def _is_upper(chars: NDArray) -> NDArray:
+    return (chars >= ord("A")) & (chars <= ord("Z"))
+
+
+def _nmea_sentences(n: int) -> tp.Dict:
+    """Return the empty arrays of `n` parsed sentences."""
+    return dict(
+        is_gga=np.zeros(n, dtype=bool),
+        time_of_day=np.full(n, np.timedelta64("NaT", "ns")),
+        date=np.full(n, np.datetime64("NaT", "D")),
+        lon=nans(n),
+        lat=nans(n),
+    )
+
+
+def _date64(year: NDArray, month: NDArray, day: NDArray) -> NDArray:
+    """Assemble datetime64[D] from year, month and day. Invalid dates are NaT."""
+    year, month, day = (np.nan_to_num(v).astype(int) for v in (year, month, day))
+    date = ymdhms_to_datetime64(year, month, day, 0, 0, 0).astype("datetime64[D]")
+    date[(month < 1) | (month > 12) | (day < 1) | (day > 31)] = np.datetime64("NaT")
+    return date
+
+
+def _date_gga_fixes(sentences: tp.Dict, counts: tp.Dict) -> tp.Dict:
+    """Put the GGA fixes on the date of the nearest preceding ZDA/RMC sentence.
+
+    The fixes more than 12 hours before (after) the time of the date sentence are
+    moved to the next (previous) day (midnight crossing).
+    """
+    has_date = np.flatnonzero(~np.isnat(sentences["date"]))
+    gga = np.flatnonzero(
+        sentences["is_gga"]
+        & np.isfinite(sentences["lat"])
+        & np.isfinite(sentences["lon"])
+        & ~np.isnat(sentences["time_of_day"])
+    )
+    if has_date.size == 0:
+        counts["undated"] = gga.size
+        return dict(
+            time=np.empty(0, dtype="datetime64[ns]"), lon=nans(0), lat=nans(0)
+        )
+    counts["undated"] = 0
+
+    date_index = has_date[np.maximum(np.searchsorted(has_date, gga) - 1, 0)]
+    date = sentences["date"][date_index].astype("datetime64[ns]")
+    time = date + sentences["time_of_day"][gga]
+    date_time = date + sentences["time_of_day"][date_index]
+    time[time - date_time > np.timedelta64(12, "h")] -= np.timedelta64(1, "D")
+    time[time - date_time < -np.timedelta64(12, "h")] += np.timedelta64(1, "D")
+
+    return dict(time=time, lon=sentences["lon"][gga], lat=sentences["lat"][gga])
+
+
 def compute_navigation(
     filenames: str,
     output_name: str = None,
     window: int = 1,
+    workers: int = 1,
+    gpx_backend: str = "iterparse",
 ):
     """Compute the `bearing`, `speed`, `u_ship` and `v_ship` from gps data in nmea text format or gpx xml format.
 
@@ -139,6 +449,10 @@ def compute_navigation(
     ----------
     window :
         Size of the centered averaging window for u_ship, v_ship and bearing computation.
+    workers :
+        Number of processes parsing the nmea files.
+    gpx_backend :
+        Parser of the gpx files, `iterparse` or `gpxpy`.
 
     Notes
     -----
@@ -147,7 +461,7 @@ def compute_navigation(
 
     """
 
-    dataset = load_navigation(filenames)
+    dataset = load_navigation(filenames, workers=workers, gpx_backend=gpx_backend)
 
     dataset = _compute_navigation(dataset, window=window)
 
@@ -181,12 +495,11 @@ def _compute_navigation(
     if not isinstance(window, int):
         window = int(window)
 
-    position0 = np.array((dataset.lon.values[:-1], dataset.lat.values[:-1])).T.tolist()
-    position1 = np.array((dataset.lon.values[1:], dataset.lat.values[1:])).T.tolist()
-
-    distances = list(map(vincenty, position0, position1))  # meter
+    lon, lat = dataset.lon.values, dataset.lat.values
 
-    bearing = list(map(get_gps_bearing, position0, position1))  # degree
+    distances, bearing = vincenty_inverse(
+        lon[:-1], lat[:-1], lon[1:], lat[1:]
+    )  # meter, degree
 
     time_delta = np.diff(dataset.time).astype("timedelta64[s]")
 
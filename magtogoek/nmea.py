@@ -0,0 +1,181 @@
+"""
+Bulk parsing of NMEA sentences.
+
+The sentences are found in bytes with compiled regular expressions (or located
+directly with NumPy) and their fields are converted to NumPy arrays all at
+once, instead of parsing every sentence with pynmea2. Used for the NMEA datasets of the RTI ensembles
+(magtogoek.adcp.rti_decoder) and the NMEA navigation logs (magtogoek.navigation).
+
+Usage:
+valid = valid_checksums(bodies, checksums)
+bodies: bytes between `$` and `*`, checksums: hex digits after `*` (b"" if none).
+
+latitude = dm_to_sd(fields) * np.where(hemisphere == b"S", -1, 1)
+
+The sentences of a large buffer can also be located, checked and parsed as
+numbers without creating Python objects per sentence:
+data = np.frombuffer(buffer, dtype=np.uint8)
+field_starts, field_ends, complete = split_fields(data, starts, stops, 5)
+values = parse_decimals(data, field_starts[:, 1], field_ends[:, 1])
+"""
+import typing as tp
+
+import numpy as np
+from nptyping import NDArray
+
+KNOTS_TO_M_S = 0.514444444444444
+
+# Tail of the sentences patterns. The body group closes after the fields.
+SENTENCE_TAIL = rb"[^*$\s]*)(?:\*([0-9A-Fa-f]{2}))?"
+NUMBER = rb"([0-9.]*)"
+
+_HEX_DIGITS = np.full(256, -1, dtype=np.int64)
+_HEX_DIGITS[np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)] = np.arange(16)
+_HEX_DIGITS[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def valid_checksums(bodies: tp.List[bytes], checksums: tp.List[bytes]) -> NDArray:
+    """Return True for the sentences with a valid checksum or without checksum.
+
+    The checksum (XOR of the bytes between `$` and `*`) of all the sentences is
+    computed at once over their joined bodies.
+    """
+    if len(bodies) == 0:
+        return np.empty(0, dtype=bool)
+    lengths = np.fromiter((len(b) for b in bodies), dtype=np.int64, count=len(bodies))
+    starts = np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+    data = np.frombuffer(b"\n".join(bodies) + b"\n", dtype=np.uint8)
+    computed = xor_checksums(data, starts, starts + lengths)
+
+    checksums = np.array(checksums, dtype="S2")
+    missing = checksums == b""
+    expected = np.full(len(checksums), -1)
+    expected[~missing] = hex_to_int(
+        np.frombuffer(checksums[~missing].tobytes(), dtype=np.uint8).reshape(-1, 2)
+    )
+    return missing | (expected == computed)
+
+
+def xor_checksums(data: NDArray, starts: NDArray, stops: NDArray) -> NDArray:
+    """XOR of the bytes data[starts:stops] (uint8) of each sentence.
+
+    The sentences can't be empty and `stops` must be smaller than `data.size`.
+    """
+    return np.bitwise_xor.reduceat(data, np.stack((starts, stops), axis=1).ravel())[
+        ::2
+    ]
+
+
+def hex_to_int(digits: NDArray) -> NDArray:
+    """Convert (n, 2) hex digits (uint8) to int. Invalid digits are -1."""
+    digits = _HEX_DIGITS[digits]
+    value = digits[:, 0] * 16 + digits[:, 1]
+    value[(digits < 0).any(axis=1)] = -1
+    return value
+
+
+def to_float(values: NDArray) -> NDArray:
+    """Convert an array of bytes to float. Empty or invalid values are NaN.
+
+    Arrays of numbers are returned as float.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "fiu":
+        return values.astype(np.float64)
+    values = values.astype(bytes)
+    values = np.where(values == b"", b"nan", values)
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        return np.array([_safe_float(v) for v in values], dtype=np.float64)
+
+
+def _safe_float(value: bytes) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def dm_to_sd(dm: NDArray) -> NDArray:
+    """Convert `dddmm.mmmm` coordinates to decimal degrees. Empty values are NaN."""
+    dm = to_float(dm)
+    return np.floor(dm / 100) + np.mod(dm, 100) / 60
+
+
+def time_of_day(hhmmss: NDArray) -> NDArray:
+    """Convert `hhmmss[.ss]` NMEA times to timedelta64[ns] since midnight."""
+    hhmmss = to_float(hhmmss)
+    seconds = (
+        np.floor(hhmmss / 10000) * 3600
+        + np.floor(np.mod(hhmmss, 10000) / 100) * 60
+        + np.mod(hhmmss, 100)
+    )
+    time = np.full(hhmmss.size, np.timedelta64("NaT", "ns"))
+    valid = np.isfinite(seconds)
+    time[valid] = np.round(seconds[valid] * 1e9).astype(np.int64).astype("m8[ns]")
+    return time
+
+
+def split_fields(
+    data: NDArray, starts: NDArray, stops: NDArray, count: int
+) -> tp.Tuple[NDArray, NDArray, NDArray]:
+    """Locate the first `count` comma separated fields of the sentences
+    data[starts:stops] (uint8).
+
+    Returns
+    -------
+    field_starts, field_ends :
+        (n_sentences, count) positions of the fields in `data`. The first field
+        starts at `starts`.
+    complete :
+        (n_sentences,) Number of fields, up to `count`, followed by a comma. The
+        positions of the other fields are not valid.
+    """
+    commas = np.append(np.flatnonzero(data == ord(",")), data.size)
+
+    first = np.searchsorted(commas, starts)
+    complete = np.minimum(np.searchsorted(commas, stops) - first, count)
+
+    field_ends = commas[np.minimum(first[:, None] + np.arange(count), commas.size - 1)]
+    field_starts = np.empty_like(field_ends)
+    field_starts[:, 0] = starts
+    field_starts[:, 1:] = field_ends[:, :-1] + 1
+
+    return field_starts, field_ends, complete
+
+
+_MAX_DIGITS = 30
+_POWERS_OF_TEN = 10.0 ** np.arange(-_MAX_DIGITS, _MAX_DIGITS + 1)
+
+
+def parse_decimals(data: NDArray, starts: NDArray, ends: NDArray) -> NDArray:
+    """Parse the decimal numbers (digits and one optional `.`) of data[starts:ends].
+
+    All the numbers are parsed at once with NumPy. Empty or invalid values are NaN.
+    """
+    n = starts.size
+    lengths = np.maximum(ends - starts, 0)
+    owner = np.repeat(np.arange(n), lengths)
+    positions = np.arange(owner.size) + np.repeat(
+        starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths
+    )
+    characters = data[positions]
+    digits = characters - np.uint8(ord("0"))  # Wraps around for non digits.
+
+    is_dot = characters == ord(".")
+    is_digit = digits < 10
+    # One for each dot, two for each other character: invalid if more than one.
+    errors = np.bincount(owner, weights=is_dot + 2 * ~(is_dot | is_digit), minlength=n)
+    invalid = (errors > 1) | (lengths == 0) | (lengths > _MAX_DIGITS)
+
+    dot_positions = ends.copy()
+    dot_positions[owner[is_dot]] = positions[is_dot]
+    exponents = dot_positions[owner] - positions
+    exponents -= exponents > 0  # digits before the dot.
+    np.clip(exponents, -_MAX_DIGITS, _MAX_DIGITS, out=exponents)
+    weights = np.where(is_digit, digits, 0) * _POWERS_OF_TEN[exponents + _MAX_DIGITS]
+
+    values = np.bincount(owner, weights=weights, minlength=n).astype(float)
+    values[invalid] = np.nan
+    return values
@@ -7,7 +7,6 @@ import typing as tp
 import numpy as np
 import xarray as xr
 from nptyping import NDArray
-from pygeodesy.ellipsoidalVincenty import LatLon
 
 
 def nans(shape: tp.Tuple[list, tuple, NDArray]) -> NDArray:
@@ -64,8 +63,127 @@ def circular_distance(a1, a2, units="rad"):
     return res
 
 
+WGS84_A = 6378137.0  # semi-major axis (m)
+WGS84_F = 1 / 298.257223563  # flattening
+WGS84_B = WGS84_A * (1 - WGS84_F)  # semi-minor axis (m)
+
+
+def vincenty_inverse(
+    lon0: NDArray,
+    lat0: NDArray,
+    lon1: NDArray,
+    lat1: NDArray,
+    tolerance: float = 1e-12,
+    max_iterations: int = 200,
+) -> tp.Tuple[NDArray, NDArray]:
+    """Vincenty inverse solution on the WGS84 ellipsoid for arrays of coordinates.
+
+    The iterations are done on all the pairs of points at once; only the pairs
+    not converged yet are updated. Pairs that don't converge (nearly antipodal
+    points) are returned as NaN.
+
+    Parameters
+    ----------
+    lon0, lat0 :
+       Coordinates of the first points in decimal degrees.
+    lon1, lat1 :
+       Coordinates of the second points in decimal degrees.
+    tolerance :
+        Convergence on lambda (radians). 1e-12 is about 0.006 mm.
+    max_iterations :
+        Maximum number of iterations.
+
+    Returns
+    -------
+    distance :
+        Distance between the points in meters.
+    bearing :
+        Initial bearing from the first to the second points in degrees [0, 360).
+    """
+    lon0, lat0, lon1, lat1 = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (lon0, lat0, lon1, lat1))
+    )
+    shape = lon0.shape
+    lon0, lat0, lon1, lat1 = (v.ravel() for v in (lon0, lat0, lon1, lat1))
+
+    L = np.radians(lon1 - lon0)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat0)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    sin_sigma, cos_sigma, sigma = nans(L.shape), nans(L.shape), nans(L.shape)
+    cos2_alpha, cos_2sigma_m = nans(L.shape), nans(L.shape)
+    active = np.isfinite(L) & np.isfinite(U1) & np.isfinite(U2)
+    converged = np.zeros(L.shape, dtype=bool)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        i = np.flatnonzero(active)
+        sin_lam, cos_lam = np.sin(lam[i]), np.cos(lam[i])
+        sin_sigma[i] = np.hypot(
+            cosU2[i] * sin_lam, cosU1[i] * sinU2[i] - sinU1[i] * cosU2[i] * cos_lam
+        )
+        cos_sigma[i] = sinU1[i] * sinU2[i] + cosU1[i] * cosU2[i] * cos_lam
+        sigma[i] = np.arctan2(sin_sigma[i], cos_sigma[i])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sin_alpha = cosU1[i] * cosU2[i] * sin_lam / sin_sigma[i]
+        sin_alpha = np.where(sin_sigma[i] == 0, 0.0, sin_alpha)  # coincident points
+        cos2_alpha[i] = 1 - sin_alpha ** 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cos_2sigma_m[i] = np.where(
+                cos2_alpha[i] != 0,  # equatorial line
+                cos_sigma[i] - 2 * sinU1[i] * sinU2[i] / cos2_alpha[i],
+                0.0,
+            )
+        C = WGS84_F / 16 * cos2_alpha[i] * (4 + WGS84_F * (4 - 3 * cos2_alpha[i]))
+        lam_prev = lam[i]
+        lam[i] = L[i] + (1 - C) * WGS84_F * sin_alpha * (
+            sigma[i]
+            + C
+            * sin_sigma[i]
+            * (cos_2sigma_m[i] + C * cos_sigma[i] * (-1 + 2 * cos_2sigma_m[i] ** 2))
+        )
+        done = np.abs(lam[i] - lam_prev) <= tolerance
+        converged[i[done]] = True
+        active[i[done]] = False
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = (
+        B
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + B
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B
+                / 6
+                * cos_2sigma_m
+                * (-3 + 4 * sin_sigma ** 2)
+                * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+    )
+    distance = WGS84_B * A * (sigma - delta_sigma)
+
+    bearing = np.degrees(
+        np.arctan2(cosU2 * np.sin(lam), cosU1 * sinU2 - sinU1 * cosU2 * np.cos(lam))
+    ) % 360
+
+    distance[~converged] = np.nan
+    bearing[~converged] = np.nan
+
+    return distance.reshape(shape), bearing.reshape(shape)
+
+
 def vincenty(p0: tp.Tuple[float, float], p1: tp.Tuple[float, float]) -> float:
-    """Calculate the distance between 2 coordinates with pygeodesy.ellipsoidalVincenty.LatLon
+    """Calculate the distance between 2 coordinates. (see vincenty_inverse)
 
     Great Circule Distance with Datum = WGS84
 
@@ -82,11 +200,11 @@ def vincenty(p0: tp.Tuple[float, float], p1: tp.Tuple[float, float]) -> float:
         distance between the two points in meters.
     """
 
-    return LatLon(p0[1], p0[0]).distanceTo(LatLon(p1[1], p1[0]))
+    return float(vincenty_inverse(p0[0], p0[1], p1[0], p1[1])[0])
 
 
 def get_gps_bearing(p0: tp.Tuple[float, float], p1: tp.Tuple[float, float]) -> float:
-    """Calculate the bearing between two coordinates with pygeodesy.ellipsoidalVincenty.LatLon
+    """Calculate the bearing between two coordinates. (see vincenty_inverse)
 
     Datum = WGS84
 
@@ -102,4 +220,4 @@ def get_gps_bearing(p0: tp.Tuple[float, float], p1: tp.Tuple[float, float]) -> f
     bearing in degrees [0, 360]
     """
 
-    return LatLon(p0[1], p0[0]).initialBearingTo(LatLon(p1[1], p1[0]))
+    return float(vincenty_inverse(p0[0], p0[1], p1[0], p1[1])[1])
@@ -19,16 +19,93 @@ from rti_python.Ensemble.NmeaData import NmeaData
 from rti_python.Ensemble.RangeTracking import RangeTracking
 from rti_python.Ensemble.SystemSetup import SystemSetup
 
-# Buffer to hold the incoming data
-buffer = bytearray()
-
-# Condition to protect the buffer and make the threads sleep.
-global_condition = Condition()
-
 # THIS LINE IS ADD BY MAGTOGOEK
 logging.getLogger().setLevel("CRITICAL")
 
 
+class SharedBuffer:
+    """
+    Buffer shared by the AddDataThread and the ProcessDataThread of a codec.
+    (MODIFIED BY MAGTOGOEK: was module globals shared by all the codecs.)
+    """
+
+    def __init__(self):
+        # Buffer to hold the incoming data
+        self.data = bytearray()
+
+        # Condition to protect the buffer and make the threads sleep.
+        self.condition = Condition()
+
+
+# Ensemble header: delimiter, ens_num, ~ens_num, payload_size, ~payload_size.
+HEADER_SIZE = Ensemble.HeaderSize
+CHECKSUM_SIZE = Ensemble.ChecksumSize
+# Dataset header: type, num_elements, element_multiplier, image, name_len.
+DATA_SET_HEADER = struct.Struct("<5i")
+DATA_SET_NAME_SIZE = 8
+DATA_SET_BASE_SIZE = DATA_SET_HEADER.size + DATA_SET_NAME_SIZE
+BYTE_TYPE = 50  # Byte Datatype. Other types are 4 bytes (int32 or float32).
+
+# Dataset name: (Dataset class, Ensemble method adding the dataset)
+DATA_SET_DECODERS = {
+    b"E000001\0": (BeamVelocity, "AddBeamVelocity"),
+    b"E000002\0": (InstrumentVelocity, "AddInstrumentVelocity"),
+    b"E000003\0": (EarthVelocity, "AddEarthVelocity"),
+    b"E000004\0": (Amplitude, "AddAmplitude"),
+    b"E000005\0": (Correlation, "AddCorrelation"),
+    b"E000006\0": (GoodBeam, "AddGoodBeam"),
+    b"E000007\0": (GoodEarth, "AddGoodEarth"),
+    b"E000008\0": (EnsembleData, "AddEnsembleData"),
+    b"E000009\0": (AncillaryData, "AddAncillaryData"),
+    b"E000010\0": (BottomTrack, "AddBottomTrack"),
+    b"E000011\0": (NmeaData, "AddNmeaData"),
+    b"E000014\0": (SystemSetup, "AddSystemSetup"),
+    b"E000015\0": (RangeTracking, "AddRangeTracking"),
+}
+
+
+def walk_data_sets(ens, start=0, stop=None):
+    """
+    Walk through the dataset headers of an ensemble.
+
+    Each dataset header is read with a single struct unpack from a memoryview of
+    the ensemble. The walk stops at the checksum or at the first bad header.
+    :param ens: Bytes-like of the ensemble (header + payload + checksum).
+    :param start: Position of the ensemble in `ens`.
+    :param stop: End of the ensemble in `ens`. The end of `ens` by default.
+    :return: Yield (offset, ds_type, num_elements, element_multiplier, name) where
+    offset is the position of the dataset header in `ens` and name is the dataset
+    name bytes (e.g. b"E000008\\0").
+    """
+    view = memoryview(ens).cast("B")
+    stop = len(view) if stop is None else stop
+    pointer = start + HEADER_SIZE
+    payload_stop = stop - CHECKSUM_SIZE
+
+    while pointer + DATA_SET_BASE_SIZE <= payload_stop:
+        ds_type, num_elements, element_multiplier, _, name_len = (
+            DATA_SET_HEADER.unpack_from(view, pointer)
+        )
+        name_start = pointer + DATA_SET_HEADER.size
+        data_size = num_elements * element_multiplier * (
+            1 if ds_type == BYTE_TYPE else 4
+        )
+        if name_len <= 0 or data_size < 0:
+            logging.warning("Bad Ensemble header")
+            break
+
+        yield (
+            pointer,
+            ds_type,
+            num_elements,
+            element_multiplier,
+            bytes(view[name_start : name_start + name_len]),
+        )
+
+        # Move to the next dataset
+        pointer = name_start + name_len + data_size
+
+
 class BinaryCodec:
     """
     Use the 2 threads, AddDataThread and ProcessDataThread
@@ -48,12 +125,15 @@ class BinaryCodec:
         """
         Start the two threads.
         """
+        # Buffer of this codec
+        self.buffer = SharedBuffer()
+
         # Start the Add Data Thread
-        self.add_data_thread = AddDataThread()
+        self.add_data_thread = AddDataThread(self.buffer)
         self.add_data_thread.start()
 
         # Start the Processing Data Thread
-        self.process_data_thread = ProcessDataThread()
+        self.process_data_thread = ProcessDataThread(self.buffer)
         self.process_data_thread.ensemble_event += self.receive_ens
         self.process_data_thread.start()
 
@@ -99,8 +179,7 @@ class BinaryCodec:
         Monitor the buffer size.
         :return: Buffer size to monitor.
         """
-        global buffer
-        return len(buffer)
+        return len(self.buffer.data)
 
     @staticmethod
     def verify_ens_data(ens_data, ens_start=0):
@@ -170,181 +249,64 @@ class BinaryCodec:
         return False
 
     @staticmethod
-    def decode_data_sets(ens):
+    def data_sets_directory(ens):
+        """
+        Get the position of the datasets in the ensemble without decoding them.
+
+        The dataset headers are read in place. (see walk_data_sets)
+        :param ens: Ensemble data.
+        :return: Dict {name: (offset, size, (num_elements, element_multiplier))}
+        where name is the 8 bytes dataset name (e.g. b"E000008\\0"), offset is the
+        position of the dataset header in the ensemble and size is the dataset
+        size in bytes (header included).
+        """
+        directory = {}
+        for offset, ds_type, num_elements, element_multiplier, name in walk_data_sets(
+            ens
+        ):
+            data_set_size = DATA_SET_HEADER.size + len(name)
+            data_set_size += num_elements * element_multiplier * (
+                1 if ds_type == BYTE_TYPE else 4
+            )
+            directory[name] = (
+                offset,
+                data_set_size,
+                (num_elements, element_multiplier),
+            )
+
+        return directory
+
+    @staticmethod
+    def decode_data_sets(ens, names=None):
         """
         Decode the datasets in the ensemble.
 
         Use verify_ens_data if you are using this
         as a static method to verify the data is correct.
         :param ens: Ensemble data.  Decode the dataset.
+        :param names: Names of the datasets to decode (e.g. "E000008"). All by default.
         :return: Return the decoded ensemble.
         """
-        # print(ens)
-        packetPointer = Ensemble().HeaderSize
-        type = 0
-        numElements = 0
-        elementMultiplier = 0
-        imag = 0
-        nameLen = 0
-        name = ""
-        dataSetSize = 0
-        ens_len = len(ens)
+        if names is not None:
+            names = {name.encode().ljust(DATA_SET_NAME_SIZE, b"\0") for name in names}
 
         # Create the ensemble
         ensemble = Ensemble()
-
-        # Add the raw data to the ensemble
-        # ensemble.AddRawData(ens)
+        view = memoryview(ens)
 
         try:
-
-            # Decode the ensemble datasets
-            for x in range(Ensemble().MaxNumDataSets):
-                # Check if we are at the end of the payload
-                if (
-                    packetPointer
-                    >= ens_len - Ensemble.ChecksumSize - Ensemble.HeaderSize
-                ):
-                    break
-
-                try:
-                    # Get the dataset info
-                    ds_type = Ensemble.GetInt32(
-                        packetPointer + (Ensemble.BytesInInt32 * 0),
-                        Ensemble().BytesInInt32,
-                        ens,
-                    )
-                    num_elements = Ensemble.GetInt32(
-                        packetPointer + (Ensemble.BytesInInt32 * 1),
-                        Ensemble().BytesInInt32,
-                        ens,
-                    )
-                    element_multiplier = Ensemble.GetInt32(
-                        packetPointer + (Ensemble.BytesInInt32 * 2),
-                        Ensemble().BytesInInt32,
-                        ens,
-                    )
-                    image = Ensemble.GetInt32(
-                        packetPointer + (Ensemble.BytesInInt32 * 3),
-                        Ensemble().BytesInInt32,
-                        ens,
-                    )
-                    name_len = Ensemble.GetInt32(
-                        packetPointer + (Ensemble.BytesInInt32 * 4),
-                        Ensemble().BytesInInt32,
-                        ens,
-                    )
-                    name = str(
-                        ens[
-                            packetPointer
-                            + (Ensemble.BytesInInt32 * 5) : packetPointer
-                            + (Ensemble.BytesInInt32 * 5)
-                            + 8
-                        ],
-                        "UTF-8",
-                    )
-                except Exception as e:
-                    logging.warning("Bad Ensemble header" + str(e))
-                    break
-
-                # Calculate the dataset size
-                data_set_size = Ensemble.GetDataSetSize(
-                    ds_type, name_len, num_elements, element_multiplier
-                )
-
-                # Beam Velocity
-                if "E000001" in name:
-                    logging.debug(name)
-                    bv = BeamVelocity(num_elements, element_multiplier)
-                    bv.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddBeamVelocity(bv)
-
-                # Instrument Velocity
-                if "E000002" in name:
-                    logging.debug(name)
-                    iv = InstrumentVelocity(num_elements, element_multiplier)
-                    iv.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddInstrumentVelocity(iv)
-
-                # Earth Velocity
-                if "E000003" in name:
-                    logging.debug(name)
-                    ev = EarthVelocity(num_elements, element_multiplier)
-                    ev.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddEarthVelocity(ev)
-
-                # Amplitude
-                if "E000004" in name:
-                    logging.debug(name)
-                    amp = Amplitude(num_elements, element_multiplier)
-                    amp.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddAmplitude(amp)
-
-                # Correlation
-                if "E000005" in name:
-                    logging.debug(name)
-                    corr = Correlation(num_elements, element_multiplier)
-                    corr.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddCorrelation(corr)
-
-                # Good Beam
-                if "E000006" in name:
-                    logging.debug(name)
-                    gb = GoodBeam(num_elements, element_multiplier)
-                    gb.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddGoodBeam(gb)
-
-                # Good Earth
-                if "E000007" in name:
-                    logging.debug(name)
-                    ge = GoodEarth(num_elements, element_multiplier)
-                    ge.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddGoodEarth(ge)
-
-                # Ensemble Data
-                if "E000008" in name:
-                    logging.debug(name)
-                    ed = EnsembleData(num_elements, element_multiplier)
-                    ed.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddEnsembleData(ed)
-
-                # Ancillary Data
-                if "E000009" in name:
-                    logging.debug(name)
-                    ad = AncillaryData(num_elements, element_multiplier)
-                    ad.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddAncillaryData(ad)
-
-                # Bottom Track
-                if "E000010" in name:
-                    logging.debug(name)
-                    bt = BottomTrack(num_elements, element_multiplier)
-                    bt.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddBottomTrack(bt)
-
-                # NMEA data
-                if "E000011" in name:
-                    logging.debug(name)
-                    nd = NmeaData(num_elements, element_multiplier)
-                    nd.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddNmeaData(nd)
-
-                # System Setup
-                if "E000014" in name:
-                    logging.debug(name)
-                    ss = SystemSetup(num_elements, element_multiplier)
-                    ss.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddSystemSetup(ss)
-
-                # Range Tracking
-                if "E000015" in name:
-                    logging.debug(name)
-                    rt = RangeTracking(num_elements, element_multiplier)
-                    rt.decode(ens[packetPointer : packetPointer + data_set_size])
-                    ensemble.AddRangeTracking(rt)
-
-                # Move to the next dataset
-                packetPointer += data_set_size
+            directory = BinaryCodec.data_sets_directory(view)
+            for name, (offset, size, shape) in directory.items():
+                if names is not None and name not in names:
+                    continue
+                decoder = DATA_SET_DECODERS.get(name)
+                if decoder is None:
+                    continue
+                logging.debug(name)
+                data_set_class, add_data_set = decoder
+                data_set = data_set_class(*shape)
+                data_set.decode(view[offset : offset + size])
+                getattr(ensemble, add_data_set)(data_set)
 
         except Exception as e:
             logging.warning("Error decoding the ensemble.  " + str(e))
@@ -359,12 +321,14 @@ class AddDataThread(Thread):
     and wakeup ProcessDataThread with "condition".
     """
 
-    def __init__(self):
+    def __init__(self, buffer):
         """
         Initialize the thread.
+        :param buffer: SharedBuffer of the codec.
         """
         Thread.__init__(self)
         self.name = "Binary Codec Add Data Thread"
+        self.buffer = buffer
         self.internal_condition = Condition()
         self.alive = True
         self.temp_data = bytes()
@@ -389,7 +353,7 @@ class AddDataThread(Thread):
         """
 
         # Store the data to be buffered
-        with global_condition:
+        with self.buffer.condition:
             self.temp_data = self.temp_data + data
 
         # Wakeup the thread
@@ -402,9 +366,8 @@ class AddDataThread(Thread):
         Then wakeup the ProcessDataThread with "condition".
         :return:
         """
-        # Get the global buffer
-        # It is shared with the 2 threads
-        global buffer
+        # The buffer is shared with the 2 threads
+        buffer = self.buffer
 
         # Verify the thread is still alive
         while self.alive:
@@ -413,16 +376,16 @@ class AddDataThread(Thread):
                 # Wait to wakeup when data arrives
                 self.internal_condition.wait()
 
-            with global_condition:
-                buffer += self.temp_data  # Set the data to the buffer
-                # print("Buffer: " + str(len(buffer)))
+            with buffer.condition:
+                buffer.data += self.temp_data  # Set the data to the buffer
+                # print("Buffer: " + str(len(buffer.data)))
 
                 # Clear the temp data
                 self.temp_data = bytes()
 
                 # Check if enough data is in the buffer to process
-                if len(buffer) > Ensemble.HeaderSize + Ensemble.ChecksumSize + 200:
-                    global_condition.notify()  # Notify to process the buffer
+                if len(buffer.data) > Ensemble.HeaderSize + Ensemble.ChecksumSize + 200:
+                    buffer.condition.notify()  # Notify to process the buffer
 
 
 class ProcessDataThread(Thread):
@@ -434,12 +397,14 @@ class ProcessDataThread(Thread):
     subscribers of the event "ensemble_event".
     """
 
-    def __init__(self):
+    def __init__(self, buffer):
         """
         Initialize this object as a thread.
+        :param buffer: SharedBuffer of the codec.
         """
         Thread.__init__(self)
         self.name = "Binary Codec Process Data Thread"
+        self.buffer = buffer
         self.alive = True
         self.MAX_TIMEOUT = 5
         self.timeout = 0
@@ -451,8 +416,8 @@ class ProcessDataThread(Thread):
         :return:
         """
         self.alive = False
-        with global_condition:
-            global_condition.notify()
+        with self.buffer.condition:
+            self.buffer.condition.notify()
 
         if self.is_alive():
             self.join()
@@ -469,7 +434,7 @@ class ProcessDataThread(Thread):
 
     def run(self):
         """
-        Get the global buffer that is shared with the AddDataThread.
+        Get the buffer that is shared with the AddDataThread.
 
         When data is received, the this thread will be unblocked with "condition".
         Process the incoming data.  Look for ensemble data. Verify and decode the binary data.
@@ -477,19 +442,18 @@ class ProcessDataThread(Thread):
         receive the ensemble.
         :return:
         """
-        # Get the global buffer
-        # It is shared with the 2 threads
-        global buffer
+        # The buffer is shared with the 2 threads
+        buffer = self.buffer
 
         # Verify the thread is still alive
         while self.alive:
             # Wait for data
-            with global_condition:
-                if self.DELIMITER in buffer:  # Check for the delimiter
-                    chunks = buffer.split(
+            with buffer.condition:
+                if self.DELIMITER in buffer.data:  # Check for the delimiter
+                    chunks = buffer.data.split(
                         self.DELIMITER
                     )  # If delimiter found, split to get the remaining buffer data
-                    buffer = chunks.pop()  # Put the remaining data back in the buffer
+                    buffer.data = chunks.pop()  # Put the remaining data back in the buffer
 
                     for chunk in chunks:  # Take out the ens data
                         self.verify_and_decode(
@@ -0,0 +1,339 @@
+import logging
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+from obsub import event
+from rti_python.Codecs.BinaryCodec import BinaryCodec
+from rti_python.Codecs.RingBufferCodec import (
+    BLOCK,
+    DEFAULT_CAPACITY,
+    EnsembleFramer,
+    RingBuffer,
+)
+
+# THIS MODULE IS ADD BY MAGTOGOEK
+
+RECV_SIZE = 2 ** 16
+
+
+def decode_ensemble(ens_bin, names=None):
+    """
+    Decode an ensemble in a worker of the decode pool.
+    :param ens_bin: bytes of a verified ensemble.
+    :param names: Names of the datasets to decode.  All by default.
+    :return: Ensemble object.
+    """
+    return BinaryCodec.decode_data_sets(ens_bin, names=names)
+
+
+class StreamStats:
+    """
+    Throughput and latency counters of a stream.
+
+    The bad ensembles are the ensembles with a bad checksum (counted by the
+    framer) plus the ensembles that could not be decoded.
+
+    The latency of an ensemble is the time between the moment its last bytes
+    are taken out of the stream buffer and the moment it is passed to the
+    subscribers.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.bytes_received = 0
+        self.ensembles = 0
+        self.bad_checksums = 0
+        self.bad_decodes = 0
+        self.bytes_dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        """
+        :return: Dict of the counters with the throughput and the mean latency.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        return dict(
+            bytes_received=self.bytes_received,
+            bytes_dropped=self.bytes_dropped,
+            ensembles=self.ensembles,
+            bad_ensembles=self.bad_checksums + self.bad_decodes,
+            bad_checksums=self.bad_checksums,
+            bad_decodes=self.bad_decodes,
+            throughput_Bps=self.bytes_received / elapsed if elapsed else 0.0,
+            ensembles_per_s=self.ensembles / elapsed if elapsed else 0.0,
+            latency_mean_s=(
+                self.latency_sum / self.ensembles if self.ensembles else None
+            ),
+            latency_max_s=self.latency_max if self.ensembles else None,
+        )
+
+
+class Stream:
+    """
+    State of one instrument stream: its buffer, framer and counters.
+    """
+
+    def __init__(self, stream_id, capacity=DEFAULT_CAPACITY, policy=BLOCK):
+        self.stream_id = stream_id
+        self.ring = RingBuffer(capacity, policy)
+        self.framer = EnsembleFramer(max_ensemble_size=capacity)
+        self.stats = StreamStats()
+        self.thread = None
+
+
+class MultiStreamCodec:
+    """
+    Decode the RTB ensembles of multiple instrument streams in one process.
+
+    Each stream has its own RingBuffer, EnsembleFramer and StreamStats, so the
+    streams can't corrupt each other.  The ensembles of all the streams are
+    decoded by a shared pool of workers.  The ensembles of a stream are
+    passed to the subscribers in the order they were received.
+
+    Subscribe to ensemble_event to receive the decoded ensembles.
+    codec.ensemble_event += event_handler
+
+    event_handler(self, sender, stream_id, ens)
+
+    Usage:
+    codec = MultiStreamCodec()
+    codec.add_stream("up")
+    codec.connect("down", "localhost", 55000)
+    codec.add("up", data)
+    codec.stats()
+    codec.shutdown()
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        executor=None,
+        names=None,
+        capacity=DEFAULT_CAPACITY,
+        policy=BLOCK,
+        max_pending=None,
+    ):
+        """
+        :param workers: Number of decode workers when `executor` is None.
+        :param executor: concurrent.futures Executor used to decode the ensembles.
+        A ProcessPoolExecutor decodes in parallel. Defaults to a ThreadPoolExecutor.
+        :param names: Names of the datasets to decode (e.g. "E000008").  All by default.
+        :param capacity: Size of each stream buffer in bytes.
+        :param policy: When a stream buffer is full, BLOCK add() or DROP_OLDEST bytes.
+        :param max_pending: Maximum number of ensembles of a stream being decoded.
+        """
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="Multi Stream Codec Decode"
+        )
+        self.names = names
+        self.capacity = capacity
+        self.policy = policy
+        self.max_pending = max_pending or getattr(self.executor, "_max_workers", 4)
+        self.streams = dict()
+        self.lock = Lock()
+
+    @event
+    def ensemble_event(self, stream_id, ens):
+        """
+        Event to subscribe to receive the decoded ensembles.
+        :param stream_id: Stream of the ensemble.
+        :param ens: Ensemble object.
+        """
+        if ens.IsEnsembleData:
+            logging.debug(f"{stream_id}: {ens.EnsembleData.EnsembleNumber}")
+
+    def add_stream(self, stream_id):
+        """
+        Add a stream and start its processing thread.
+        :param stream_id: Hashable name of the stream.
+        :return: The Stream.
+        """
+        with self.lock:
+            if stream_id in self.streams:
+                raise ValueError(f"Stream {stream_id} already exists.")
+            stream = Stream(stream_id, self.capacity, self.policy)
+            stream.thread = Thread(
+                target=self.run,
+                args=(stream,),
+                name=f"Multi Stream Codec {stream_id}",
+            )
+            self.streams[stream_id] = stream
+        stream.thread.start()
+        return stream
+
+    def add(self, stream_id, data, timeout=None):
+        """
+        Add data to a stream.  With the BLOCK policy, wait while its buffer is full.
+        :param stream_id: Stream of the data.
+        :param data: bytes-like object.
+        :param timeout: Maximum time waiting for space in the buffer.
+        :return: True if the data was added.
+        """
+        stream = self.streams[stream_id]
+        if not stream.ring.write(data, timeout):
+            return False
+        stream.stats.bytes_received += len(data)
+        return True
+
+    def connect(self, stream_id, host, port):
+        """
+        Add a stream fed by a TCP connection.  The stream ends when the
+        connection is closed.
+        :param stream_id: Hashable name of the stream.
+        :param host: Host of the TCP source.
+        :param port: Port of the TCP source.
+        :return: The reading thread.
+        """
+        sock = socket.create_connection((host, port))
+        self.add_stream(stream_id)
+
+        def receive():
+            try:
+                with sock:
+                    data = sock.recv(RECV_SIZE)
+                    while data:
+                        self.add(stream_id, data)
+                        data = sock.recv(RECV_SIZE)
+            finally:
+                self.streams[stream_id].ring.close()
+
+        thread = Thread(target=receive, name=f"Multi Stream Codec {stream_id} TCP")
+        thread.start()
+        return thread
+
+    def close_stream(self, stream_id):
+        """
+        Stop a stream once its buffered data are decoded.
+        :param stream_id: Stream to close.
+        """
+        stream = self.streams[stream_id]
+        stream.ring.close()
+        if stream.thread.is_alive():
+            stream.thread.join()
+
+    def shutdown(self):
+        """
+        Close all the streams and the decode pool.
+        """
+        for stream_id in list(self.streams):
+            self.close_stream(stream_id)
+        if self.owns_executor:
+            self.executor.shutdown()
+
+    def buffer_size(self, stream_id):
+        """
+        :return: Number of bytes of a stream waiting to be decoded.
+        """
+        stream = self.streams[stream_id]
+        return len(stream.ring) + len(stream.framer)
+
+    def stats(self):
+        """
+        :return: Dict {stream_id: counters}. (see StreamStats.as_dict)
+        """
+        for stream in self.streams.values():
+            stream.stats.bytes_dropped = stream.ring.dropped
+            stream.stats.bad_checksums = stream.framer.bad_ensembles
+        return {k: s.stats.as_dict() for k, s in self.streams.items()}
+
+    def run(self, stream):
+        """
+        Frame the ensembles of a stream and submit them to the decode pool.
+
+        At most `max_pending` ensembles of the stream are decoded at a time.
+        Decoded ensembles are passed in order.  When the stream buffer is
+        empty, all the submitted ensembles are passed before waiting for data.
+        :param stream: Stream to process.
+        """
+        pending = deque()
+        try:
+            while True:
+                data = stream.ring.read()
+                if not data:
+                    if stream.ring.closed and len(stream.ring) == 0:
+                        break
+                    continue
+                read_time = time.perf_counter()
+
+                stream.framer.feed(data)
+                ens_bin = stream.framer.next_ensemble()
+                while ens_bin is not None:
+                    pending.append(
+                        (
+                            read_time,
+                            self.executor.submit(decode_ensemble, ens_bin, self.names),
+                        )
+                    )
+                    while len(pending) >= self.max_pending:
+                        self._deliver(stream, *pending.popleft())
+                    ens_bin = stream.framer.next_ensemble()
+
+                while pending and (pending[0][1].done() or len(stream.ring) == 0):
+                    self._deliver(stream, *pending.popleft())
+
+            while pending:
+                self._deliver(stream, *pending.popleft())
+        finally:
+            stream.ring.close()
+
+    def _deliver(self, stream, read_time, future):
+        """
+        Wait for a decoded ensemble, update the counters and pass it to the subscribers.
+
+        An ensemble that can't be decoded is counted as bad.  An error in a
+        subscriber is logged; the next ensembles are passed.
+        """
+        try:
+            ens = future.result()
+        except Exception as e:
+            logging.warning(f"{stream.stream_id}: Error decoding the ensemble.  {e}")
+            ens = None
+        if ens is None:
+            stream.stats.bad_decodes += 1
+            return
+        latency = time.perf_counter() - read_time
+        stream.stats.ensembles += 1
+        stream.stats.latency_sum += latency
+        stream.stats.latency_max = max(stream.stats.latency_max, latency)
+        try:
+            self.ensemble_event(stream.stream_id, ens)
+        except Exception as e:
+            logging.warning(f"{stream.stream_id}: Error in an ensemble subscriber.  {e}")
+
+
+def serve_file(filename, host="localhost", port=0, rate=None, packet_size=2 ** 14):
+    """
+    Stand-in instrument: replay a .ENS file to the first TCP client.
+    :param filename: Path to the .ENS file.
+    :param host: Host to listen on.
+    :param port: Port to listen on.  0 picks a free port.
+    :param rate: Bytes per second.  As fast as possible if None.
+    :param packet_size: Bytes sent at a time.
+    :return: (port, thread).  The thread ends after the file is sent.
+    """
+    server = socket.create_server((host, port))
+    port = server.getsockname()[1]
+
+    def replay():
+        with server:
+            conn, _ = server.accept()
+        with conn, open(filename, "rb") as f:
+            start, sent = time.perf_counter(), 0
+            data = f.read(packet_size)
+            while data:
+                conn.sendall(data)
+                sent += len(data)
+                if rate:
+                    delay = start + sent / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                data = f.read(packet_size)
+
+    thread = Thread(target=replay, name=f"Replay {filename}")
+    thread.start()
+    return port, thread
@@ -0,0 +1,379 @@
+import binascii
+import logging
+import struct
+import time
+from threading import Condition, Thread
+
+from obsub import event
+from rti_python.Codecs.BinaryCodec import BinaryCodec
+from rti_python.Ensemble.Ensemble import Ensemble
+
+# THIS MODULE IS ADD BY MAGTOGOEK
+
+DELIMITER = b"\x80" * 16
+
+# ens_num, ~ens_num, payload_size, ~payload_size
+ENSEMBLE_HEADER = struct.Struct("<4i")
+
+DEFAULT_CAPACITY = 2 ** 22  # bytes
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+
+
+class EnsembleFramer:
+    """
+    Find the complete and valid RTB ensembles in a stream of bytes.
+
+    The bytes are added with feed() and the ensembles are taken out with
+    next_ensemble().  Only the bytes added since the last search are scanned
+    for the delimiter; an incomplete trailing ensemble is kept until the rest
+    of its bytes is fed.
+
+    The framer has no thread or lock, it belongs to a single stream.
+    """
+
+    def __init__(self, max_ensemble_size=DEFAULT_CAPACITY):
+        """
+        :param max_ensemble_size: Ensembles with a larger payload size are considered invalid.
+        """
+        self.max_ensemble_size = max_ensemble_size
+        self.buffer = bytearray()
+        self.start = 0  # Position of the first byte not consumed.
+        self.scan_pos = 0  # Position where to resume the delimiter search.
+        self.bad_ensembles = 0
+
+    def __len__(self):
+        """
+        :return: Number of bytes held by the framer.
+        """
+        return len(self.buffer) - self.start
+
+    def feed(self, data):
+        """
+        Add data to the framer.
+        :param data: bytes-like object.
+        """
+        if self.start > len(self.buffer) // 2:
+            # Discard the consumed bytes. Amortized over the data fed.
+            del self.buffer[: self.start]
+            self.scan_pos -= self.start
+            self.start = 0
+        self.buffer += data
+
+    def next_ensemble(self):
+        """
+        Take out the next complete ensemble with a valid checksum.
+        :return: bytes of the ensemble (header + payload + checksum) or None if
+        there is no complete ensemble in the framer.
+        """
+        buffer = self.buffer
+        while True:
+            pos = buffer.find(DELIMITER, self.scan_pos)
+            if pos < 0:
+                # Keep the bytes that could start a delimiter.
+                self.start = max(self.start, len(buffer) - len(DELIMITER) + 1)
+                self.scan_pos = self.start
+                return None
+
+            self.start = self.scan_pos = pos
+            if len(buffer) - pos < Ensemble.HeaderSize:
+                return None
+
+            ens_num, inv_ens_num, payload_size, inv_payload_size = (
+                ENSEMBLE_HEADER.unpack_from(buffer, pos + len(DELIMITER))
+            )
+            if (
+                ens_num != ~inv_ens_num
+                or payload_size != ~inv_payload_size
+                or not 0 < payload_size <= self.max_ensemble_size
+            ):
+                self.scan_pos = pos + 1
+                continue
+
+            payload_start = pos + Ensemble.HeaderSize
+            checksum_start = payload_start + payload_size
+            stop = checksum_start + Ensemble.ChecksumSize
+            if len(buffer) < stop:
+                return None
+
+            checksum = int.from_bytes(buffer[checksum_start:stop], "little")
+            if binascii.crc_hqx(buffer[payload_start:checksum_start], 0) != checksum:
+                self.bad_ensembles += 1
+                self.scan_pos = pos + 1
+                continue
+
+            self.start = self.scan_pos = stop
+            return bytes(buffer[pos:stop])
+
+
+class RingBuffer:
+    """
+    Bounded bytes buffer shared by a producer (write) and a consumer (read).
+
+    The buffer is preallocated.  When it is full, write() either waits for the
+    consumer to read (policy BLOCK) or discards the oldest unread bytes
+    (policy DROP_OLDEST).  read() waits until data is available.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy=BLOCK):
+        """
+        :param capacity: Size of the buffer in bytes.
+        :param policy: BLOCK or DROP_OLDEST.
+        """
+        if policy not in (BLOCK, DROP_OLDEST):
+            raise ValueError(f"policy must be `{BLOCK}` or `{DROP_OLDEST}`")
+        self.capacity = capacity
+        self.policy = policy
+        self.data = bytearray(capacity)
+        self.condition = Condition()
+        self.head = 0  # Total number of bytes read (or dropped).
+        self.tail = 0  # Total number of bytes written.
+        self.dropped = 0
+        self.closed = False
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def write(self, data, timeout=None):
+        """
+        Write data in the buffer.
+        :param data: bytes-like object.
+        :param timeout: Maximum time waiting for space with policy BLOCK.
+        :return: True if the data was written.
+        """
+        data = memoryview(data).cast("B")
+        with self.condition:
+            if len(data) > self.capacity:
+                if self.policy == BLOCK:
+                    raise ValueError("Data larger than the buffer capacity.")
+                self.dropped += len(data) - self.capacity
+                data = data[-self.capacity :]
+
+            if self.policy == BLOCK:
+                if not self.condition.wait_for(
+                    lambda: self.closed or self.capacity - len(self) >= len(data),
+                    timeout,
+                ):
+                    return False
+                if self.closed:
+                    return False
+            else:
+                overflow = len(self) + len(data) - self.capacity
+                if overflow > 0:
+                    self.head += overflow
+                    self.dropped += overflow
+
+            start = self.tail % self.capacity
+            first = min(len(data), self.capacity - start)
+            self.data[start : start + first] = data[:first]
+            self.data[: len(data) - first] = data[first:]
+            self.tail += len(data)
+            self.condition.notify_all()
+        return True
+
+    def read(self, timeout=None):
+        """
+        Read all the available data.  Wait for data if the buffer is empty.
+        :param timeout: Maximum time waiting for data.
+        :return: bytes read.  Empty if the buffer is closed or on timeout.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or len(self) > 0, timeout)
+            start, size = self.head % self.capacity, len(self)
+            first = min(size, self.capacity - start)
+            data = bytes(self.data[start : start + first]) + bytes(
+                self.data[: size - first]
+            )
+            self.head += size
+            self.condition.notify_all()
+        return data
+
+    def close(self):
+        """
+        Wakeup the waiting producer and consumer.  Nothing can be written after.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class RingBufferCodec:
+    """
+    Decode a stream of RTB ensembles.  Drop-in replacement of BinaryCodec.
+
+    Subscribe to ensemble_event to receive the latest
+    decoded data.
+    codec.ensemble_event += event_handler
+
+    event_handler(self, sender, ens)
+
+    The data added with add() are stored in a RingBuffer.  A single thread
+    waits for new data, searches the ensembles with an EnsembleFramer and
+    decodes them.  Unlike BinaryCodec, the thread sleeps while no data arrives
+    and each instance has its own buffer.
+
+    The verified binary ensembles are also passed to the subscribers of
+    frame_event before being decoded.  With decode=False, the ensembles are not
+    decoded into Ensemble objects. (see magtogoek.adcp.rti_stream.EnsembleBatcher)
+    """
+
+    def __init__(
+        self, capacity=DEFAULT_CAPACITY, policy=BLOCK, names=None, decode=True
+    ):
+        """
+        Start the processing thread.
+        :param capacity: Size of the ring buffer in bytes.
+        :param policy: When the buffer is full, BLOCK add() or DROP_OLDEST bytes.
+        :param names: Names of the datasets to decode (e.g. "E000008"). All by default.
+        :param decode: If False, ensemble_event is not fired.  Only frame_event is.
+        """
+        self.ring = RingBuffer(capacity, policy)
+        self.framer = EnsembleFramer(max_ensemble_size=capacity)
+        self.names = names
+        self.decode = decode
+        self.ensembles_decoded = 0
+        self.ensemble_errors = 0
+
+        self.process_thread = Thread(
+            target=self.run, name="Ring Buffer Codec Process Data Thread"
+        )
+        self.process_thread.start()
+
+    def shutdown(self):
+        """
+        Stop the processing thread.  The data in the buffer are processed first.
+        """
+        self.ring.close()
+        if self.process_thread.is_alive():
+            self.process_thread.join()
+
+    @event
+    def ensemble_event(self, ens):
+        """
+        Event to subscribe to receive the latest ensemble data.
+        :param ens: Ensemble object
+        """
+        if ens.IsEnsembleData:
+            logging.debug(str(ens.EnsembleData.EnsembleNumber))
+
+    @event
+    def frame_event(self, ens_bin):
+        """
+        Event to subscribe to receive the verified binary ensembles.
+        :param ens_bin: bytes of the ensemble; header + payload + checksum.
+        """
+
+    def add(self, data, timeout=None):
+        """
+        Add data to decode.  With the BLOCK policy, wait while the buffer is full.
+        :param data: Data to start decoding.
+        :param timeout: Maximum time waiting for space in the buffer.
+        :return: True if the data was added.
+        """
+        return self.ring.write(data, timeout)
+
+    def buffer_size(self):
+        """
+        Monitor the buffer size.
+        :return: Number of bytes waiting to be decoded.
+        """
+        return len(self.ring) + len(self.framer)
+
+    @property
+    def bytes_dropped(self):
+        """
+        :return: Number of bytes discarded with the DROP_OLDEST policy.
+        """
+        return self.ring.dropped
+
+    def run(self):
+        """
+        Wait for data, then frame and decode the ensembles.
+
+        An error decoding an ensemble or in a subscriber is logged and counted
+        in `ensemble_errors`; the next ensembles are processed.  If the thread
+        stops anyway, the buffer is closed so add() doesn't wait for it.
+        """
+        try:
+            while True:
+                data = self.ring.read()
+                if not data:
+                    if self.ring.closed and len(self.ring) == 0:
+                        break
+                    continue
+
+                self.framer.feed(data)
+                ens_bin = self.framer.next_ensemble()
+                while ens_bin is not None:
+                    self._process(ens_bin)
+                    ens_bin = self.framer.next_ensemble()
+        finally:
+            self.ring.close()
+
+    def _process(self, ens_bin):
+        """
+        Pass a verified ensemble to the subscribers, decoded if `decode`.
+        """
+        try:
+            self.frame_event(ens_bin)
+            if self.decode:
+                ens = BinaryCodec.decode_data_sets(ens_bin, names=self.names)
+                if ens:
+                    self.ensembles_decoded += 1
+                    self.ensemble_event(ens)
+        except Exception as e:
+            self.ensemble_errors += 1
+            logging.warning("Error processing the ensemble.  " + str(e))
+
+
+def benchmark(filename, codec, rate=10e6, duration=5.0, packet_size=2 ** 16):
+    """
+    Replay a .ENS file to a codec at a sustained rate.
+    :param filename: Path to the .ENS file replayed in loop.
+    :param codec: BinaryCodec or RingBufferCodec instance.
+    :param rate: Bytes per second.
+    :param duration: Seconds.
+    :param packet_size: Bytes added at a time.
+    :return: Dict of the bytes sent, ensembles received, wall and cpu time.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    received = []
+    codec.ensemble_event += lambda sender, ens: received.append(1)
+
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    sent, pos = 0, 0
+    while time.perf_counter() - wall0 < duration:
+        packet = data[pos : pos + packet_size]
+        pos = (pos + packet_size) % len(data)
+        codec.add(packet)
+        sent += len(packet)
+        # Pace the feed.
+        delay = wall0 + sent / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+    codec.shutdown()
+
+    return dict(
+        sent_MB=sent / 1e6,
+        rate_MBps=sent / 1e6 / wall,
+        ensembles=len(received),
+        cpu_s=cpu,
+        cpu_load=cpu / wall,
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    filename = sys.argv[1]
+    print("BinaryCodec", benchmark(filename, BinaryCodec()))
+    print("RingBufferCodec", benchmark(filename, RingBufferCodec()))
+    print(
+        "RingBufferCodec (E000008 only)",
+        benchmark(filename, RingBufferCodec(names=["E000008"])),
+    )
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.checkpoint import (
+    CheckpointError,
+    checkpoint_key,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+
+def _dataset():
+    return xr.Dataset(
+        {"u": (["depth", "time"], np.arange(6.0).reshape(2, 3), {"units": "m/s"})},
+        coords={"depth": [1.0, 2.0], "time": np.arange(3).astype("datetime64[s]")},
+        attrs={"sonar": "os", "frequency": np.int64(75000), "magnetic_declination": None},
+    )
+
+
+def test_checkpoint(tmp_path):
+    key = checkpoint_key(files=[["a.ens", 10, 0]], yearbase=2021)
+    save_checkpoint(_dataset(), tmp_path, "load", key)
+    dataset = load_checkpoint(tmp_path, "load", key)
+    xr.testing.assert_identical(dataset, _dataset())
+    assert load_checkpoint(tmp_path, "load", checkpoint_key(yearbase=2020)) is None
+
+
+def test_checkpoint_unsaved_attribute(tmp_path):
+    dataset = _dataset()
+    dataset.attrs["filename"] = Path("nav.log")
+    with pytest.raises(CheckpointError):
+        save_checkpoint(dataset, tmp_path, "load", checkpoint_key(yearbase=2021))
+    assert not list(tmp_path.iterdir())
+
+
+def test_checkpoint_keeps_last(tmp_path):
+    keys = [checkpoint_key(yearbase=year) for year in (2020, 2021)]
+    save_checkpoint(_dataset(), tmp_path, "load", keys[0])
+    save_checkpoint(_dataset(), tmp_path, "load_nav", keys[0])
+    save_checkpoint(_dataset(), tmp_path, "load", keys[1])
+
+    assert load_checkpoint(tmp_path, "load", keys[0]) is None
+    assert load_checkpoint(tmp_path, "load", keys[1]) is not None
+    assert load_checkpoint(tmp_path, "load_nav", keys[0]) is not None
+    assert len(list(tmp_path.iterdir())) == 4
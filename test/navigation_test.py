@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.navigation import _read_gpx, _stream_gpx, load_navigation
+
+GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <wpt lat="48.0" lon="-68.0"><time>2021-06-01T00:00:00Z</time></wpt>
+  <trk>
+    <name>first</name>
+    <trkseg>
+      <trkpt lat="48.1" lon="-68.1"><ele>1</ele><time>2021-06-01T00:00:10Z</time></trkpt>
+      <trkpt lat="48.2" lon="-68.2"><time>2021-06-01T00:00:20.5Z</time></trkpt>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="48.3" lon="-68.3"><time>2021-06-01T00:00:30+02:00</time></trkpt>
+    </trkseg>
+  </trk>
+  <trk>
+    <trkseg>
+      <trkpt lat="48.4" lon="-68.4"><time>2021-06-01T00:00:40-0400</time></trkpt>
+      <trkpt lat="48.5" lon="-68.5"><time>2021-06-01T00:00:50Z</time></trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+
+@pytest.fixture
+def gpx_file(tmp_path):
+    filename = tmp_path / "track.gpx"
+    filename.write_text(GPX)
+    return str(filename)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 100])
+def test_stream_gpx(gpx_file, chunk_size):
+    expected = _read_gpx(gpx_file)
+    gps_data = _stream_gpx(gpx_file, chunk_size=chunk_size)
+    assert len(gps_data["time"]) == 5
+    for k in ("lon", "lat"):
+        np.testing.assert_array_equal(gps_data[k], expected[k])
+    np.testing.assert_array_equal(
+        gps_data["time"], np.array(expected["time"], dtype="datetime64[ns]")
+    )
+
+
+def test_load_navigation_gpx_backends(gpx_file):
+    datasets = [load_navigation(gpx_file, gpx_backend=b) for b in ("gpxpy", "iterparse")]
+    xr.testing.assert_identical(*datasets)
+    with pytest.raises(ValueError):
+        load_navigation(gpx_file, gpx_backend="sax")
+
+
+def test_stream_gpx_no_time(tmp_path):
+    filename = tmp_path / "track.gpx"
+    filename.write_text(GPX.replace("<time>2021-06-01T00:00:30+02:00</time>", ""))
+    gps_data = _stream_gpx(str(filename))
+    assert np.isnat(gps_data["time"]).tolist() == [False, False, True, False, False]
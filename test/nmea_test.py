@@ -0,0 +1,62 @@
+import numpy as np
+from magtogoek.navigation import load_navigation
+from magtogoek.nmea import (
+    dm_to_sd,
+    hex_to_int,
+    parse_decimals,
+    split_fields,
+    time_of_day,
+    valid_checksums,
+)
+
+
+def _fields(text: bytes, count: int):
+    data = np.frombuffer(text, dtype=np.uint8)
+    starts, stops = np.array([0]), np.array([len(text)])
+    return data, split_fields(data, starts, stops, count)
+
+
+def test_parse_decimals():
+    data = np.frombuffer(b"12.5,0.25,7,", dtype=np.uint8)
+    values = parse_decimals(data, np.array([0, 5, 10]), np.array([4, 9, 11]))
+    np.testing.assert_allclose(values, [12.5, 0.25, 7])
+
+
+def test_parse_decimals_empty_and_invalid():
+    data = np.frombuffer(b",,1.2.3,1a,", dtype=np.uint8)
+    values = parse_decimals(data, np.array([0, 1, 2, 8]), np.array([0, 1, 7, 10]))
+    assert values.dtype == float
+    assert np.isnan(values).all()
+
+    values = parse_decimals(data, np.array([0, 1]), np.array([0, 1]))
+    assert np.isnan(values).all()
+
+
+def test_split_fields():
+    data, (field_starts, field_ends, complete) = _fields(b"GPGGA,1,,3", 4)
+    assert complete[0] == 3
+    fields = [bytes(data[s:e]) for s, e in zip(field_starts[0, :3], field_ends[0, :3])]
+    assert fields == [b"GPGGA", b"1", b""]
+
+
+def test_checksums():
+    assert hex_to_int(np.frombuffer(b"66:0", dtype=np.uint8).reshape(-1, 2)).tolist() == [
+        0x66,
+        -1,
+    ]
+    bodies = [b"GPGGA,,,,,,0,00,,,M,,M,,", b"GPGGA,,,,,,0,00,,,M,,M,,", b"GPZDA"]
+    valid = valid_checksums(bodies, [b"66", b"67", b""])
+    assert valid.tolist() == [True, False, True]
+
+
+def test_conversions():
+    np.testing.assert_allclose(dm_to_sd(np.array([b"4830.00", b""])), [48.5, np.nan])
+    time = time_of_day(np.array([b"123015.50", b""]))
+    assert time[0] == np.timedelta64(45015500, "ms")
+    assert np.isnat(time[1])
+
+
+def test_load_navigation_without_fix(tmp_path):
+    filename = tmp_path / "no_fix.log"
+    filename.write_bytes(b"$GPGGA,,,,,,0,00,,,M,,M,,*66\r\n")
+    assert load_navigation(str(filename)).time.size == 0
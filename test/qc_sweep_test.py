@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.adcp.qc_sweep import QCSweep, QCSweepError
+from magtogoek.adcp.quality_control import adcp_quality_control
+
+THRESHOLDS = dict(
+    amplitude=[40, 60],
+    correlation=[100, 160],
+    percentgood=[50, 80],
+    horizontal_velocity=[0.7, 1.0],
+    vertical_velocity=[0.3],
+    error_velocity=[0.2, 0.4],
+    roll=[2, 5],
+    pitch=[3],
+)
+QC_ARGUMENTS = dict(
+    amplitude="amp_th",
+    correlation="corr_th",
+    percentgood="pg_th",
+    horizontal_velocity="horizontal_vel_th",
+    vertical_velocity="vertical_vel_th",
+    error_velocity="error_vel_th",
+    roll="roll_th",
+    pitch="pitch_th",
+)
+
+
+def _dataset(depth_size=16, time_size=40):
+    rng = np.random.default_rng(1)
+    shape = (depth_size, time_size)
+    dataset = xr.Dataset(
+        {v: (["depth", "time"], rng.normal(0, 0.4, shape)) for v in ("u", "v", "w", "e")},
+        coords={
+            "depth": np.arange(12.0, 12 + 2 * depth_size, 2),
+            "time": np.arange(time_size),
+        },
+        attrs=dict(beam_angle=30, orientation="down", xducer_depth=10, logbook=""),
+    )
+    for i in range(1, 5):
+        dataset[f"amp{i}"] = (["depth", "time"], rng.uniform(20, 80, shape))
+        dataset[f"corr{i}"] = (["depth", "time"], rng.uniform(60, 200, shape))
+    dataset["pg"] = (["depth", "time"], rng.uniform(30, 100, shape))
+    dataset["u"][2, 3] = np.nan
+    dataset["v"][4, 5] = 20
+    for v in ("roll_", "pitch"):
+        dataset[v] = (["time"], rng.normal(0, 3, time_size))
+    dataset["pres"] = (["time"], rng.uniform(10, 20, time_size))
+    dataset["pres"][7] = -5
+    dataset["bt_depth"] = (["time"], rng.uniform(30, 45, time_size))
+    for v in ("u", "v", "w"):
+        dataset[f"bt_{v}"] = (["time"], rng.normal(0, 0.2, time_size))
+    return dataset
+
+
+def _combinations(count=40):
+    """All tests off, each test alone and random combinations of thresholds."""
+    tests = list(THRESHOLDS)
+    combinations = [dict()]
+    combinations += [{t: THRESHOLDS[t][0]} for t in tests]
+    rng = np.random.default_rng(2)
+    for _ in range(count):
+        combinations.append(
+            {t: v for t in tests for v in [rng.choice([None] + THRESHOLDS[t])] if v}
+        )
+    return combinations
+
+
+@pytest.mark.parametrize(
+    "fixed", [dict(), dict(motion_correction_mode="bt", sidelobes_correction=True)]
+)
+def test_flagged_fraction(fixed):
+    sweep = QCSweep(_dataset(), THRESHOLDS, block_size=7, **fixed)
+    for thresholds in _combinations():
+        dataset = _dataset()
+        qc_arguments = {a: thresholds.get(t) for t, a in QC_ARGUMENTS.items()}
+        adcp_quality_control(dataset, **qc_arguments, **fixed)
+        expected = (dataset.u_QC.values != 1).mean(axis=1)
+        np.testing.assert_allclose(
+            sweep.flagged_fraction(**thresholds), expected, err_msg=str(thresholds)
+        )
+        assert 0 < expected.mean() < 1
+
+
+def test_flagged_fraction_errors():
+    sweep = QCSweep(_dataset(), dict(amplitude=[40, 60]))
+    with pytest.raises(QCSweepError):
+        sweep.flagged_fraction(amplitude=50)
+    with pytest.raises(QCSweepError):
+        sweep.flagged_fraction(roll=5)
+    with pytest.raises(QCSweepError):
+        QCSweep(_dataset(), dict(sidelobes=[1]))
+
+    table = sweep.table()
+    assert len(table) == 3
+    expected = [sweep.flagged_fraction(amplitude=t).mean() for t in (None, 40, 60)]
+    np.testing.assert_allclose(table["mean_flagged_%"], 100 * np.array(expected))
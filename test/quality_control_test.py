@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.adcp.qc_sweep import _fixed_tests
+from magtogoek.adcp.quality_control import (
+    QC_TESTS,
+    QC_TESTS_BITS,
+    QC_TESTS_VARIABLE,
+    adcp_quality_control,
+    qc_tests_to_flags,
+    quality_control_netcdf,
+)
+
+NO_TESTS = dict(
+    amp_th=None,
+    corr_th=None,
+    pg_th=None,
+    roll_th=None,
+    pitch_th=None,
+    horizontal_vel_th=None,
+    vertical_vel_th=None,
+    error_vel_th=None,
+)
+
+
+def _dataset(depth, orientation, time_size=6):
+    shape = (len(depth), time_size)
+    rng = np.random.default_rng(0)
+    dataset = xr.Dataset(
+        {v: (["depth", "time"], rng.normal(0, 0.5, shape)) for v in ("u", "v", "w", "e")},
+        coords={"depth": np.asarray(depth, dtype=float), "time": np.arange(time_size)},
+        attrs=dict(beam_angle=30, orientation=orientation, logbook=""),
+    )
+    if orientation == "down":
+        dataset.attrs["xducer_depth"] = 10
+        dataset["bt_depth"] = (["time"], np.linspace(40, 60, time_size))
+    else:
+        dataset.attrs["xducer_depth"] = 50
+    return dataset
+
+
+def test_qc_tests_bits():
+    bits = [QC_TESTS_BITS[t] for t in QC_TESTS]
+    assert bits == [1 << i for i in range(len(QC_TESTS))]
+    assert max(bits) <= np.iinfo(np.uint16).max
+
+
+def test_qc_tests_to_flags():
+    bits = QC_TESTS_BITS
+    qc_tests = np.array(
+        [
+            0,
+            bits["amplitude"],
+            bits["amplitude"] | bits["roll"],
+            bits["sidelobes"],
+            bits["horizontal_velocity"] | bits["pressure"],
+            bits["missing"],
+            bits["missing"] | bits["sidelobes"] | bits["correlation"],
+        ],
+        dtype=np.uint16,
+    )
+    flags = qc_tests_to_flags(qc_tests)
+    assert flags.dtype == np.int8
+    np.testing.assert_array_equal(flags, [1, 3, 3, 4, 4, 9, 9])
+
+
+def test_keep_qc_tests():
+    dataset = _dataset(np.arange(12.0, 70, 2.0), "down")
+    dataset["u"][0, 0] = np.nan
+    dataset["u"][1, 1] = 2
+    tests = dict(NO_TESTS, horizontal_vel_th=1.5)
+    adcp_quality_control(dataset, sidelobes_correction=True, keep_qc_tests=True, **tests)
+
+    qc_tests = dataset[QC_TESTS_VARIABLE]
+    assert qc_tests.dtype == np.uint16 and qc_tests.dims == ("depth", "time")
+    assert qc_tests.attrs["flag_meanings"].split() == list(QC_TESTS)
+    np.testing.assert_array_equal(
+        qc_tests.attrs["flag_masks"], [QC_TESTS_BITS[t] for t in QC_TESTS]
+    )
+    assert qc_tests.values[0, 0] == QC_TESTS_BITS["missing"]
+    assert qc_tests.values[1, 1] == QC_TESTS_BITS["horizontal_velocity"]
+    np.testing.assert_array_equal(dataset.u_QC.values, qc_tests_to_flags(qc_tests.values))
+
+    dataset = _dataset(np.arange(12.0, 70, 2.0), "down")
+    adcp_quality_control(dataset, sidelobes_correction=True, **tests)
+    assert QC_TESTS_VARIABLE not in dataset
+
+
+def _expected_sidelobes(dataset):
+    """Element-wise comparison of the depth to the sidelobe limit."""
+    cos_angle = np.cos(np.radians(dataset.attrs["beam_angle"]))
+    xducer_depth = dataset.attrs["xducer_depth"]
+    depth = dataset.depth.values[:, np.newaxis]
+    if dataset.attrs["orientation"] == "down":
+        bottom_depth = dataset.bt_depth.values
+        return depth > xducer_depth + (bottom_depth - xducer_depth) * cos_angle
+    return np.broadcast_to(depth < xducer_depth * (1 - cos_angle), dataset.u.shape)
+
+
+@pytest.mark.parametrize("orientation", ["down", "up"])
+@pytest.mark.parametrize("ascending", [True, False])
+def test_sidelobes(orientation, ascending):
+    depth = np.arange(2.0, 50.0, 2.0) if orientation == "up" else np.arange(12.0, 70, 2.0)
+    dataset = _dataset(depth if ascending else depth[::-1], orientation)
+    expected = _expected_sidelobes(dataset)
+    assert expected.any() and not expected.all()
+
+    adcp_quality_control(dataset, sidelobes_correction=True, keep_qc_tests=True, **NO_TESTS)
+    failed = (dataset[QC_TESTS_VARIABLE].values & QC_TESTS_BITS["sidelobes"]) != 0
+    np.testing.assert_array_equal(failed, expected)
+    np.testing.assert_array_equal(dataset.u_QC.values == 4, expected)
+
+    fixed = _fixed_tests(_dataset(dataset.depth.values, orientation), True, None)
+    np.testing.assert_array_equal(fixed["sidelobes"](slice(None)), expected)
+
+
+def test_sidelobes_unordered_depth():
+    depth = np.array([30.0, 60.0, 14.0, np.nan, 64.0, 48.0])
+    dataset = _dataset(depth, "down")
+    expected = _expected_sidelobes(dataset)
+
+    adcp_quality_control(dataset, sidelobes_correction=True, keep_qc_tests=True, **NO_TESTS)
+    failed = (dataset[QC_TESTS_VARIABLE].values & QC_TESTS_BITS["sidelobes"]) != 0
+    np.testing.assert_array_equal(failed, expected)
+
+
+def _motion_dataset():
+    dataset = _dataset(np.arange(12.0, 70, 2.0), "down", time_size=10)
+    for v in ("u", "v", "w"):
+        dataset[f"bt_{v}"] = (["time"], np.linspace(-0.2, 0.2, 10))
+    dataset["u"][3, 4] = 20
+    dataset["w"][5, 7] = np.nan
+    return dataset
+
+
+def test_quality_control_netcdf(tmp_path):
+    kwargs = dict(
+        NO_TESTS,
+        horizontal_vel_th=0.6,
+        motion_correction_mode="bt",
+        sidelobes_correction=True,
+        keep_qc_tests=True,
+    )
+    _motion_dataset().to_netcdf(tmp_path / "adcp.nc")
+    quality_control_netcdf(tmp_path / "adcp.nc", tmp_path / "adcp_qc.nc", block_size=3, **kwargs)
+
+    expected = _motion_dataset()
+    adcp_quality_control(expected, block_size=3, **kwargs)
+    with xr.open_dataset(tmp_path / "adcp_qc.nc") as dataset:
+        for var in ("u", "v", "w", "u_QC", QC_TESTS_VARIABLE):
+            np.testing.assert_array_equal(dataset[var].values, expected[var].values)
+    assert np.isnan(expected.u.values[3, 4]) and np.isnan(expected.u.values[5, 7])
+
+
+def test_correct_lazy_velocities(tmp_path):
+    _motion_dataset().to_netcdf(tmp_path / "adcp.nc")
+    expected = _motion_dataset()
+    adcp_quality_control(expected, block_size=3, motion_correction_mode="bt")
+    with xr.open_dataset(tmp_path / "adcp.nc") as dataset:
+        adcp_quality_control(dataset, block_size=3, motion_correction_mode="bt")
+        for var in ("u", "v", "w"):
+            np.testing.assert_array_equal(dataset[var].values, expected[var].values)
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from magtogoek.adcp.rti_decoder import (
+    DecodeError,
+    data_sets_directory,
+    decode_ensembles,
+    decode_file,
+    layout_runs,
+)
+from magtogoek.adcp.rti_scanner import find_data_set, scan_ens_file
+from rti_python.Codecs.BinaryCodec import DATA_SET_BASE_SIZE, BinaryCodec
+
+# 8 ensembles of 20 bins then 4 ensembles of 12 bins.
+ENS_FILE = str(Path(__file__).parent / "files/rti_stream.ens")
+
+
+def test_data_sets_directory():
+    index = scan_ens_file(ENS_FILE)
+    with open(ENS_FILE, "rb") as f:
+        buffer = f.read()
+    offset, length = int(index["offset"][1]), int(index["length"][1])
+    chunk = buffer[offset : offset + length]
+    directory = data_sets_directory(chunk)
+    codec_directory = BinaryCodec.data_sets_directory(chunk)
+    assert len(directory) == len(codec_directory) > 0
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    for name, (header_offset, size, shape) in codec_directory.items():
+        data_offset, *entry_shape, _ = directory[name.rstrip(b"\0").decode()]
+        assert data_offset == header_offset + DATA_SET_BASE_SIZE
+        assert tuple(entry_shape) == shape
+        assert find_data_set(data, offset, length, name) == offset + header_offset
+    assert find_data_set(data, offset, length, b"E000099\0") == -1
+
+
+def _codec_decode(chunk):
+    """Decode an ensemble with the rti_python Ensemble classes."""
+    ens = BinaryCodec.decode_data_sets(chunk)
+    return dict(
+        datetime=np.datetime64(ens.EnsembleData.datetime()),
+        cor=np.array(ens.Correlation.Correlation) * 255,
+        amp=np.array(ens.Amplitude.Amplitude),
+        pg=np.array(ens.GoodEarth.GoodEarth),
+        vel=np.array(ens.EarthVelocity.Velocities),
+        temperature=ens.AncillaryData.WaterTemp,
+        salinity=ens.AncillaryData.Salinity,
+        pressure=ens.AncillaryData.Pressure / 10,
+        XducerDepth=ens.AncillaryData.TransducerDepth,
+        heading=ens.AncillaryData.Heading,
+        pitch=ens.AncillaryData.Pitch,
+        roll=ens.AncillaryData.Roll,
+        bt_vel=np.array(ens.BottomTrack.EarthVelocity),
+        bt_pg=np.array(ens.BottomTrack.BeamGood),
+        bt_cor=np.array(ens.BottomTrack.Correlation) * 255,
+        bt_depth=np.array(ens.BottomTrack.Range),
+        latitude=ens.NmeaData.latitude,
+        longitude=ens.NmeaData.longitude,
+    )
+
+
+def test_decode_ensembles_codec():
+    index = scan_ens_file(ENS_FILE)
+    with open(ENS_FILE, "rb") as f:
+        buffer = f.read()
+    for run in layout_runs(buffer, index):
+        decoded = decode_ensembles(buffer, index[run])
+        decoded["pressure"] = decoded["VL"]["Pressure"]
+        for i, (offset, length) in enumerate(index[run][["offset", "length"]]):
+            expected = _codec_decode(buffer[offset : offset + length])
+            assert decoded["datetime"][i] == expected.pop("datetime")
+            for k, v in expected.items():
+                np.testing.assert_allclose(decoded[k][i], v, rtol=1e-6, err_msg=k)
+
+
+def test_layout_runs():
+    index = scan_ens_file(ENS_FILE)
+    with open(ENS_FILE, "rb") as f:
+        buffer = f.read()
+    assert layout_runs(buffer, index) == [slice(0, 8), slice(8, 12)]
+    assert layout_runs(buffer, index[8:]) == [slice(0, 4)]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_decode_file_layout_change(workers):
+    index = scan_ens_file(ENS_FILE)
+    with pytest.raises(DecodeError, match="layout changed at ensemble 9"):
+        decode_file(ENS_FILE, index, workers=workers, chunk_size=5)
+
+
+def test_decode_runs():
+    index = scan_ens_file(ENS_FILE)
+    with open(ENS_FILE, "rb") as f:
+        buffer = f.read()
+    for run, bins in zip(layout_runs(buffer, index), (20, 12)):
+        decoded = decode_ensembles(buffer, index[run])
+        assert decoded["vel"].shape == (run.stop - run.start, bins, 4)
+        assert np.isfinite(decoded["vel"]).all()
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from magtogoek.adcp.rti_reader import RtiReader
+from magtogoek.adcp.rti_scanner import scan_ens_file
+
+ENS_FILE = Path(__file__).parent / "files/rti_stream.ens"
+
+
+@pytest.fixture
+def ens_files(tmp_path):
+    """Two files of the 8 ensembles of 20 bins; 5 and 3 ensembles."""
+    data = ENS_FILE.read_bytes()
+    offsets = scan_ens_file(str(ENS_FILE))["offset"]
+    filenames = [str(tmp_path / "a.ens"), str(tmp_path / "b.ens")]
+    Path(filenames[0]).write_bytes(data[: offsets[5]])
+    Path(filenames[1]).write_bytes(data[offsets[5] : offsets[8]])
+    return filenames
+
+
+def _reader(filenames):
+    return RtiReader(filenames, cache=False, workers=1)
+
+
+def _assert_blocks_equal(blocks, data):
+    """The ensembles arrays of the blocks are the ones of data."""
+    count = len(data.datetime)
+    assert sum(block.ens_count for block in blocks) == count
+    for k, v in data.items():
+        if isinstance(v, np.ndarray) and v.shape[:1] == (count,):
+            np.testing.assert_array_equal(
+                np.concatenate([block[k] for block in blocks]), v, err_msg=k
+            )
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 100])
+def test_iter_blocks(ens_files, block_size):
+    blocks = list(_reader(ens_files).iter_blocks(block_size=block_size))
+    sizes = [block.ens_count for block in blocks]
+    expected = [min(block_size, n - i) for n in (5, 3) for i in range(0, n, block_size)]
+    assert sizes == expected
+    _assert_blocks_equal(blocks, _reader(ens_files).read())
+
+
+def test_iter_blocks_trimmed(ens_files):
+    blocks = list(_reader(ens_files).iter_blocks(2, start_index=2, stop_index=2))
+    _assert_blocks_equal(blocks, _reader(ens_files).read(start_index=2, stop_index=2))
+
+
+@pytest.mark.parametrize(
+    "start_time, end_time",
+    [
+        ("2020-05-01T00:02", "2020-05-01T00:06"),
+        ("2020-05-01T00:01:30", None),
+        (None, "2020-05-01T00:03:59"),
+        ("2020-05-01T00:06", "2020-05-01T00:06"),
+    ],
+)
+def test_read_time_window(ens_files, start_time, end_time):
+    data = _reader(ens_files).read()
+    in_window = np.ones(data.datetime.shape, dtype=bool)
+    if start_time is not None:
+        in_window &= data.datetime >= np.datetime64(start_time)
+    if end_time is not None:
+        in_window &= data.datetime <= np.datetime64(end_time)
+
+    window = _reader(ens_files).read(start_time=start_time, end_time=end_time)
+    np.testing.assert_array_equal(window.datetime, data.datetime[in_window])
+    np.testing.assert_array_equal(window.vel, data.vel[in_window])
+
+
+def test_read_empty_time_window(ens_files):
+    with pytest.raises(ValueError, match="No ensemble found"):
+        _reader(ens_files).read(
+            start_time="2020-05-01T00:02:10", end_time="2020-05-01T00:02:50"
+        )
+
+
+def test_time_window_index():
+    times = np.datetime64("2020-05-01", "ns") + np.arange(6) * np.timedelta64(60, "s")
+    window = (
+        np.datetime64("2020-05-01T00:01", "ns"),
+        np.datetime64("2020-05-01T00:03", "ns"),
+    )
+    assert RtiReader._time_window_index(times, *window) == (1, 4)
+    assert RtiReader._time_window_index(times, None, window[0]) == (0, 2)
+
+    times[0], times[4] = np.datetime64("NaT"), times[1]
+    assert RtiReader._time_window_index(times, *window) == (1, 5)
+    assert RtiReader._time_window_index(times[:0], *window) == (0, 0)
+
+
+def test_follow(tmp_path):
+    data = ENS_FILE.read_bytes()
+    offsets = scan_ens_file(str(ENS_FILE))["offset"]
+    filename = tmp_path / "follow.ens"
+    filename.write_bytes(bytes(5000) + data[: offsets[3] + 1000])
+
+    blocks = RtiReader(str(filename)).follow(poll_interval=0.01, timeout=0.2)
+    assert next(blocks).vel.shape == (3, 20, 4)
+    with open(filename, "ab") as f:
+        f.write(data[offsets[3] + 1000 : offsets[8]] + bytes(5000))
+    block = next(blocks)
+    assert block.vel.shape == (5, 20, 4)
+    assert np.isfinite(block.vel[:, :-2]).all()
+    assert list(blocks) == []
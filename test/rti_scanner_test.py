@@ -0,0 +1,79 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+from magtogoek.adcp.rti_scanner import (
+    DELIMITER,
+    incomplete_ensemble_start,
+    index_cache_path,
+    read_index_cache,
+    scan_ens_file,
+    write_index_cache,
+)
+from rti_python.Codecs.BinaryCodec import BinaryCodec
+
+ENS_FILE = Path(__file__).parent / "files/rti_stream.ens"
+
+
+def _verified_ensembles(data):
+    """Offsets and ensemble numbers of the ensembles verified by rti_python."""
+    offsets, ens_nums = [], []
+    offset = data.find(DELIMITER)
+    while offset >= 0:
+        if BinaryCodec.verify_ens_data(data, offset):
+            offsets.append(offset)
+            ens_nums.append(int.from_bytes(data[offset + 16 : offset + 20], "little"))
+        offset = data.find(DELIMITER, offset + 1)
+    return offsets, ens_nums
+
+
+@pytest.mark.parametrize("corrupted", [None, 100, 2262 * 3 + 500])
+def test_scan_ens_file(tmp_path, corrupted):
+    data = bytearray(ENS_FILE.read_bytes())
+    if corrupted is not None:
+        data[corrupted] ^= 0xFF
+    filename = tmp_path / "rti_stream.ens"
+    filename.write_bytes(bytes(1000) + data + data[:1500])
+
+    index = scan_ens_file(str(filename))
+    offsets, ens_nums = _verified_ensembles(filename.read_bytes())
+    assert len(index) == 12 - (corrupted is not None)
+    np.testing.assert_array_equal(index["offset"], offsets)
+    np.testing.assert_array_equal(index["ens_num"], ens_nums)
+    elapsed = (index["ens_num"] - index["ens_num"][0]) * np.timedelta64(60, "s")
+    np.testing.assert_array_equal(index["time"], index["time"][0] + elapsed)
+
+
+@pytest.fixture
+def ens_file(tmp_path):
+    return str(shutil.copy(ENS_FILE, tmp_path / "rti_stream.ens"))
+
+
+def test_index_cache(ens_file):
+    index = scan_ens_file(ens_file)
+    write_index_cache(ens_file, index, {"serial_number": "123"})
+    files = sorted(p.name for p in Path(ens_file).parent.iterdir())
+    assert files == ["rti_stream.ens", "rti_stream.ens.idx"]
+    cached_index, static = read_index_cache(ens_file)
+    np.testing.assert_array_equal(cached_index, index)
+    assert static == {"serial_number": "123"}
+
+
+@pytest.mark.parametrize("size", [0, 10, 200])
+def test_index_cache_truncated(ens_file, size):
+    write_index_cache(ens_file, scan_ens_file(ens_file))
+    cache = index_cache_path(ens_file)
+    cache.write_bytes(cache.read_bytes()[:size])
+    assert read_index_cache(ens_file) is None
+
+
+def test_incomplete_ensemble_start():
+    data = ENS_FILE.read_bytes()
+    index = scan_ens_file(str(ENS_FILE))
+    start = int(index["offset"][3])
+    junk = bytes(1000)
+    assert incomplete_ensemble_start(junk) == len(junk) - len(DELIMITER) + 1
+    assert incomplete_ensemble_start(junk + data[start : start + 1000]) == len(junk)
+    assert incomplete_ensemble_start(junk + data[start : start + 20]) == len(junk)
+    assert incomplete_ensemble_start(data[start : start + 5]) == 0
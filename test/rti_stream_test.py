@@ -0,0 +1,94 @@
+import asyncio
+from pathlib import Path
+
+import numpy as np
+from magtogoek.adcp.rti_reader import RDI_FILL_VALUE, RTI_FILL_VALUE
+from magtogoek.adcp.rti_stream import EnsembleBatcher, EnsembleReader, replay_server
+
+# 8 ensembles of 20 bins, some junk, then 4 ensembles of 12 bins. The last two bins
+# of the 20 bins ensembles are bad velocities (RTI_FILL_VALUE).
+ENS_FILE = str(Path(__file__).parent / "files/rti_stream.ens")
+ENS_COUNT = 12
+
+
+def _check_batches(batches):
+    bins = [batch["vel"].shape[1] for batch in batches]
+    counts = [len(batch["vel"]) for batch in batches]
+    assert sum(counts) == ENS_COUNT
+    assert sum(c for c, b in zip(counts, bins) if b == 20) == 8
+    assert sum(c for c, b in zip(counts, bins) if b == 12) == 4
+
+    vel = np.concatenate([batch["vel"] for batch in batches if batch["vel"].shape[1] == 20])
+    assert (vel[:, 18:] == RDI_FILL_VALUE).all()
+    assert not (vel == RTI_FILL_VALUE).any()
+    times = np.concatenate([batch["datetime"] for batch in batches])
+    assert (np.diff(times) == np.timedelta64(60, "s")).all()
+
+
+def test_ensemble_reader_replay_server():
+    async def read():
+        server = await replay_server(ENS_FILE, rate=1e5, packet_size=1000)
+        port = server.sockets[0].getsockname()[1]
+        reader = EnsembleReader("localhost", port, batch_size=5, batch_interval=0.1)
+        batches, count = [], 0
+        try:
+            async for batch in reader.batches():
+                batches.append({k: v.copy() for k, v in batch.items()})
+                count += len(batch["vel"])
+                if count >= ENS_COUNT:
+                    reader.stop()
+                    break
+        finally:
+            server.close()
+            await server.wait_closed()
+        return batches
+
+    _check_batches(asyncio.run(asyncio.wait_for(read(), timeout=30)))
+
+
+def test_ensemble_reader_stop_idle():
+    async def read():
+        connected = asyncio.Event()
+
+        async def idle(reader, writer):
+            connected.set()
+            await reader.read()  # Send nothing until the client closes.
+            writer.close()
+
+        server = await asyncio.start_server(idle, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader = EnsembleReader("localhost", port, batch_interval=0.1)
+
+        async def stop():
+            await connected.wait()
+            reader.stop()
+
+        try:
+            stopping = asyncio.ensure_future(stop())
+            batches = [batch async for batch in reader.batches()]
+            await stopping
+        finally:
+            server.close()
+            await server.wait_closed()
+        return batches, reader.connections
+
+    assert asyncio.run(asyncio.wait_for(read(), timeout=10)) == ([], 1)
+
+
+def test_ensemble_batcher():
+    from rti_python.Codecs.RingBufferCodec import EnsembleFramer
+
+    framer = EnsembleFramer()
+    with open(ENS_FILE, "rb") as f:
+        framer.feed(f.read())
+
+    batches = []
+    batcher = EnsembleBatcher(batch_size=5, batch_interval=10)
+    batcher.subscribe(lambda batch: batches.append({k: v.copy() for k, v in batch.items()}))
+    frame = framer.next_ensemble()
+    while frame is not None:
+        batcher.add(frame)
+        frame = framer.next_ensemble()
+    batcher.close()
+
+    _check_batches(batches)
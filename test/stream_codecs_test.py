@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from rti_python.Codecs import MultiStreamCodec as multi_stream_codec
+from rti_python.Codecs.MultiStreamCodec import MultiStreamCodec, serve_file
+from rti_python.Codecs.RingBufferCodec import RingBufferCodec
+
+ENS_FILE = Path(__file__).parent / "files/rti_stream.ens"
+ENS_COUNT = 12
+
+
+def _failing_once(received):
+    def subscriber(sender, *args):
+        received.append(args[-1])
+        if len(received) == 1:
+            raise RuntimeError("subscriber error")
+
+    return subscriber
+
+
+def test_ring_buffer_codec_subscriber_error():
+    codec = RingBufferCodec(capacity=4096, decode=False)
+    received = []
+    codec.frame_event += _failing_once(received)
+    data = ENS_FILE.read_bytes()
+    for start in range(0, len(data), 1000):
+        assert codec.add(data[start : start + 1000], timeout=5)
+    codec.shutdown()
+
+    assert len(received) == ENS_COUNT
+    assert codec.ensemble_errors == 1
+
+
+def test_multi_stream_codec_subscriber_error():
+    codec = MultiStreamCodec(workers=2, capacity=4096)
+    received = []
+    codec.ensemble_event += _failing_once(received)
+    codec.add_stream("adcp")
+    data = ENS_FILE.read_bytes()
+    for start in range(0, len(data), 1000):
+        assert codec.add("adcp", data[start : start + 1000], timeout=5)
+    codec.shutdown()
+
+    assert len(received) == ENS_COUNT
+    assert codec.stats()["adcp"]["ensembles"] == ENS_COUNT
+
+
+def test_multi_stream_codec_bad_ensembles(monkeypatch):
+    decode = multi_stream_codec.decode_ensemble
+    calls = []
+
+    def decode_once_none(ens_bin, names=None):
+        calls.append(1)
+        return None if len(calls) == 1 else decode(ens_bin, names)
+
+    monkeypatch.setattr(multi_stream_codec, "decode_ensemble", decode_once_none)
+    data = bytearray(ENS_FILE.read_bytes())
+    data[100] ^= 0xFF  # Bad checksum of the first ensemble.
+
+    codec = MultiStreamCodec(workers=1, capacity=4096)
+    codec.add_stream("adcp")
+    for start in range(0, len(data), 1000):
+        assert codec.add("adcp", data[start : start + 1000], timeout=5)
+    codec.shutdown()
+
+    stats = codec.stats()["adcp"]
+    assert (stats["bad_checksums"], stats["bad_decodes"]) == (1, 1)
+    assert stats["bad_ensembles"] == 2
+    assert stats["ensembles"] == ENS_COUNT - 2
+
+
+def test_multi_stream_codec_connect_error():
+    port, server = serve_file(str(ENS_FILE))
+    codec = MultiStreamCodec(workers=1)
+
+    def add(stream_id, data, timeout=None):
+        raise RuntimeError("add error")
+
+    codec.add = add
+    codec.connect("adcp", "localhost", port).join(timeout=5)
+    codec.streams["adcp"].thread.join(timeout=5)
+    assert not codec.streams["adcp"].thread.is_alive()
+    server.join(timeout=5)
+    codec.shutdown()
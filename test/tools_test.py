@@ -0,0 +1,40 @@
+import numpy as np
+from magtogoek.tools import get_gps_bearing, vincenty, vincenty_inverse
+from pygeodesy.ellipsoidalVincenty import LatLon
+
+
+def _random_pairs(size, spread):
+    rng = np.random.default_rng(0)
+    lon0 = rng.uniform(-180, 180, size)
+    lat0 = rng.uniform(-80, 80, size)
+    lon1 = (lon0 + rng.uniform(-spread, spread, size) + 180) % 360 - 180
+    lat1 = np.clip(lat0 + rng.uniform(-spread, spread, size), -89, 89)
+    return lon0, lat0, lon1, lat1
+
+
+def test_vincenty_inverse():
+    for spread in (0.01, 1, 60):
+        lon0, lat0, lon1, lat1 = _random_pairs(200, spread)
+        distance, bearing = vincenty_inverse(lon0, lat0, lon1, lat1)
+        for i in range(lon0.size):
+            p0, p1 = LatLon(lat0[i], lon0[i]), LatLon(lat1[i], lon1[i])
+            assert abs(distance[i] - p0.distanceTo(p1)) < 1e-6
+            assert abs((bearing[i] - p0.initialBearingTo(p1) + 180) % 360 - 180) < 1e-6
+
+
+def test_vincenty_inverse_shapes():
+    lon = np.array([[-68.0, -68.1], [-68.2, -68.3]])
+    distance, bearing = vincenty_inverse(lon, 48.0, -68.0, 48.0)
+    assert distance.shape == bearing.shape == (2, 2)
+    assert distance[0, 0] == 0
+
+    # Nearly antipodal points don't converge.
+    distance, bearing = vincenty_inverse([0, 0], 0, [10, 179.9], [0, 0.1])
+    assert np.isfinite(distance[0]) and np.isnan(distance[1]) and np.isnan(bearing[1])
+
+
+def test_vincenty():
+    p0, p1 = (-68.0, 48.0), (-68.1, 48.05)
+    expected = LatLon(48.0, -68.0), LatLon(48.05, -68.1)
+    assert abs(vincenty(p0, p1) - expected[0].distanceTo(expected[1])) < 1e-6
+    assert abs(get_gps_bearing(p0, p1) - expected[0].initialBearingTo(expected[1])) < 1e-6